@@ -4,6 +4,7 @@ from jax import lax
 from jax import jacfwd
 from distrax import MultivariateNormalFullCovariance as MVN
 from ssm_jax.nlgssm.containers import NLGSSMPosterior
+from ssm_jax.utils import mask_missing_emission
 
 
 # Helper functions
@@ -73,14 +74,69 @@ def _condition_on(m, P, h, H, R, u, y):
     return mu_cond, Sigma_cond
 
 
-def extended_kalman_filter(params, emissions, inputs=None):
+def _condition_on_diagonal(m, P, h, H, R_diag, u, y):
+    """Condition a Gaussian potential on a new observation with a diagonal
+    emission covariance, one observation dimension at a time. The emission
+    function is linearized once at the prior mean, as in `_condition_on`, so
+    this gives the same result with rank-one updates instead of a
+    D_obs x D_obs solve.
+
+    Args:
+         m (D_hid,): prior mean.
+         P (D_hid,D_hid): prior covariance.
+         h (Callable): emission function.
+         H (Callable): Jacobian of emission function.
+         R_diag (D_obs,): diagonal of the emission covariance matrix.
+         u (D_in,): inputs.
+         y (D_obs,): observation.
+
+     Returns:
+         mu_cond (D_hid,): filtered mean.
+         Sigma_cond (D_hid,D_hid): filtered covariance.
+         ll: log likelihood of y.
+    """
+    H_x = jnp.atleast_2d(H(m, u))
+    yhat = jnp.atleast_1d(h(m, u))
+
+    def _step(carry, args):
+        ll, mm, PP = carry
+        H_i, r, y_i, yhat_i = args
+        PH = PP @ H_i
+        s = H_i @ PH + r
+        k = PH / s
+        # Residual of the linearized emission function around m
+        resid = y_i - yhat_i - H_i @ (mm - m)
+        ll += -0.5 * (jnp.log(2 * jnp.pi * s) + resid**2 / s)
+        # Joseph form (I - k H_i) PP (I - k H_i)^T + r k k^T, in O(D_hid^2)
+        KP = PP - jnp.outer(k, H_i @ PP)
+        PP = KP - jnp.outer(KP @ H_i, k) + r * jnp.outer(k, k)
+        return (ll, mm + k * resid, 0.5 * (PP + PP.T)), None
+
+    (ll, mu_cond, Sigma_cond), _ = lax.scan(_step, (0.0, m, P), (H_x, R_diag, jnp.atleast_1d(y), yhat))
+    return mu_cond, Sigma_cond, ll
+
+
+def _mask_emission_fns(h, H, R, y):
+    """Zero out the emission function, its Jacobian and the emission covariance
+    on the missing (NaN) entries of y. See `ssm_jax.utils.mask_missing_emission`."""
+    observed, y, R, ll_correction = mask_missing_emission(y, R)
+    h_masked = lambda x, u: jnp.where(observed, jnp.atleast_1d(h(x, u)), 0.0)
+    H_masked = lambda x, u: jnp.where(observed[:, None], jnp.atleast_2d(H(x, u)), 0.0)
+    return h_masked, H_masked, R, y, ll_correction
+
+
+def extended_kalman_filter(params, emissions, inputs=None, diagonal_emission_covariance=False):
     """Run an extended Kalman filter to produce the marginal likelihood and
-    filtered state estimates.
+    filtered state estimates. Missing entries of the emissions (NaN) are
+    skipped.
 
     Args:
         params: an NLGSSMParams instance (or object with the same fields)
         emissions (T,D_hid): array of observations.
         inputs (T,D_in): array of inputs.
+        diagonal_emission_covariance (bool): whether the emission covariance is
+            diagonal, in which case the emission dimensions are processed one
+            at a time with rank-one updates.
 
     Returns:
         filtered_posterior: LGSSMPosterior instance containing,
@@ -104,12 +160,21 @@ def extended_kalman_filter(params, emissions, inputs=None):
         u = inputs[t]
         y = emissions[t]
 
-        # Update the log likelihood
-        H_x = H(pred_mean, u)
-        ll += MVN(h(pred_mean, u), H_x @ pred_cov @ H_x.T + R).log_prob(jnp.atleast_1d(y))
-
-        # Condition on this emission
-        filtered_mean, filtered_cov = _condition_on(pred_mean, pred_cov, h, H, R, u, y)
+        # Only condition on the observed (non-NaN) entries of this emission
+        h_t, H_t, R, y, ll_correction = _mask_emission_fns(h, H, R, y)
+        ll += ll_correction
+
+        if diagonal_emission_covariance:
+            # Condition on one emission dimension at a time
+            filtered_mean, filtered_cov, ll_t = _condition_on_diagonal(pred_mean, pred_cov, h_t, H_t, jnp.diag(R), u, y)
+            ll += ll_t
+        else:
+            # Update the log likelihood
+            H_x = H_t(pred_mean, u)
+            ll += MVN(h_t(pred_mean, u), H_x @ pred_cov @ H_x.T + R).log_prob(y)
+
+            # Condition on this emission
+            filtered_mean, filtered_cov = _condition_on(pred_mean, pred_cov, h_t, H_t, R, u, y)
 
         # Predict the next state
         pred_mean, pred_cov = _predict(filtered_mean, filtered_cov, f, F, Q, u)
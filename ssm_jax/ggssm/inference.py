@@ -5,6 +5,7 @@ from jax import numpy as jnp
 from jax import lax
 from distrax import MultivariateNormalFullCovariance as MVN
 from ssm_jax.ggssm.containers import GGSSMPosterior
+from ssm_jax.utils import mask_missing_emission
 
 
 # Helper functions
@@ -88,6 +89,10 @@ def _condition_on(m, P, h, R, u, y, g_ev, g_cov):
 
 
 def general_gaussian_filter(params, emissions, inputs=None):
+    """Run a general Gaussian filter.
+
+    Missing entries of the emissions (NaN) are skipped.
+    """
     num_timesteps = len(emissions)
     
     # Process dynamics and emission functions to take in control inputs
@@ -108,9 +113,13 @@ def general_gaussian_filter(params, emissions, inputs=None):
         u = inputs[t]
         y = emissions[t]
 
+        # Only condition on the observed (non-NaN) entries of this emission
+        observed, y, R, ll_correction = mask_missing_emission(y, R)
+        h_t = lambda x, u: jnp.where(observed, jnp.atleast_1d(h(x, u)), 0.0)
+
         # Condition on the emission
-        log_likelihood, filtered_mean, filtered_cov = _condition_on(pred_mean, pred_cov, h, R, u, y, g_ev, g_cov)
-        ll += log_likelihood
+        log_likelihood, filtered_mean, filtered_cov = _condition_on(pred_mean, pred_cov, h_t, R, u, y, g_ev, g_cov)
+        ll += log_likelihood + ll_correction
 
         # Predict the next state
         pred_mean, pred_cov, _ = _predict(filtered_mean, filtered_cov, f, Q, u, g_ev, g_cov)
@@ -1,8 +1,9 @@
 import jax.numpy as jnp
 
+from ssm_jax.ggssm.inference import general_gaussian_filter
 from ssm_jax.ggssm.inference import general_gaussian_smoother
 from ssm_jax.ggssm.containers import EKFParams, UKFParams
-from ssm_jax.ekf.inference import extended_kalman_smoother
+from ssm_jax.ekf.inference import extended_kalman_filter, extended_kalman_smoother
 from ssm_jax.ukf.inference import unscented_kalman_smoother, UKFHyperParams
 from ssm_jax.nlgssm.inference_test import random_args
 
@@ -58,3 +59,23 @@ def test_ukf(key=0, num_timesteps=15):
     assert _all_close(ukf_post.filtered_covariances, ggf_post.filtered_covariances)
     assert _all_close(ukf_post.smoothed_means, ggf_post.smoothed_means)
     assert _all_close(ukf_post.smoothed_covariances, ggf_post.smoothed_covariances)
+
+
+def test_missing_emissions(key=0, num_timesteps=15):
+    nlgssm, _, emissions = random_args(key=key, num_timesteps=num_timesteps, emission_dim=3, linear=False)
+    emissions = emissions.at[::3, 1].set(jnp.nan).at[4].set(jnp.nan)
+    ekf_params = EKFParams(
+        initial_mean = nlgssm.initial_mean,
+        initial_covariance = nlgssm.initial_covariance,
+        dynamics_function = nlgssm.dynamics_function,
+        dynamics_covariance = nlgssm.dynamics_covariance,
+        emission_function = nlgssm.emission_function,
+        emission_covariance = nlgssm.emission_covariance,
+    )
+
+    # Missing entries are skipped in the same way as in the EKF
+    ekf_post = extended_kalman_filter(nlgssm, emissions)
+    ggf_post = general_gaussian_filter(ekf_params, emissions)
+    assert _all_close(ekf_post.marginal_loglik, ggf_post.marginal_loglik)
+    assert _all_close(ekf_post.filtered_means, ggf_post.filtered_means)
+    assert _all_close(ekf_post.filtered_covariances, ggf_post.filtered_covariances)
@@ -0,0 +1,72 @@
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from jax.core import Tracer
+from jax.tree_util import tree_leaves
+
+
+def fingerprint(tree):
+    """Hash the dtypes, shapes and contents of all arrays in a PyTree.
+    The leaves must be concrete (not traced).
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for leaf in tree_leaves(tree):
+        leaf = np.asarray(leaf)
+        h.update(str((leaf.dtype, leaf.shape)).encode())
+        h.update(np.ascontiguousarray(leaf).tobytes())
+    return h.hexdigest()
+
+
+class ConditionalLoglikCache:
+    """An LRU cache of the (T, K) conditional log likelihoods of an HMM.
+
+    Entries are keyed on a fingerprint of the model parameters and one of
+    the emissions, so updating the parameters (e.g. by EM) never returns a
+    stale value. The least recently used entries are evicted once the cached
+    arrays take up more than `max_bytes`.
+
+    Lookups are skipped when the parameters or emissions are traced, i.e.
+    inside `jit`, `vmap` or `grad`, where the cache could not be consulted.
+    """
+
+    def __init__(self, max_bytes=2**28):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def get_or_compute(self, params, emissions, compute_fn):
+        """Return `compute_fn(emissions)`, from the cache if possible.
+
+        Args:
+            params: PyTree of the parameters the log likelihoods depend on.
+            emissions: (T, ...) emissions.
+            compute_fn: function mapping emissions to (T, K) log likelihoods.
+        """
+        if any(isinstance(leaf, Tracer) for leaf in tree_leaves((params, emissions))):
+            return compute_fn(emissions)
+
+        key = (fingerprint(params), fingerprint(emissions))
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        log_likelihoods = compute_fn(emissions)
+        if log_likelihoods.nbytes <= self.max_bytes:
+            self._entries[key] = log_likelihoods
+            self.nbytes += log_likelihoods.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return log_likelihoods
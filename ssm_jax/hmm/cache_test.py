@@ -0,0 +1,49 @@
+import jax.numpy as jnp
+import jax.random as jr
+from jax import jit
+from ssm_jax.hmm.cache import ConditionalLoglikCache
+from ssm_jax.hmm.models.gaussian_hmm import GaussianHMM
+
+
+def test_loglik_cache(key=jr.PRNGKey(0), num_states=3, emission_dim=2, num_timesteps=20):
+    hmm = GaussianHMM.random_initialization(key, num_states, emission_dim)
+    _, emissions = hmm.sample(jr.PRNGKey(1), num_timesteps)
+    cache = hmm.enable_loglik_cache()
+
+    # All inference calls on the same emissions evaluate the emission model once
+    ll = hmm.marginal_log_prob(emissions)
+    post = hmm.smoother(emissions)
+    hmm.filter(emissions)
+    hmm.most_likely_states(emissions)
+    assert (cache.misses, cache.hits) == (1, 3)
+    assert jnp.allclose(post.marginal_loglik, ll)
+
+    # Updating the parameters invalidates the cached values
+    hmm.emission_means.value = hmm.emission_means.value + 1.0
+    ll2 = hmm.marginal_log_prob(emissions)
+    hmm.disable_loglik_cache()
+    assert cache.misses == 2
+    assert jnp.allclose(ll2, hmm.marginal_log_prob(emissions))
+
+    # Traced calls bypass the cache
+    cache = hmm.enable_loglik_cache()
+    jit(hmm.marginal_log_prob)(emissions)
+    assert len(cache) == 0
+
+    # The cache is not part of the PyTree
+    _, (_, _, hyper_values) = hmm.tree_flatten()
+    assert not any(isinstance(value, ConditionalLoglikCache) for value in hyper_values)
+
+
+def test_loglik_cache_eviction():
+    cache = ConditionalLoglikCache(max_bytes=2 * 10 * 3 * 4)
+    compute_fn = lambda emissions: jnp.zeros((10, 3), dtype=jnp.float32)
+    for i in range(3):
+        cache.get_or_compute(jnp.ones(2), i * jnp.ones(10), compute_fn)
+    assert len(cache) == 2
+    assert cache.nbytes == 2 * 10 * 3 * 4
+
+    # The least recently used entry was evicted
+    cache.get_or_compute(jnp.ones(2), 0 * jnp.ones(10), compute_fn)
+    cache.get_or_compute(jnp.ones(2), 2 * jnp.ones(10), compute_fn)
+    assert (cache.misses, cache.hits) == (4, 1)
@@ -1,8 +1,14 @@
 import chex
 import jax.numpy as jnp
 import jax.random as jr
+from jax import checkpoint
+from jax import jit
 from jax import lax
 from jax import vmap
+from jax.tree_util import tree_leaves
+from jax.tree_util import tree_map
+from ssm_jax.hmm.transitions import BandedTransitionMatrix
+from ssm_jax.hmm.transitions import TransitionOperator
 
 # Helper function to access parameters
 _get_params = lambda x, dim, t: x[t] if x.ndim == dim + 1 else x
@@ -29,6 +35,38 @@ class HMMPosterior:
     trans_probs: chex.Array = None
 
 
+@chex.dataclass
+class HMMSuffStats:
+    """Expected sufficient statistics of an HMM posterior, summed over time.
+
+    marginal_loglik: log prob(obs(1:T) | params)
+    initial_probs(k) = p(hidden(1)=k | obs(1:T))
+    trans_probs(j,k) = \sum_t p(hidden(t)=j, hidden(t+1)=k | obs(1:T)), or
+        the unsummed (T-1,j,k) array for time-varying transition matrices
+    sum_w(k) = \sum_t p(hidden(t)=k | obs(1:T))
+    emission_stats: PyTree with leaves of shape (k, ...) equal to
+        \sum_t p(hidden(t)=k | obs(1:T)) stats(obs(t))
+    """
+
+    marginal_loglik: chex.Scalar = None
+    initial_probs: chex.Array = None
+    trans_probs: chex.Array = None
+    sum_w: chex.Array = None
+    emission_stats: chex.ArrayTree = None
+
+
+@chex.dataclass
+class HMMFilterState:
+    """State of a streaming HMM filter, carried between chunks of emissions.
+
+    predicted_probs(k) = p(hidden(t+1)=k | obs(1:t)) for the last step seen
+    marginal_loglik: log prob(obs(1:t) | params) for all steps seen so far
+    """
+
+    predicted_probs: chex.Array
+    marginal_loglik: chex.Scalar = 0.0
+
+
 def _normalize(u, axis=0, eps=1e-15):
     """Normalizes the values within the axis in a way that they sum up to 1.
 
@@ -66,20 +104,99 @@ def _condition_on(probs, ll):
 
 
 def _predict(probs, A):
+    if isinstance(A, TransitionOperator):
+        return A.predict(probs)
     return A.T @ probs
 
 
-def hmm_filter(initial_distribution, transition_matrix, log_likelihoods):
+def _backward_predict(probs, A):
+    """Compute A @ probs, i.e. propagate backward messages by one step."""
+    if isinstance(A, TransitionOperator):
+        return A.matvec(probs)
+    return A @ probs
+
+
+def _max_product(scores, A):
+    """Compute max_j log A[i,j] + scores[j] and the maximizing j for each i."""
+    if isinstance(A, TransitionOperator):
+        return A.max_product(scores)
+    scores = jnp.log(A) + scores
+    return jnp.max(scores, axis=1), jnp.argmax(scores, axis=1)
+
+
+def _as_dense(transition_matrix):
+    if isinstance(transition_matrix, TransitionOperator):
+        return transition_matrix.todense()
+    return transition_matrix
+
+
+def _mask_padding(x, length):
+    """Zero out the entries of `x` at time steps >= length, if a length is given."""
+    if length is None:
+        return x
+    return jnp.where((jnp.arange(len(x)) < length)[:, None], x, 0.0)
+
+
+def _scan(f, init, xs, checkpoint_every=None):
+    """Same as `lax.scan(f, init, xs)`, but optionally rematerialized in segments.
+
+    If `checkpoint_every` is given, the scan is split into segments of that many
+    steps and each segment is wrapped in `jax.checkpoint`. Reverse-mode
+    differentiation then only stores the carries at the segment boundaries and
+    recomputes the steps within one segment at a time, so with
+    checkpoint_every ~ sqrt(T) the memory for the scan residuals drops from
+    O(T K) to O(sqrt(T) K).
+    """
+    if checkpoint_every is None:
+        return lax.scan(f, init, xs)
+
+    num_steps = len(tree_leaves(xs)[0])
+    num_segments = -(-num_steps // checkpoint_every)
+    num_padded = num_segments * checkpoint_every
+
+    # Pad the last segment with steps that leave the carry unchanged
+    def _pad_and_reshape(x):
+        x = jnp.concatenate([x, jnp.repeat(x[-1:], num_padded - num_steps, axis=0)])
+        return x.reshape((num_segments, checkpoint_every) + x.shape[1:])
+
+    xs = tree_map(_pad_and_reshape, xs)
+    valid = (jnp.arange(num_padded) < num_steps).reshape(num_segments, checkpoint_every)
+
+    @checkpoint
+    def _segment(carry, args):
+        def _step(carry, args):
+            x, is_valid = args
+            new_carry, y = f(carry, x)
+            carry = tree_map(lambda a, b: jnp.where(is_valid, a, b), new_carry, carry)
+            return carry, y
+
+        return lax.scan(_step, carry, args)
+
+    carry, ys = lax.scan(_segment, init, (xs, valid))
+    ys = tree_map(lambda y: y.reshape((num_padded,) + y.shape[2:])[:num_steps], ys)
+    return carry, ys
+
+
+def hmm_filter(initial_distribution, transition_matrix, log_likelihoods, checkpoint_every=None, length=None):
     """Forwards filtering.
 
     Args:
         initial_distribution(k): prob(hid(1)=k)
-        transition_matrix(j,k): prob(hid(t)=k | hid(t-1)=j)
+        transition_matrix(j,k): prob(hid(t)=k | hid(t-1)=j). This may also be a
+            TransitionOperator, e.g. a BandedTransitionMatrix, in which case
+            each step costs whatever its `predict` costs.
         log_likelihoods(t,k): p(obs(t) | hid(t)=k)
+        checkpoint_every(int): if given, rematerialize the scan in segments of
+            this many steps to reduce the memory needed for gradients.
+        length(int): number of valid time steps if `log_likelihoods` is padded.
+            The padded steps carry no evidence, so the marginal likelihood is
+            that of the first `length` steps and the filtered probabilities
+            beyond it are predictions.
 
     Returns: HMMPosterior object (smoothed_probs=None)
     """
     num_timesteps, num_states = log_likelihoods.shape
+    log_likelihoods = _mask_padding(log_likelihoods, length)
 
     def _step(carry, t):
         log_normalizer, predicted_probs = carry
@@ -97,7 +214,105 @@ def hmm_filter(initial_distribution, transition_matrix, log_likelihoods):
         return (log_normalizer, predicted_probs_next), (filtered_probs, predicted_probs)
 
     carry = (0.0, initial_distribution)
-    (log_normalizer, _), (filtered_probs, predicted_probs) = lax.scan(_step, carry, jnp.arange(num_timesteps))
+    (log_normalizer, _), (filtered_probs, predicted_probs) = _scan(_step, carry, jnp.arange(num_timesteps),
+                                                                   checkpoint_every)
+
+    post = HMMPosterior(marginal_loglik=log_normalizer, filtered_probs=filtered_probs, predicted_probs=predicted_probs)
+    return post
+
+
+def hmm_filter_init(initial_distribution):
+    """Initialize the state of a streaming HMM filter.
+
+    Args:
+        initial_distribution(k): prob(hid(1)=k)
+
+    Returns: HMMFilterState object
+    """
+    return HMMFilterState(predicted_probs=initial_distribution, marginal_loglik=0.0)
+
+
+@jit
+def hmm_filter_update(state, transition_matrix, log_likelihoods):
+    """Advance a streaming HMM filter by a chunk of emissions. Running this on
+    consecutive chunks gives the same results as `hmm_filter` on the whole
+    sequence, and the cost of each call only depends on the chunk length.
+
+    Args:
+        state: HMMFilterState from `hmm_filter_init` or a previous update.
+        transition_matrix(j,k): prob(hid(t)=k | hid(t-1)=j), or an array of
+            shape (t,j,k) with one matrix per step in the chunk.
+        log_likelihoods(t,k): p(obs(t) | hid(t)=k) for the steps in the chunk.
+
+    Returns:
+        state: updated HMMFilterState.
+        post: HMMPosterior object with filtered and predicted probabilities for
+            the steps in the chunk, and the running marginal log likelihood.
+    """
+    num_timesteps = log_likelihoods.shape[0]
+    post = hmm_filter(state.predicted_probs, transition_matrix, log_likelihoods)
+
+    # Predict the state after the last step in the chunk
+    A = _get_params(transition_matrix, 2, num_timesteps - 1)
+    predicted_probs_next = _predict(post.filtered_probs[-1], A)
+    marginal_loglik = state.marginal_loglik + post.marginal_loglik
+
+    state = HMMFilterState(predicted_probs=predicted_probs_next, marginal_loglik=marginal_loglik)
+    post.marginal_loglik = marginal_loglik
+    return state, post
+
+
+def hmm_filter_parallel(initial_distribution, transition_matrix, log_likelihoods):
+    """Forwards filtering with a parallel (associative) scan over time.
+
+    Each time step is represented by a matrix of conditional state probabilities
+    and a vector of log normalizers,
+        A(i,k) = p(hid(t)=k | hid(s-1)=i, obs(s:t))
+        log_z(i) = log p(obs(s:t) | hid(s-1)=i)
+    Adjacent segments are combined by marginalizing over the state at their
+    boundary, which is associative, so the whole sequence is processed in
+    O(log T) depth rather than O(T).
+
+    Args:
+        initial_distribution(k): prob(hid(1)=k)
+        transition_matrix(j,k): prob(hid(t)=k | hid(t-1)=j)
+        log_likelihoods(t,k): p(obs(t) | hid(t)=k)
+
+    Returns: HMMPosterior object (smoothed_probs=None)
+    """
+    transition_matrix = _as_dense(transition_matrix)
+    num_timesteps, num_states = log_likelihoods.shape
+    transition_matrices = vmap(lambda t: _get_params(transition_matrix, 2, t))(jnp.arange(num_timesteps - 1))
+
+    @vmap
+    def _combine(elem1, elem2):
+        A1, log_z1 = elem1
+        A2, log_z2 = elem2
+
+        # Marginalize over the state at the boundary, being careful not to underflow.
+        log_z2_max = log_z2.max()
+        weights = A1 * jnp.exp(log_z2 - log_z2_max)
+        norm = weights.sum(axis=1)
+        norm = jnp.where(norm == 0, 1, norm)
+        A = (weights / norm[:, None]) @ A2
+        log_z = log_z1 + jnp.log(norm) + log_z2_max
+        return A, log_z
+
+    # The first element does not depend on the previous state, so all its rows are the same
+    filtered_probs, log_norm = _condition_on(initial_distribution, log_likelihoods[0])
+    initial_element = (jnp.tile(filtered_probs, (num_states, 1)), jnp.repeat(log_norm, num_states))
+
+    # The remaining elements condition each row of the transition matrix on the emission
+    generic_elements = vmap(vmap(_condition_on, (0, None)))(transition_matrices, log_likelihoods[1:])
+
+    elements = tree_map(lambda x0, x: jnp.concatenate([x0[None], x]), initial_element, generic_elements)
+    cumulative_probs, cumulative_log_norms = lax.associative_scan(_combine, elements)
+    filtered_probs = cumulative_probs[:, 0]
+    log_normalizer = cumulative_log_norms[-1, 0]
+
+    # Recover the one-step-ahead predictions from the filtered probabilities
+    predicted_probs = jnp.concatenate(
+        [initial_distribution[None], vmap(_predict)(filtered_probs[:-1], transition_matrices)])
 
     post = HMMPosterior(marginal_loglik=log_normalizer, filtered_probs=filtered_probs, predicted_probs=predicted_probs)
     return post
@@ -129,7 +344,7 @@ def hmm_posterior_sample(rng, initial_distribution, transition_matrix, log_likel
         A = _get_params(transition_matrix, 2, t)
 
         # Fold in the next state and renormalize
-        smoothed_probs = filtered_probs * A[:, next_state]
+        smoothed_probs = filtered_probs * _backward_predict(jnp.zeros(num_states).at[next_state].set(1.0), A)
         smoothed_probs /= smoothed_probs.sum()
 
         # Sample current state
@@ -173,7 +388,7 @@ def hmm_backward_filter(transition_matrix, log_likelihoods):
         # Update the log normalizer.
         log_normalizer += log_norm
         # Predict the next state (going backward in time).
-        next_backward_pred_probs = _predict(backward_filt_probs, A.T)
+        next_backward_pred_probs = _backward_predict(backward_filt_probs, A)
         return (log_normalizer, next_backward_pred_probs), backward_pred_probs
 
     carry = (0.0, jnp.ones(num_states))
@@ -182,7 +397,7 @@ def hmm_backward_filter(transition_matrix, log_likelihoods):
     return log_normalizer, backward_pred_probs
 
 
-def hmm_two_filter_smoother(initial_distribution, transition_matrix, log_likelihoods):
+def hmm_two_filter_smoother(initial_distribution, transition_matrix, log_likelihoods, length=None):
     """Computed the smoothed state probabilities using the two-filter
     smoother, a.k.a. the forward-backward algorithm.
 
@@ -190,21 +405,23 @@ def hmm_two_filter_smoother(initial_distribution, transition_matrix, log_likelih
         initial_distribution (_type_): _description_
         transition_matrix (_type_): _description_
         log_likelihoods (_type_): _description_
+        length(int): number of valid time steps if `log_likelihoods` is padded.
+            The smoothed probabilities are zero at the padded steps.
 
     Returns:
         HMMPosterior object
     """
     # Run the filters forward and backward
-    post = hmm_filter(initial_distribution, transition_matrix, log_likelihoods)
+    post = hmm_filter(initial_distribution, transition_matrix, log_likelihoods, length=length)
     ll = post.marginal_loglik
     filtered_probs, predicted_probs = post.filtered_probs, post.predicted_probs
 
-    _, backward_pred_probs = hmm_backward_filter(transition_matrix, log_likelihoods)
+    _, backward_pred_probs = hmm_backward_filter(transition_matrix, _mask_padding(log_likelihoods, length))
 
     # Compute smoothed probabilities
     smoothed_probs = filtered_probs * backward_pred_probs
     norm = smoothed_probs.sum(axis=1, keepdims=True)
-    smoothed_probs /= norm
+    smoothed_probs = _mask_padding(smoothed_probs / norm, length)
 
     return HMMPosterior(
         marginal_loglik=ll,
@@ -214,7 +431,7 @@ def hmm_two_filter_smoother(initial_distribution, transition_matrix, log_likelih
     )
 
 
-def hmm_smoother(initial_distribution, transition_matrix, log_likelihoods):
+def hmm_smoother(initial_distribution, transition_matrix, log_likelihoods, checkpoint_every=None, length=None):
     """Computed the smoothed state probabilities using a general
     Bayesian smoother.
 
@@ -225,6 +442,12 @@ def hmm_smoother(initial_distribution, transition_matrix, log_likelihoods):
         initial_distribution (_type_): _description_
         transition_matrix (_type_): _description_
         log_likelihoods (_type_): _description_
+        checkpoint_every(int): if given, rematerialize the forward and backward
+            scans in segments of this many steps to reduce the memory needed
+            for gradients.
+        length(int): number of valid time steps if `log_likelihoods` is padded.
+            The smoothed probabilities are zero at the padded steps, so that
+            statistics computed from them ignore the padding.
 
     Returns:
         HMMPosterior object
@@ -232,7 +455,7 @@ def hmm_smoother(initial_distribution, transition_matrix, log_likelihoods):
     num_timesteps, num_states = log_likelihoods.shape
 
     # Run the HMM filter
-    post = hmm_filter(initial_distribution, transition_matrix, log_likelihoods)
+    post = hmm_filter(initial_distribution, transition_matrix, log_likelihoods, checkpoint_every, length)
     ll = post.marginal_loglik
     filtered_probs, predicted_probs = post.filtered_probs, post.predicted_probs
 
@@ -247,7 +470,7 @@ def hmm_smoother(initial_distribution, transition_matrix, log_likelihoods):
 
         # Fold in the next state (Eq. 8.2 of Saarka, 2013)
         relative_probs_next = smoothed_probs_next / predicted_probs_next
-        smoothed_probs = filtered_probs * (A @ relative_probs_next)
+        smoothed_probs = filtered_probs * _backward_predict(relative_probs_next, A)
         smoothed_probs /= smoothed_probs.sum()
 
         return smoothed_probs, smoothed_probs
@@ -255,10 +478,11 @@ def hmm_smoother(initial_distribution, transition_matrix, log_likelihoods):
     # Run the HMM smoother
     carry = filtered_probs[-1]
     args = (jnp.arange(num_timesteps - 2, -1, -1), filtered_probs[:-1][::-1], predicted_probs[1:][::-1])
-    _, rev_smoothed_probs = lax.scan(_step, carry, args)
+    _, rev_smoothed_probs = _scan(_step, carry, args, checkpoint_every)
 
     # Reverse the arrays and return
     smoothed_probs = jnp.row_stack([rev_smoothed_probs[::-1], filtered_probs[-1]])
+    smoothed_probs = _mask_padding(smoothed_probs, length)
 
     return HMMPosterior(
         marginal_loglik=ll,
@@ -268,99 +492,266 @@ def hmm_smoother(initial_distribution, transition_matrix, log_likelihoods):
     )
 
 
-def hmm_fixed_lag_smoother(initial_distribution, transition_matrix, log_likelihoods, window_size):
-    """Compute the smoothed state probabilities using the fixed-lag smoother.
+def hmm_expected_statistics(initial_distribution,
+                            transition_matrix,
+                            log_likelihoods,
+                            emissions=None,
+                            emission_statistics_fn=None,
+                            length=None,
+                            reduce_sum=True,
+                            per_state_statistics=False):
+    """Compute the expected sufficient statistics of the posterior without
+    storing the smoothed or pairwise posterior marginals.
+
+    This runs the same backward pass as `hmm_smoother`, but accumulates the
+    expected initial state, transition counts, state occupancies and
+    emission statistics in the scan carry. Only the (T,K) forward messages
+    are kept in memory.
 
     Args:
         initial_distribution(k): prob(hid(1)=k)
         transition_matrix(j,k): prob(hid(t)=k | hid(t-1)=j)
         log_likelihoods(t,k): p(obs(t) | hid(t)=k)
-        window_size(int): size of smoothed window
+        emissions(t,...): observations, passed one time step at a time to
+            `emission_statistics_fn`.
+        emission_statistics_fn: function mapping a single emission to a PyTree
+            of statistics, which are summed over time weighted by the posterior
+            probability of each state.
+        length(int): number of valid time steps if the inputs are padded.
+        reduce_sum(bool): whether to sum the transition probabilities over time.
+        per_state_statistics(bool): whether the leaves returned by
+            `emission_statistics_fn` have a leading (K,) axis, i.e. the
+            statistics depend on the state (as for mixture emissions).
 
     Returns:
-        HMMPosterior object
+        HMMSuffStats object
     """
     num_timesteps, num_states = log_likelihoods.shape
+    valid = jnp.arange(num_timesteps) < (num_timesteps if length is None else length)
 
-    def _step(carry, t):
-        # Unpack the inputs
-        log_normalizers, filtered_probs, predicted_probs, bmatrices = carry
+    # Run the HMM filter
+    post = hmm_filter(initial_distribution, transition_matrix, log_likelihoods, length=length)
+    filtered_probs, predicted_probs = post.filtered_probs, post.predicted_probs
+
+    def _emission_stats(weights, emission):
+        if emission_statistics_fn is None:
+            return None
+        subscripts = "k,k...->k..." if per_state_statistics else "k,...->k..."
+        return tree_map(lambda x: jnp.einsum(subscripts, weights, x), emission_statistics_fn(emission))
+
+    # Run the smoother backward in time, accumulating statistics as we go
+    def _step(carry, args):
+        smoothed_probs_next, sum_trans_probs, sum_w, sum_emission_stats = carry
+        t, filtered_probs, predicted_probs_next, emission = args
 
         # Get parameters for time t
-        A_fwd = _get_params(transition_matrix, 2, t - 1)
-        A_bwd = _get_params(transition_matrix, 2, t)
-        ll = log_likelihoods[t]
+        A = _get_params(transition_matrix, 2, t)
+
+        # Fold in the next state (Eq. 8.2 of Saarka, 2013)
+        relative_probs_next = smoothed_probs_next / predicted_probs_next
+        smoothed_probs = filtered_probs * _backward_predict(relative_probs_next, A)
+        smoothed_probs /= smoothed_probs.sum()
 
-        # Shift window forward by 1
-        log_normalizers = log_normalizers[1:]
-        predicted_probs = predicted_probs[1:]
-        filtered_probs = filtered_probs[1:]
-        bmatrices = bmatrices[1:]
+        # Accumulate the statistics of the valid time steps
+        weights = smoothed_probs * valid[t]
+        trans_probs = _smoothed_transition_probs(filtered_probs, relative_probs_next, A) * valid[t + 1]
+        sum_w += weights
+        sum_emission_stats = tree_map(jnp.add, sum_emission_stats, _emission_stats(weights, emission))
+        if reduce_sum:
+            sum_trans_probs += trans_probs
+            trans_probs = None
+        return (smoothed_probs, sum_trans_probs, sum_w, sum_emission_stats), trans_probs
+
+    # Initialize with the last time step
+    weights = filtered_probs[-1] * valid[-1]
+    emissions = jnp.zeros((num_timesteps, 0)) if emissions is None else emissions
+    emission = tree_map(lambda x: x[-1], emissions)
+    if isinstance(transition_matrix, BandedTransitionMatrix):
+        sum_trans_probs = jnp.zeros((num_states, len(transition_matrix.offsets)))
+    else:
+        sum_trans_probs = jnp.zeros((num_states, num_states))
+    carry = (filtered_probs[-1], sum_trans_probs, weights, _emission_stats(weights, emission))
+    args = (jnp.arange(num_timesteps - 2, -1, -1),
+            filtered_probs[:-1][::-1],
+            predicted_probs[1:][::-1],
+            tree_map(lambda x: x[:-1][::-1], emissions))
+    (smoothed_probs, sum_trans_probs, sum_w, sum_emission_stats), rev_trans_probs = lax.scan(_step, carry, args)
+
+    trans_probs = sum_trans_probs if reduce_sum else rev_trans_probs[::-1]
+    if isinstance(transition_matrix, BandedTransitionMatrix):
+        trans_probs = BandedTransitionMatrix(trans_probs, transition_matrix.offsets)
+
+    return HMMSuffStats(marginal_loglik=post.marginal_loglik,
+                        initial_probs=smoothed_probs,
+                        trans_probs=trans_probs,
+                        sum_w=sum_w,
+                        emission_stats=sum_emission_stats)
+
+
+def hmm_smoother_parallel(initial_distribution, transition_matrix, log_likelihoods):
+    """Computed the smoothed state probabilities with parallel (associative)
+    scans over time, running in O(log T) depth.
+
+    The forward pass is `hmm_filter_parallel`. The backward pass composes the
+    reverse-time conditionals
+        E(j,i) = p(hid(t)=i | hid(t+1)=j, obs(1:t))
+    with an associative scan, starting from the final filtered distribution.
 
-        # Perform forward operation
-        predicted_probs_next = _predict(filtered_probs[-1], A_fwd)
-        filtered_probs_next, log_norm = _condition_on(predicted_probs_next, ll)
-        log_normalizers = jnp.concatenate((log_normalizers, jnp.array([log_norm])))
-        filtered_probs = jnp.concatenate((filtered_probs, jnp.array([filtered_probs_next])))
-        predicted_probs = jnp.concatenate((predicted_probs, jnp.array([predicted_probs_next])))
+    Args:
+        initial_distribution(k): prob(hid(1)=k)
+        transition_matrix(j,k): prob(hid(t)=k | hid(t-1)=j)
+        log_likelihoods(t,k): p(obs(t) | hid(t)=k)
+
+    Returns:
+        HMMPosterior object
+    """
+    transition_matrix = _as_dense(transition_matrix)
+    num_timesteps, num_states = log_likelihoods.shape
+    transition_matrices = vmap(lambda t: _get_params(transition_matrix, 2, t))(jnp.arange(num_timesteps - 1))
+
+    # Run the parallel HMM filter
+    post = hmm_filter_parallel(initial_distribution, transition_matrix, log_likelihoods)
+    ll = post.marginal_loglik
+    filtered_probs, predicted_probs = post.filtered_probs, post.predicted_probs
 
-        # Smooth inside the window in parallel
-        def update_bmatrix(bmatrix):
-            return (bmatrix @ A_bwd) * jnp.exp(ll)
+    @vmap
+    def _backward_element(filtered_probs, A):
+        # Fold in the next state (Eq. 8.2 of Saarka, 2013)
+        joint_probs = filtered_probs[:, None] * A
+        norm = joint_probs.sum(axis=0)
+        norm = jnp.where(norm == 0, 1, norm)
+        return (joint_probs / norm).T
 
-        bmatrices = vmap(update_bmatrix)(bmatrices)
-        bmatrices = jnp.concatenate((bmatrices, jnp.eye(num_states)[None, :]))
+    @vmap
+    def _combine(E_next, E):
+        return E_next @ E
 
-        # Compute beta values by row-summing bmatrices
-        def compute_beta(bmatrix):
-            beta = bmatrix.sum(axis=1)
-            return jnp.where(beta.sum(), beta / beta.sum(), beta)
+    # The last element does not depend on the next state, so all its rows are the same
+    final_element = jnp.tile(filtered_probs[-1], (num_states, 1))
+    elements = jnp.concatenate([_backward_element(filtered_probs[:-1], transition_matrices), final_element[None]])
+    smoothed_probs = lax.associative_scan(_combine, elements, reverse=True)[:, 0]
+
+    return HMMPosterior(
+        marginal_loglik=ll,
+        filtered_probs=filtered_probs,
+        predicted_probs=predicted_probs,
+        smoothed_probs=smoothed_probs,
+    )
 
-        betas = vmap(compute_beta)(bmatrices)
 
-        # Compute posterior values
-        def compute_posterior(filtered_probs, beta):
-            smoothed_probs = filtered_probs * beta
-            return jnp.where(smoothed_probs.sum(), smoothed_probs / smoothed_probs.sum(), smoothed_probs)
+def hmm_fixed_lag_smoother(initial_distribution, transition_matrix, log_likelihoods, window_size, lag_only=False):
+    """Compute the smoothed state probabilities using the fixed-lag smoother.
 
-        smoothed_probs = vmap(compute_posterior, (0, 0))(filtered_probs, betas)
+    The log normalizers, filtered and predicted probabilities of the last
+    `window_size` steps are kept in fixed-size ring buffers. At each step the
+    backward smoothing pass is re-run over the window, which costs O(W K^2).
 
-        post = HMMPosterior(
+    Args:
+        initial_distribution(k): prob(hid(1)=k)
+        transition_matrix(j,k): prob(hid(t)=k | hid(t-1)=j)
+        log_likelihoods(t,k): p(obs(t) | hid(t)=k)
+        window_size(int): size of smoothed window
+        lag_only(bool): if True, only return the lag-smoothed marginal of each
+            step instead of the whole window at every step.
+
+    Returns:
+        HMMPosterior object. If `lag_only` is False, each field has a time axis
+        and a window axis, e.g. smoothed_probs(t,w,k) = p(hid(t-W+1+w)=k | obs(1:t)),
+        padded with zeros before the start of the sequence, and marginal_loglik(t)
+        is the sum of the log normalizers in the window. If `lag_only` is True,
+            marginal_loglik = log prob(obs(1:T))
+            filtered_probs(t,k) = p(hid(t)=k | obs(1:t))
+            predicted_probs(t,k) = p(hid(t)=k | obs(1:t-1))
+            smoothed_probs(t,k) = p(hid(t)=k | obs(1:min(t+W-1,T)))
+    """
+    num_timesteps, num_states = log_likelihoods.shape
+
+    def _smooth_window(t, filtered_probs, predicted_probs):
+        # Run the smoother backward over the window ending at time t
+        def _step(smoothed_probs_next, k):
+            slot = (t + 1 + k) % window_size
+            A = _get_params(transition_matrix, 2, t - window_size + 1 + k)
+            predicted_probs_next = predicted_probs[(slot + 1) % window_size]
+
+            # Fold in the next state (Eq. 8.2 of Saarka, 2013), leaving the
+            # zero padding before the start of the sequence untouched
+            relative_probs_next = jnp.where(predicted_probs_next > 0, smoothed_probs_next / predicted_probs_next, 0)
+            smoothed_probs = filtered_probs[slot] * _backward_predict(relative_probs_next, A)
+            norm = smoothed_probs.sum()
+            smoothed_probs = jnp.where(norm > 0, smoothed_probs / norm, smoothed_probs)
+            return smoothed_probs, smoothed_probs
+
+        newest_probs = filtered_probs[t % window_size]
+        oldest_probs, rev_smoothed_probs = lax.scan(_step, newest_probs, jnp.arange(window_size - 2, -1, -1))
+        return oldest_probs, jnp.concatenate([rev_smoothed_probs[::-1], newest_probs[None]])
+
+    def _window_posterior(t, log_normalizers, filtered_probs, predicted_probs):
+        # Unroll the ring buffers into chronological order
+        order = (t + 1 + jnp.arange(window_size)) % window_size
+        _, smoothed_probs = _smooth_window(t, filtered_probs, predicted_probs)
+        return HMMPosterior(
             marginal_loglik=log_normalizers.sum(),
-            filtered_probs=filtered_probs,
-            predicted_probs=predicted_probs,
+            filtered_probs=filtered_probs[order],
+            predicted_probs=predicted_probs[order],
             smoothed_probs=smoothed_probs,
         )
 
-        return (log_normalizers, filtered_probs, predicted_probs, bmatrices), post
+    def _step(carry, t):
+        # Unpack the inputs
+        marginal_loglik, log_normalizers, filtered_probs, predicted_probs = carry
+
+        # Get parameters for time t
+        A = _get_params(transition_matrix, 2, t - 1)
+        ll = log_likelihoods[t]
+
+        # Perform forward operation, overwriting the oldest entry in the window
+        slot = t % window_size
+        predicted_probs_next = _predict(filtered_probs[(t - 1) % window_size], A)
+        filtered_probs_next, log_norm = _condition_on(predicted_probs_next, ll)
+        marginal_loglik += log_norm
+        log_normalizers = log_normalizers.at[slot].set(log_norm)
+        filtered_probs = filtered_probs.at[slot].set(filtered_probs_next)
+        predicted_probs = predicted_probs.at[slot].set(predicted_probs_next)
+        carry = (marginal_loglik, log_normalizers, filtered_probs, predicted_probs)
+
+        if lag_only:
+            lagged_probs, _ = _smooth_window(t, filtered_probs, predicted_probs)
+            return carry, (filtered_probs_next, predicted_probs_next, lagged_probs)
+        else:
+            return carry, _window_posterior(t, log_normalizers, filtered_probs, predicted_probs)
 
     # Filter on first observation
     ll = log_likelihoods[0]
     filtered_probs, log_norm = _condition_on(initial_distribution, ll)
 
-    # Reshape for lax.scan
-    filtered_probs = jnp.pad(jnp.expand_dims(filtered_probs, axis=0), ((window_size - 1, 0), (0, 0)))
-    predicted_probs = jnp.pad(jnp.expand_dims(initial_distribution, axis=0), ((window_size - 1, 0), (0, 0)))
-    log_normalizers = jnp.pad(jnp.array([log_norm]), (window_size - 1, 0))
-    bmatrices = jnp.pad(jnp.expand_dims(jnp.eye(num_states), axis=0), ((window_size - 1, 0), (0, 0), (0, 0)))
-
-    carry = (log_normalizers, filtered_probs, predicted_probs, bmatrices)
-    _, posts = lax.scan(_step, carry, jnp.arange(1, num_timesteps))
-
-    # Include initial values
-    marginal_loglik = jnp.concatenate((jnp.array([log_normalizers.sum()]), posts.marginal_loglik))
-    predicted_probs = jnp.concatenate((jnp.expand_dims(predicted_probs, axis=0), posts.predicted_probs))
-    smoothed_probs = jnp.concatenate((jnp.expand_dims(filtered_probs, axis=0), posts.smoothed_probs))
-    filtered_probs = jnp.concatenate((jnp.expand_dims(filtered_probs, axis=0), posts.filtered_probs))
-
-    posts = HMMPosterior(
-        marginal_loglik=marginal_loglik,
-        filtered_probs=filtered_probs,
-        predicted_probs=predicted_probs,
-        smoothed_probs=smoothed_probs,
+    # Initialize the ring buffers, with zeros before the start of the sequence
+    buffers = (
+        jnp.zeros(window_size).at[0].set(log_norm),
+        jnp.zeros((window_size, num_states)).at[0].set(filtered_probs),
+        jnp.zeros((window_size, num_states)).at[0].set(initial_distribution),
     )
+    carry, outputs = lax.scan(_step, (log_norm, *buffers), jnp.arange(1, num_timesteps))
+
+    if lag_only:
+        marginal_loglik, _, final_filtered_probs, final_predicted_probs = carry
+        all_filtered_probs, all_predicted_probs, lagged_probs = outputs
+
+        # The lagged marginals cover steps 0,...,T-W and the final window covers the rest
+        first_lagged_probs, _ = _smooth_window(0, *buffers[1:])
+        lagged_probs = jnp.concatenate([first_lagged_probs[None], lagged_probs])
+        _, final_window = _smooth_window(num_timesteps - 1, final_filtered_probs, final_predicted_probs)
+        smoothed_probs = jnp.concatenate([lagged_probs[window_size - 1:], final_window[1:]])[-num_timesteps:]
+
+        return HMMPosterior(
+            marginal_loglik=marginal_loglik,
+            filtered_probs=jnp.concatenate([filtered_probs[None], all_filtered_probs]),
+            predicted_probs=jnp.concatenate([initial_distribution[None], all_predicted_probs]),
+            smoothed_probs=smoothed_probs,
+        )
 
-    return posts
+    # Include initial values
+    post = _window_posterior(0, *buffers)
+    return tree_map(lambda x0, x: jnp.concatenate([x0[None], x]), post, outputs)
 
 
 def hmm_posterior_mode(initial_distribution, transition_matrix, log_likelihoods):
@@ -378,9 +769,7 @@ def hmm_posterior_mode(initial_distribution, transition_matrix, log_likelihoods)
     def _backward_pass(best_next_score, t):
         A = _get_params(transition_matrix, 2, t)
 
-        scores = jnp.log(A) + best_next_score + log_likelihoods[t + 1]
-        best_next_state = jnp.argmax(scores, axis=1)
-        best_next_score = jnp.max(scores, axis=1)
+        best_next_score, best_next_state = _max_product(best_next_score + log_likelihoods[t + 1], A)
         return best_next_score, best_next_state
 
     num_states = log_likelihoods.shape[1]
@@ -400,6 +789,109 @@ def hmm_posterior_mode(initial_distribution, transition_matrix, log_likelihoods)
     return jnp.concatenate([jnp.array([first_state]), states])
 
 
+def _max_plus_product(M1, M2):
+    """Max-plus matrix product, (M1 * M2)(i,k) = max_j M1(i,j) + M2(j,k)."""
+    return jnp.max(M1[:, :, None] + M2[None, :, :], axis=1)
+
+
+def _max_plus_scan(element_fn, num_elements, num_states, chunk_size=None):
+    """Compute the running max-plus products of a sequence of score matrices,
+    reduced over their first axis,
+        scores(t,k) = max_j (M(0) * M(1) * ... * M(t))(j,k)
+    where M(t) = element_fn(t) is a (K,K) matrix and * is the max-plus product.
+
+    Without chunking, all T score matrices are materialized and combined with
+    a single associative scan, which takes O(T K^2) memory. With chunking, the
+    matrices are built and combined one chunk at a time and only the reduced
+    (K,) scores are carried between chunks, which takes O(T K + C K^2) memory.
+
+    Args:
+        element_fn: function mapping a time index to a (K,K) score matrix.
+        num_elements(int): number of score matrices T.
+        num_states(int): number of states K.
+        chunk_size(int): optional number of time steps C to combine in parallel.
+
+    Returns:
+        scores(t,k)
+    """
+    combine = vmap(_max_plus_product)
+
+    if chunk_size is None:
+        elements = vmap(element_fn)(jnp.arange(num_elements))
+        return lax.associative_scan(combine, elements).max(axis=1)
+
+    # Pad the last chunk with max-plus identity matrices
+    identity = jnp.where(jnp.eye(num_states, dtype=bool), 0.0, -jnp.inf)
+    padded_element_fn = lambda t: jnp.where(t < num_elements, element_fn(t), identity)
+    num_chunks = -(-num_elements // chunk_size)
+
+    def _step(carry, ts):
+        prefixes = lax.associative_scan(combine, vmap(padded_element_fn)(ts))
+        scores = jnp.max(carry[None, :, None] + prefixes, axis=1)
+        return scores[-1], scores
+
+    ts = jnp.arange(num_chunks * chunk_size).reshape(num_chunks, chunk_size)
+    _, scores = lax.scan(_step, jnp.zeros(num_states), ts)
+    return scores.reshape(-1, num_states)[:num_elements]
+
+
+def hmm_posterior_mode_parallel(initial_distribution, transition_matrix, log_likelihoods, chunk_size=None):
+    """Compute the most likely state sequence with parallel (max-plus
+    associative) scans. This is a parallel version of the Viterbi algorithm.
+
+    The forward scan computes the best score of any path ending in each state,
+    and the backward scan computes the best score of any continuation from each
+    state. The most likely state at each time step maximizes their sum, so no
+    sequential backtrace is required.
+
+    Args:
+        initial_distribution(k): prob(hid(1)=k)
+        transition_matrix(j,k): prob(hid(t)=k | hid(t-1)=j)
+        log_likelihoods(t,k): p(obs(t) | hid(t)=k)
+        chunk_size(int): if given, scan over chunks of this many time steps,
+            combining the steps within each chunk in parallel. This reduces the
+            memory from O(T K^2) to O(T K + chunk_size K^2).
+
+    Returns:
+        map_state_seq(1:T)
+    """
+    transition_matrix = _as_dense(transition_matrix)
+    num_timesteps, num_states = log_likelihoods.shape
+
+    def _score_matrix(t):
+        # M(i,j) = log p(hid(t)=j | hid(t-1)=i) + log p(obs(t) | hid(t)=j)
+        log_A = jnp.where(t == 0,
+                          jnp.log(initial_distribution)[None, :],
+                          jnp.log(_get_params(transition_matrix, 2, t - 1)))
+        return log_A + log_likelihoods[t][None, :]
+
+    # Best score of a path ending in each state at time t
+    forward_scores = _max_plus_scan(_score_matrix, num_timesteps, num_states, chunk_size)
+
+    # Best score of the continuation from each state at time t, computed by
+    # running the same scan over the transposed score matrices in reverse
+    rev_backward_scores = _max_plus_scan(lambda s: _score_matrix(num_timesteps - 1 - s).T,
+                                         num_timesteps - 1, num_states, chunk_size)
+    backward_scores = jnp.concatenate([rev_backward_scores[::-1], jnp.zeros((1, num_states))])
+
+    return jnp.argmax(forward_scores + backward_scores, axis=1)
+
+
+def _smoothed_transition_probs(filtered_probs, relative_probs_next, A):
+    """Compute p(hid(t)=j, hid(t+1)=k | obs(1:T)) for a single time step (Eq. 8.4
+    of Saarka, 2013). For banded transition matrices, only the diagonals are
+    returned. Transitions into padded time steps have zero mass.
+    """
+    if isinstance(A, BandedTransitionMatrix):
+        smoothed_trans_probs = A.rescale(filtered_probs, relative_probs_next).diagonals
+    elif isinstance(A, TransitionOperator):
+        smoothed_trans_probs = A.rescale(filtered_probs, relative_probs_next)
+    else:
+        smoothed_trans_probs = filtered_probs[:, None] * A * relative_probs_next[None, :]
+    norm = smoothed_trans_probs.sum()
+    return smoothed_trans_probs / jnp.where(norm == 0, 1.0, norm)
+
+
 def _compute_sum_transition_probs(transition_matrix, hmm_posterior):
     """Compute the transition probabilities from the HMM posterior messages.
     Args:
@@ -415,16 +907,19 @@ def _compute_sum_transition_probs(transition_matrix, hmm_posterior):
 
         # Compute smoothed transition probabilities (Eq. 8.4 of Saarka, 2013)
         relative_probs_next = smoothed_probs_next / predicted_probs_next
-        smoothed_trans_probs = filtered_probs[:, None] * A * relative_probs_next[None, :]
-        smoothed_trans_probs /= smoothed_trans_probs.sum()
+        smoothed_trans_probs = _smoothed_transition_probs(filtered_probs, relative_probs_next, A)
         return carry + smoothed_trans_probs, None
 
     # Initialize the recursion
     num_states = transition_matrix.shape[-1]
     num_timesteps = len(hmm_posterior.filtered_probs)
+    if isinstance(transition_matrix, BandedTransitionMatrix):
+        init = jnp.zeros((num_states, len(transition_matrix.offsets)))
+    else:
+        init = jnp.zeros((num_states, num_states))
     sum_transition_probs, _ = lax.scan(
         _step,
-        jnp.zeros((num_states, num_states)),
+        init,
         (
             hmm_posterior.filtered_probs[:-1],
             hmm_posterior.smoothed_probs[1:],
@@ -432,6 +927,8 @@ def _compute_sum_transition_probs(transition_matrix, hmm_posterior):
             jnp.arange(num_timesteps - 1),
         ),
     )
+    if isinstance(transition_matrix, BandedTransitionMatrix):
+        return BandedTransitionMatrix(sum_transition_probs, transition_matrix.offsets)
     return sum_transition_probs
 
 
@@ -445,6 +942,10 @@ def _compute_all_transition_probs(transition_matrix, hmm_posterior):
     smoothed_probs_next = hmm_posterior.smoothed_probs[1:]
     predicted_probs_next = hmm_posterior.predicted_probs[1:]
     relative_probs_next = smoothed_probs_next / predicted_probs_next
+    if isinstance(transition_matrix, TransitionOperator):
+        num_timesteps = len(filtered_probs)
+        return vmap(lambda t: _get_params(transition_matrix, 2, t).rescale(filtered_probs[t], relative_probs_next[t]))(
+            jnp.arange(num_timesteps))
     transition_probs = filtered_probs[:, :, None] * transition_matrix * relative_probs_next[:, None, :]
     return transition_probs
 
@@ -463,6 +964,9 @@ def compute_transition_probs(transition_matrix, hmm_posterior, reduce_sum=True):
     Returns:
         array of transition probabilities. The shape is (num_states, num_states) if
             reduce_sum==True, otherwise (num_timesteps, num_states, num_states).
+            If `transition_matrix` is a BandedTransitionMatrix, the result is a
+            BandedTransitionMatrix with the same offsets; other TransitionOperators
+            give dense arrays.
     """
     if reduce_sum:
         return _compute_sum_transition_probs(transition_matrix, hmm_posterior)
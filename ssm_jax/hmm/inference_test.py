@@ -1,10 +1,13 @@
 import itertools as it
 
+import jax
 import jax.numpy as jnp
 import jax.random as jr
 import pytest
 import ssm_jax.hmm.inference as core
 from jax.scipy.special import logsumexp
+from ssm_jax.hmm.transitions import BandedTransitionMatrix
+from ssm_jax.hmm.transitions_test import random_transition_operator
 
 
 def big_log_joint(initial_probs, transition_matrix, log_likelihoods):
@@ -140,6 +143,213 @@ def test_hmm_smoother(key=0, num_timesteps=5, num_states=2):
         assert jnp.allclose(posterior.smoothed_probs[t], smoothed_probs_t, atol=1e-4)
 
 
+def test_hmm_filter_parallel(key=0, num_timesteps=100, num_states=5):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    args = random_hmm_args(key, num_timesteps, num_states, scale=10.0)
+
+    # Run the sequential and parallel HMM filters
+    posterior = core.hmm_filter(*args)
+    posterior_par = core.hmm_filter_parallel(*args)
+
+    assert jnp.allclose(posterior.marginal_loglik, posterior_par.marginal_loglik, rtol=1e-4)
+    assert jnp.allclose(posterior.filtered_probs, posterior_par.filtered_probs, atol=1e-4)
+    assert jnp.allclose(posterior.predicted_probs, posterior_par.predicted_probs, atol=1e-4)
+
+
+def test_hmm_smoother_parallel(key=0, num_timesteps=100, num_states=5):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    args = random_hmm_args(key, num_timesteps, num_states, scale=10.0)
+
+    # Run the sequential and parallel HMM smoothers
+    posterior = core.hmm_smoother(*args)
+    posterior_par = core.hmm_smoother_parallel(*args)
+
+    assert jnp.allclose(posterior.marginal_loglik, posterior_par.marginal_loglik, rtol=1e-4)
+    assert jnp.allclose(posterior.smoothed_probs, posterior_par.smoothed_probs, atol=1e-4)
+
+
+def test_hmm_smoother_parallel_time_varying(key=0, num_timesteps=20, num_states=3):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+    k1, k2 = jr.split(key)
+
+    initial_probs, _, log_lkhds = random_hmm_args(k1, num_timesteps, num_states)
+    transition_matrices = jr.uniform(k2, (num_timesteps, num_states, num_states))
+    transition_matrices /= transition_matrices.sum(2, keepdims=True)
+
+    posterior = core.hmm_smoother(initial_probs, transition_matrices, log_lkhds)
+    posterior_par = core.hmm_smoother_parallel(initial_probs, transition_matrices, log_lkhds)
+
+    assert jnp.allclose(posterior.marginal_loglik, posterior_par.marginal_loglik, rtol=1e-4)
+    assert jnp.allclose(posterior.filtered_probs, posterior_par.filtered_probs, atol=1e-4)
+    assert jnp.allclose(posterior.smoothed_probs, posterior_par.smoothed_probs, atol=1e-4)
+
+
+def test_hmm_filter_update(key=0, num_timesteps=50, num_states=4, chunk_lengths=(1, 7, 20, 22)):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    initial_probs, transition_matrix, log_lkhds = random_hmm_args(key, num_timesteps, num_states)
+    posterior = core.hmm_filter(initial_probs, transition_matrix, log_lkhds)
+
+    # Run the streaming filter on consecutive chunks
+    state = core.hmm_filter_init(initial_probs)
+    start = 0
+    for length in chunk_lengths:
+        state, post = core.hmm_filter_update(state, transition_matrix, log_lkhds[start:start + length])
+        assert jnp.allclose(post.filtered_probs, posterior.filtered_probs[start:start + length], atol=1e-5)
+        assert jnp.allclose(post.predicted_probs, posterior.predicted_probs[start:start + length], atol=1e-5)
+        start += length
+
+    assert jnp.allclose(state.marginal_loglik, posterior.marginal_loglik, rtol=1e-5)
+
+
+def test_hmm_smoother_checkpointed(key=0, num_timesteps=50, num_states=4, checkpoint_every=7):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    initial_probs, transition_matrix, log_lkhds = random_hmm_args(key, num_timesteps, num_states)
+    posterior = core.hmm_smoother(initial_probs, transition_matrix, log_lkhds)
+    posterior_ckpt = core.hmm_smoother(initial_probs, transition_matrix, log_lkhds, checkpoint_every=checkpoint_every)
+    assert jnp.allclose(posterior.marginal_loglik, posterior_ckpt.marginal_loglik)
+    assert jnp.allclose(posterior.filtered_probs, posterior_ckpt.filtered_probs)
+    assert jnp.allclose(posterior.smoothed_probs, posterior_ckpt.smoothed_probs)
+
+    # Check that the gradients agree too
+    def _loss(log_lkhds, checkpoint_every):
+        post = core.hmm_smoother(initial_probs, transition_matrix, log_lkhds, checkpoint_every=checkpoint_every)
+        return post.marginal_loglik + post.smoothed_probs[:, 0].sum()
+
+    grad = jax.grad(_loss)(log_lkhds, None)
+    grad_ckpt = jax.grad(_loss)(log_lkhds, checkpoint_every)
+    assert jnp.allclose(grad, grad_ckpt, atol=1e-5)
+
+
+def random_banded_hmm_args(key, num_timesteps, num_states, offsets, time_varying=False):
+    initial_probs, _, log_lkhds = random_hmm_args(key, num_timesteps, num_states)
+    shape = (num_timesteps - 1, num_states, num_states) if time_varying else (num_states, num_states)
+    transition_matrix = BandedTransitionMatrix.from_dense(jr.uniform(key, shape), offsets)
+    diagonals = transition_matrix.diagonals / transition_matrix.todense().sum(-1, keepdims=True)
+    return initial_probs, BandedTransitionMatrix(diagonals, offsets), log_lkhds
+
+
+@pytest.mark.parametrize("time_varying", [False, True])
+def test_hmm_banded(time_varying, key=0, num_timesteps=20, num_states=6, offsets=(-1, 0, 2)):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    initial_probs, banded_matrix, log_lkhds = random_banded_hmm_args(key, num_timesteps, num_states, offsets,
+                                                                     time_varying)
+    dense_matrix = banded_matrix.todense()
+
+    post = core.hmm_smoother(initial_probs, dense_matrix, log_lkhds)
+    post_banded = core.hmm_smoother(initial_probs, banded_matrix, log_lkhds)
+    assert jnp.allclose(post.marginal_loglik, post_banded.marginal_loglik)
+    assert jnp.allclose(post.filtered_probs, post_banded.filtered_probs, atol=1e-5)
+    assert jnp.allclose(post.smoothed_probs, post_banded.smoothed_probs, atol=1e-5)
+
+    post_two_filter = core.hmm_two_filter_smoother(initial_probs, dense_matrix, log_lkhds)
+    post_two_filter_banded = core.hmm_two_filter_smoother(initial_probs, banded_matrix, log_lkhds)
+    assert jnp.allclose(post_two_filter.smoothed_probs, post_two_filter_banded.smoothed_probs, atol=1e-5)
+
+    # Compare the (summed) transition probabilities
+    trans_probs = core.compute_transition_probs(dense_matrix, post, reduce_sum=not time_varying)
+    trans_probs_banded = core.compute_transition_probs(banded_matrix, post_banded, reduce_sum=not time_varying)
+    assert jnp.allclose(trans_probs, trans_probs_banded.todense(), atol=1e-5)
+
+    # Compare the Viterbi paths
+    mode = core.hmm_posterior_mode(initial_probs, dense_matrix, log_lkhds)
+    mode_banded = core.hmm_posterior_mode(initial_probs, banded_matrix, log_lkhds)
+    assert jnp.all(mode == mode_banded)
+
+
+@pytest.mark.parametrize("structure", ["low_rank", "kronecker", "circulant"])
+def test_hmm_transition_operator(structure, key=0, num_timesteps=20, num_states=6):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    k1, k2 = jr.split(key)
+    initial_probs, _, log_lkhds = random_hmm_args(k1, num_timesteps, num_states)
+    operator = random_transition_operator(k2, structure, num_states)
+    dense_matrix = operator.todense()
+
+    post = core.hmm_smoother(initial_probs, dense_matrix, log_lkhds)
+    post_op = core.hmm_smoother(initial_probs, operator, log_lkhds)
+    assert jnp.allclose(post.marginal_loglik, post_op.marginal_loglik)
+    assert jnp.allclose(post.smoothed_probs, post_op.smoothed_probs, atol=1e-5)
+
+    post_two_filter = core.hmm_two_filter_smoother(initial_probs, operator, log_lkhds)
+    assert jnp.allclose(post.smoothed_probs, post_two_filter.smoothed_probs, atol=1e-5)
+
+    trans_probs = core.compute_transition_probs(dense_matrix, post)
+    trans_probs_op = core.compute_transition_probs(operator, post_op)
+    assert jnp.allclose(trans_probs, trans_probs_op, atol=1e-5)
+
+    mode = core.hmm_posterior_mode(initial_probs, dense_matrix, log_lkhds)
+    mode_op = core.hmm_posterior_mode(initial_probs, operator, log_lkhds)
+    assert jnp.all(mode == mode_op)
+
+    post_par = core.hmm_filter_parallel(initial_probs, operator, log_lkhds)
+    assert jnp.allclose(post.filtered_probs, post_par.filtered_probs, atol=1e-5)
+
+
+def test_hmm_smoother_length(key=0, num_timesteps=20, num_states=4, length=13):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    initial_probs, transition_matrix, log_lkhds = random_hmm_args(key, num_timesteps, num_states)
+    post = core.hmm_smoother(initial_probs, transition_matrix, log_lkhds[:length])
+    post.trans_probs = core.compute_transition_probs(transition_matrix, post)
+
+    # Padded time steps should not change the posterior over the valid ones
+    padded_log_lkhds = log_lkhds.at[length:].set(jnp.nan)
+    for smoother in [core.hmm_smoother, core.hmm_two_filter_smoother]:
+        post_padded = smoother(initial_probs, transition_matrix, padded_log_lkhds, length=length)
+        assert jnp.allclose(post.marginal_loglik, post_padded.marginal_loglik)
+        assert jnp.allclose(post.filtered_probs, post_padded.filtered_probs[:length], atol=1e-5)
+        assert jnp.allclose(post.smoothed_probs, post_padded.smoothed_probs[:length], atol=1e-5)
+        assert jnp.all(post_padded.smoothed_probs[length:] == 0)
+
+        trans_probs = core.compute_transition_probs(transition_matrix, post_padded)
+        assert jnp.allclose(post.trans_probs, trans_probs, atol=1e-5)
+
+
+@pytest.mark.parametrize("length", [None, 13])
+def test_hmm_expected_statistics(length, key=0, num_timesteps=20, num_states=4, emission_dim=2):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    k1, k2 = jr.split(key)
+    initial_probs, transition_matrix, log_lkhds = random_hmm_args(k1, num_timesteps, num_states)
+    emissions = jr.normal(k2, (num_timesteps, emission_dim))
+    emission_statistics_fn = lambda x: dict(x=x, xxT=jnp.outer(x, x))
+
+    post = core.hmm_smoother(initial_probs, transition_matrix, log_lkhds, length=length)
+    stats = core.hmm_expected_statistics(initial_probs, transition_matrix, log_lkhds,
+                                         emissions=emissions,
+                                         emission_statistics_fn=emission_statistics_fn,
+                                         length=length)
+    assert jnp.allclose(stats.marginal_loglik, post.marginal_loglik)
+    assert jnp.allclose(stats.initial_probs, post.smoothed_probs[0], atol=1e-5)
+    assert jnp.allclose(stats.sum_w, post.smoothed_probs.sum(0), atol=1e-4)
+    assert jnp.allclose(stats.trans_probs, core.compute_transition_probs(transition_matrix, post), atol=1e-4)
+    assert jnp.allclose(stats.emission_stats["x"], jnp.einsum("tk,ti->ki", post.smoothed_probs, emissions), atol=1e-4)
+    assert jnp.allclose(stats.emission_stats["xxT"],
+                        jnp.einsum("tk,ti,tj->kij", post.smoothed_probs, emissions, emissions),
+                        atol=1e-4)
+
+    # Time-varying transition matrices give unsummed transition probabilities
+    transition_matrices = jnp.tile(transition_matrix, (num_timesteps - 1, 1, 1))
+    stats = core.hmm_expected_statistics(initial_probs, transition_matrices, log_lkhds, length=length,
+                                         reduce_sum=False)
+    all_trans_probs = core.compute_transition_probs(transition_matrices, post, reduce_sum=False)
+    assert jnp.allclose(stats.trans_probs, all_trans_probs, atol=1e-5)
+
+
 def test_hmm_fixed_lag_smoother(key=0, num_timesteps=5, num_states=2):
     if isinstance(key, int):
         key = jr.PRNGKey(key)
@@ -159,6 +369,28 @@ def test_hmm_fixed_lag_smoother(key=0, num_timesteps=5, num_states=2):
     assert jnp.allclose(posterior.smoothed_probs, posterior_fl.smoothed_probs[-1], atol=1e-3)
 
 
+def test_hmm_fixed_lag_smoother_lag_only(key=0, num_timesteps=20, num_states=3, window_size=4):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    args = random_hmm_args(key, num_timesteps, num_states)
+
+    # With a full window, the lagged marginals are the smoothed marginals
+    posterior = core.hmm_smoother(*args)
+    posterior_fl = core.hmm_fixed_lag_smoother(*args, window_size=num_timesteps, lag_only=True)
+    assert jnp.allclose(posterior.marginal_loglik, posterior_fl.marginal_loglik, atol=1e-3)
+    assert jnp.allclose(posterior.filtered_probs, posterior_fl.filtered_probs, atol=1e-4)
+    assert jnp.allclose(posterior.smoothed_probs, posterior_fl.smoothed_probs, atol=1e-4)
+
+    # Otherwise, they are the oldest entries of each window
+    posterior_window = core.hmm_fixed_lag_smoother(*args, window_size=window_size)
+    posterior_lag = core.hmm_fixed_lag_smoother(*args, window_size=window_size, lag_only=True)
+    num_lagged = num_timesteps - window_size + 1
+    assert jnp.allclose(posterior_lag.smoothed_probs[:num_lagged], posterior_window.smoothed_probs[window_size - 1:, 0],
+                        atol=1e-4)
+    assert jnp.allclose(posterior_lag.smoothed_probs[num_lagged:], posterior_window.smoothed_probs[-1, 1:], atol=1e-4)
+
+
 def test_compute_transition_probs(key=0, num_timesteps=5, num_states=2):
     if isinstance(key, int):
         key = jr.PRNGKey(key)
@@ -218,6 +450,36 @@ def test_hmm_posterior_mode(key=0, num_timesteps=5, num_states=2):
     assert jnp.all(mode == mode_t)
 
 
+def test_hmm_posterior_mode_parallel(key=0, num_timesteps=5, num_states=2):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    args = random_hmm_args(key, num_timesteps, num_states)
+
+    # Run the parallel Viterbi algorithm, with and without chunking
+    mode = core.hmm_posterior_mode_parallel(*args)
+    mode_chunked = core.hmm_posterior_mode_parallel(*args, chunk_size=2)
+
+    # Compare log_normalizer to manually computed entries and find the mode
+    log_joint = big_log_joint(*args)
+    mode_t = jnp.stack(jnp.unravel_index(jnp.argmax(log_joint), log_joint.shape))
+
+    # Compare the posterior modes
+    assert jnp.all(mode == mode_t)
+    assert jnp.all(mode_chunked == mode_t)
+
+
+def test_hmm_posterior_mode_parallel_long(key=0, num_timesteps=500, num_states=10, chunk_size=64):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    args = random_hmm_args(key, num_timesteps, num_states, scale=3.0)
+
+    mode = core.hmm_posterior_mode(*args)
+    assert jnp.all(core.hmm_posterior_mode_parallel(*args) == mode)
+    assert jnp.all(core.hmm_posterior_mode_parallel(*args, chunk_size=chunk_size) == mode)
+
+
 def test_hmm_smoother_stability(key=0, num_timesteps=10000, num_states=100, scale=100.0):
     if isinstance(key, int):
         key = jr.PRNGKey(key)
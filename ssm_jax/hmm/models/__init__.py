@@ -1,4 +1,10 @@
 from ssm_jax.hmm.models.bernoulli_hmm import BernoulliHMM
 from ssm_jax.hmm.models.categorical_hmm import CategoricalHMM
+from ssm_jax.hmm.models.gaussian_hmm import DiagonalGaussianHMM
 from ssm_jax.hmm.models.gaussian_hmm import GaussianHMM
+from ssm_jax.hmm.models.gaussian_hmm import LowRankGaussianHMM
+from ssm_jax.hmm.models.gaussian_hmm import SharedCovarianceGaussianHMM
+from ssm_jax.hmm.models.gaussian_hmm import SphericalGaussianHMM
+from ssm_jax.hmm.models.gmm_hmm import DiagonalGaussianMixtureHMM
+from ssm_jax.hmm.models.gmm_hmm import GaussianMixtureHMM
 from ssm_jax.hmm.models.poisson_hmm import PoissonHMM
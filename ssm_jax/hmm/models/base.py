@@ -1,22 +1,45 @@
 from abc import abstractmethod
+from functools import partial
+from weakref import WeakKeyDictionary
 
 import jax.numpy as jnp
 import jax.random as jr
 import optax
 import tensorflow_probability.substrates.jax.bijectors as tfb
 import tensorflow_probability.substrates.jax.distributions as tfd
-from jax import vmap
+from jax import eval_shape
 from jax import jit
 from jax import vmap
-from tqdm.auto import trange
-
+from jax.core import Tracer
+from jax.scipy.special import gammaln
+from jax.tree_util import tree_leaves
+from jax.tree_util import tree_map
+from jax.tree_util import tree_structure
+from jax.tree_util import tree_unflatten
+
+from ssm_jax.hmm.cache import ConditionalLoglikCache
+from ssm_jax.hmm.inference import HMMPosterior
 from ssm_jax.hmm.inference import compute_transition_probs
+from ssm_jax.hmm.inference import hmm_expected_statistics
 from ssm_jax.hmm.inference import hmm_filter
+from ssm_jax.hmm.inference import hmm_filter_init
+from ssm_jax.hmm.inference import hmm_filter_parallel
+from ssm_jax.hmm.inference import hmm_filter_update
 from ssm_jax.hmm.inference import hmm_posterior_mode
+from ssm_jax.hmm.inference import hmm_posterior_mode_parallel
 from ssm_jax.hmm.inference import hmm_smoother
+from ssm_jax.hmm.inference import hmm_smoother_parallel
 from ssm_jax.hmm.inference import hmm_two_filter_smoother
+from ssm_jax.hmm.transitions import BandedSoftmaxBijector
+from ssm_jax.hmm.transitions import BandedTransitionMatrix
 from ssm_jax.abstractions import SSM, Parameter
+from ssm_jax.optimize import run_em
 from ssm_jax.optimize import run_sgd
+from ssm_jax.utils import bucket_by_length
+
+# Log-likelihood caches of the models that enabled one. They are kept out of
+# the models so that they are not part of the PyTree (see SSM.tree_flatten).
+_loglik_caches = WeakKeyDictionary()
 
 
 class BaseHMM(SSM):
@@ -51,6 +74,17 @@ class BaseHMM(SSM):
             return g(jnp.arange(self.num_states))
 
     def _compute_conditional_logliks(self, emissions):
+        cache = _loglik_caches.get(self)
+        if cache is not None:
+            params, _ = self.tree_flatten()
+            return cache.get_or_compute(params, emissions, self.log_likelihoods)
+        return self.log_likelihoods(emissions)
+
+    def log_likelihoods(self, emissions):
+        """Compute the (T, K) log likelihoods of the emissions under each state.
+        Emission models should override this with a kernel that is batched
+        over time and states, rather than building a distribution per state.
+        """
         # Compute the log probability for each time step by
         # performing a nested vmap over emission time steps and states.
         f = lambda emission: \
@@ -58,43 +92,142 @@ class BaseHMM(SSM):
                 jnp.arange(self.num_states))
         return vmap(f)(emissions)
 
+    def enable_loglik_cache(self, max_bytes=2**28):
+        """Cache the conditional log likelihoods of the emissions, so that
+        calling several inference methods on the same emissions and parameters
+        evaluates the emission model only once.
+
+        The cache belongs to this model object only. It is not part of the
+        PyTree, so copies made by `jit`, `vmap` or `tree_unflatten` do not use it.
+
+        Args:
+            max_bytes (int): size of the cache before the least recently
+                used entries are evicted.
+
+        Returns:
+            cache (ConditionalLoglikCache): the cache, e.g. to inspect its hits.
+        """
+        cache = _loglik_caches[self] = ConditionalLoglikCache(max_bytes)
+        return cache
+
+    def disable_loglik_cache(self):
+        _loglik_caches.pop(self, None)
+
     # Basic inference code
-    def marginal_log_prob(self, emissions):
-        """Compute log marginal likelihood of observations."""
+    def marginal_log_prob(self, emissions, checkpoint_every=None):
+        """Compute log marginal likelihood of observations.
+
+        If `checkpoint_every` is given, the forward pass is rematerialized in
+        segments of that many time steps, which reduces the memory needed to
+        differentiate it (use ~sqrt(T) for long sequences).
+        """
         post = hmm_filter(self._compute_initial_probs(),
                           self._compute_transition_matrices(),
-                          self._compute_conditional_logliks(emissions))
+                          self._compute_conditional_logliks(emissions),
+                          checkpoint_every=checkpoint_every)
         ll = post.marginal_loglik
         return ll
 
-    def most_likely_states(self, emissions):
-        """Compute Viterbi path."""
-        return hmm_posterior_mode(self._compute_initial_probs(),
-                                  self._compute_transition_matrices(),
-                                  self._compute_conditional_logliks(emissions))
+    def most_likely_states(self, emissions, parallel=False):
+        """Compute Viterbi path.
 
-    def filter(self, emissions):
-        """Compute filtering distribution."""
-        return hmm_filter(self._compute_initial_probs(),
-                          self._compute_transition_matrices(),
-                          self._compute_conditional_logliks(emissions))
+        If `parallel` is True, use the max-plus associative scan implementation,
+        which has O(log T) depth instead of O(T).
+        """
+        mode_fn = hmm_posterior_mode_parallel if parallel else hmm_posterior_mode
+        return mode_fn(self._compute_initial_probs(),
+                       self._compute_transition_matrices(),
+                       self._compute_conditional_logliks(emissions))
 
-    def smoother(self, emissions):
-        """Compute smoothing distribution."""
-        return hmm_smoother(self._compute_initial_probs(),
-                            self._compute_transition_matrices(),
-                            self._compute_conditional_logliks(emissions))
+    def filter(self, emissions, parallel=False):
+        """Compute filtering distribution.
+
+        If `parallel` is True, use the associative scan implementation,
+        which has O(log T) depth instead of O(T).
+        """
+        filter_fn = hmm_filter_parallel if parallel else hmm_filter
+        return filter_fn(self._compute_initial_probs(),
+                         self._compute_transition_matrices(),
+                         self._compute_conditional_logliks(emissions))
+
+    def filter_stream(self, emissions_chunks, state=None):
+        """Compute filtering distributions for a stream of emissions, one chunk
+        at a time, without recomputing the history.
+
+        Args:
+            emissions_chunks: iterable of emission arrays with a leading time axis.
+            state (HMMFilterState): state to resume from. Defaults to the
+                initial distribution.
+
+        Yields:
+            state (HMMFilterState) and posterior (HMMPosterior) for each chunk.
+        """
+        if state is None:
+            state = hmm_filter_init(self._compute_initial_probs())
+
+        transition_matrix = self._compute_transition_matrices()
+        for emissions in emissions_chunks:
+            state, post = hmm_filter_update(state, transition_matrix, self._compute_conditional_logliks(emissions))
+            yield state, post
+
+    def smoother(self, emissions, parallel=False):
+        """Compute smoothing distribution.
+
+        If `parallel` is True, use the associative scan implementation,
+        which has O(log T) depth instead of O(T).
+        """
+        smoother_fn = hmm_smoother_parallel if parallel else hmm_smoother
+        return smoother_fn(self._compute_initial_probs(),
+                           self._compute_transition_matrices(),
+                           self._compute_conditional_logliks(emissions))
 
     # Expectation-maximization (EM) code
-    def e_step(self, batch_emissions):
+    def _emission_statistics(self, emission):
+        """Sufficient statistics of a single emission, as a PyTree of arrays.
+        The default, None, means the emission model has no such statistics.
+        """
+        return None
+
+    @property
+    def _has_emission_statistics(self):
+        """Whether the emission model overrides `_emission_statistics`."""
+        return type(self)._emission_statistics is not BaseHMM._emission_statistics
+
+    def expected_sufficient_statistics(self, batch_emissions, lengths=None):
+        """Reduce each sequence to the expected initial state, transition
+        counts, state occupancies and per-state sums of `_emission_statistics`
+        under the posterior. Unlike `e_step`, this never stores the (T,K)
+        smoothed probabilities, so it is the E-step to use for models whose
+        M-step only needs these statistics.
+
+        Returns:
+            HMMSuffStats object with a leading batch dimension.
+        """
+        def _single_e_step(emissions, length):
+            transition_matrices = self._compute_transition_matrices()
+            return hmm_expected_statistics(self._compute_initial_probs(),
+                                           transition_matrices,
+                                           self._compute_conditional_logliks(emissions),
+                                           emissions=emissions,
+                                           emission_statistics_fn=self._emission_statistics,
+                                           length=length,
+                                           reduce_sum=(transition_matrices.ndim == 2))
+
+        return vmap(_single_e_step, in_axes=(0, None if lengths is None else 0))(batch_emissions, lengths)
+
+    def e_step(self, batch_emissions, lengths=None):
         """The E-step computes expected sufficient statistics under the
         posterior. In the generic case, we simply return the posterior itself.
+
+        If `lengths` is given, `batch_emissions` is a padded batch of ragged
+        sequences and the time steps beyond each length are ignored.
         """
-        def _single_e_step(emissions):
+        def _single_e_step(emissions, length):
             transition_matrices = self._compute_transition_matrices()
             posterior = hmm_two_filter_smoother(self._compute_initial_probs(),
                                                 transition_matrices,
-                                                self._compute_conditional_logliks(emissions))
+                                                self._compute_conditional_logliks(emissions),
+                                                length=length)
 
             # Compute the transition probabilities
             posterior.trans_probs = compute_transition_probs(
@@ -103,11 +236,11 @@ class BaseHMM(SSM):
 
             return posterior
 
-        return vmap(_single_e_step)(batch_emissions)
+        return vmap(_single_e_step, in_axes=(0, None if lengths is None else 0))(batch_emissions, lengths)
 
     def m_step(self, batch_emissions, batch_posteriors,
                optimizer=optax.adam(1e-2),
-               num_mstep_iters=50):
+               num_mstep_iters=100):
         """_summary_
 
         Args:
@@ -145,32 +278,82 @@ class BaseHMM(SSM):
                                  num_epochs=num_mstep_iters)
         self.unconstrained_params = params
 
-    def fit_em(self, batch_emissions, num_iters=50, **kwargs):
+    def _bucketed_e_step(self, batch_emissions, lengths, bucket_sizes, bucket_lengths):
+        """Run the E-step on consecutive buckets of sequences, each truncated to
+        its own padded length, and concatenate the results. Outputs with a time
+        axis are zero-padded back to the length of `batch_emissions`.
+        """
+        full_shapes = eval_shape(self.e_step, batch_emissions, lengths)
+
+        bucket_posteriors = []
+        start = 0
+        for size, length in zip(bucket_sizes, bucket_lengths):
+            bucket = slice(start, start + size)
+            bucket_posteriors.append(self.e_step(batch_emissions[bucket, :length], lengths[bucket]))
+            start += size
+
+        def _pad_and_concatenate(full_shape, *leaves):
+            padded = [jnp.pad(leaf, [(0, 0)] + [(0, n - m) for n, m in zip(full_shape.shape[1:], leaf.shape[1:])])
+                      for leaf in leaves]
+            return jnp.concatenate(padded)
+
+        # Subclasses may define their statistics containers inside e_step, so
+        # merge the flattened outputs rather than matching their tree types.
+        treedef = tree_structure(bucket_posteriors[0])
+        leaves = map(_pad_and_concatenate, tree_leaves(full_shapes), *map(tree_leaves, bucket_posteriors))
+        return tree_unflatten(treedef, list(leaves))
+
+    def fit_em(self, batch_emissions, num_iters=50, lengths=None, num_buckets=1, tol=None, callback=None,
+               **kwargs):
         """Fit this HMM with Expectation-Maximization (EM).
 
         Args:
             batch_emissions (_type_): _description_
             num_iters (int, optional): _description_. Defaults to 50.
+            lengths (array, optional): valid length of each sequence if
+                `batch_emissions` is a padded batch of ragged sequences.
+            num_buckets (int, optional): if `lengths` is given, group the
+                sequences into this many buckets of similar length and run the
+                E-step on each bucket separately, so that short sequences do not
+                pay for the padding of long ones. The buckets are chosen on the
+                host, so `lengths` must then be concrete, not traced inside
+                `jit` or `vmap`. Defaults to 1.
+            tol (float, optional): stop early once the log probability changes
+                by less than `tol` times its magnitude. Defaults to None.
+            callback (Callable, optional): host function called with the
+                iteration number and log probability after each iteration.
 
         Returns:
-            _type_: _description_
+            log_probs: log probability at each iteration that was run.
         """
-        @jit
+        run = jit(self._em_runner(batch_emissions, num_iters, lengths, num_buckets, tol, callback, **kwargs))
+        params, log_probs, num_completed = run(self.unconstrained_params)
+        self.unconstrained_params = params
+        return log_probs[:num_completed]
+
+    def _em_runner(self, batch_emissions, num_iters, lengths, num_buckets, tol, callback, **kwargs):
+        """Return a function mapping initial unconstrained params to the output
+        of `run_em`, so that it can be jitted (and vmapped over restarts).
+        """
+        if lengths is not None and num_buckets > 1:
+            if isinstance(lengths, Tracer):
+                raise ValueError("Bucketing by length requires concrete lengths; call fit_em outside of "
+                                 "jit/vmap or set num_buckets=1.")
+            # Sort the sequences by length so that each bucket is a contiguous slice
+            order, bucket_sizes, bucket_lengths = bucket_by_length(lengths, num_buckets)
+            batch_emissions, lengths = batch_emissions[order], jnp.asarray(lengths)[order]
+            e_step = lambda: self._bucketed_e_step(batch_emissions, lengths, bucket_sizes, bucket_lengths)
+        else:
+            e_step = lambda: self.e_step(batch_emissions, lengths)
+
         def em_step(params):
             self.unconstrained_params = params
-            batch_posteriors = self.e_step(batch_emissions)
+            batch_posteriors = e_step()
             lp = self.log_prior() + batch_posteriors.marginal_loglik.sum()
             self.m_step(batch_emissions, batch_posteriors, **kwargs)
             return self.unconstrained_params, lp
 
-        log_probs = []
-        params = self.unconstrained_params
-        for _ in trange(num_iters):
-            params, lp = em_step(params)
-            log_probs.append(lp)
-
-        self.unconstrained_params = params
-        return jnp.array(log_probs)
+        return partial(run_em, em_step, num_iters=num_iters, tol=tol, callback=callback)
 
     def fit_sgd(self,
                 batch_emissions,
@@ -179,6 +362,7 @@ class BaseHMM(SSM):
                 num_epochs=50,
                 shuffle=False,
                 key=jr.PRNGKey(0),
+                checkpoint_every=None,
         ):
         """
         Fit this HMM by running SGD on the marginal log likelihood.
@@ -196,6 +380,8 @@ class BaseHMM(SSM):
             num_epochs (int): Iterations made through entire dataset.
             shuffle (bool): Indicates whether to shuffle minibatches.
             key (chex.PRNGKey): RNG key to shuffle minibatches.
+            checkpoint_every (int): If given, rematerialize the forward pass in
+                segments of this many time steps to trade compute for memory.
 
         Returns:
             losses: Output of loss_fn stored at each step.
@@ -204,7 +390,8 @@ class BaseHMM(SSM):
             """Default objective function."""
             self.unconstrained_params = params
             scale = len(batch_emissions) / len(minibatch_emissions)
-            minibatch_lls = vmap(self.marginal_log_prob)(minibatch_emissions)
+            marginal_log_prob = partial(self.marginal_log_prob, checkpoint_every=checkpoint_every)
+            minibatch_lls = vmap(marginal_log_prob)(minibatch_emissions)
             lp = self.log_prior() + minibatch_lls.sum() * scale
             return -lp / batch_emissions.size
 
@@ -233,7 +420,9 @@ class StandardHMM(BaseHMM):
 
         Args:
             initial_probabilities[k]: prob(hidden(1)=k)
-            transition_matrix[j,k]: prob(hidden(t) = k | hidden(t-1)j)
+            transition_matrix[j,k]: prob(hidden(t) = k | hidden(t-1)j). This may
+                also be a BandedTransitionMatrix, in which case inference and the
+                M-step only touch its nonzero diagonals.
         """
         # Check shapes
         num_states = transition_matrix.shape[-1]
@@ -242,13 +431,19 @@ class StandardHMM(BaseHMM):
 
         # Store the parameters
         self._initial_probs = Parameter(initial_probabilities, bijector=tfb.Invert(tfb.SoftmaxCentered()))
-        self._transition_matrix = Parameter(transition_matrix, bijector=tfb.Invert(tfb.SoftmaxCentered()))
+        if isinstance(transition_matrix, BandedTransitionMatrix):
+            self._transition_matrix = Parameter(transition_matrix,
+                                                bijector=BandedSoftmaxBijector(transition_matrix.offsets))
+            num_transitions = len(transition_matrix.offsets)
+        else:
+            self._transition_matrix = Parameter(transition_matrix, bijector=tfb.Invert(tfb.SoftmaxCentered()))
+            num_transitions = num_states
 
         # And the hyperparameters of the prior
         self._initial_probs_concentration = Parameter(initial_probs_concentration * jnp.ones(num_states),
                                                       is_frozen=True,
                                                       bijector=tfb.Invert(tfb.Softplus()))
-        self._transition_matrix_concentration = Parameter(transition_matrix_concentration * jnp.ones(num_states),
+        self._transition_matrix_concentration = Parameter(transition_matrix_concentration * jnp.ones(num_transitions),
                                                           is_frozen=True,
                                                           bijector=tfb.Invert(tfb.Softplus()))
 
@@ -264,7 +459,28 @@ class StandardHMM(BaseHMM):
         return tfd.Categorical(probs=self._initial_probs.value)
 
     def transition_distribution(self, state):
-        return tfd.Categorical(probs=self._transition_matrix.value[state])
+        transition_matrix = self._transition_matrix.value
+        if isinstance(transition_matrix, BandedTransitionMatrix):
+            return tfd.Categorical(probs=transition_matrix.predict(jnp.zeros(self.num_states).at[state].set(1.0)))
+        return tfd.Categorical(probs=transition_matrix[state])
+
+    def _compute_transition_matrices(self):
+        return self._transition_matrix.value
+
+    def log_prior(self):
+        lp = tfd.Dirichlet(self._initial_probs_concentration.value).log_prob(self.initial_probs.value)
+        transition_matrix = self._transition_matrix.value
+        concentration = self._transition_matrix_concentration.value
+        if isinstance(transition_matrix, BandedTransitionMatrix):
+            # Dirichlet prior on the in-range entries of each row
+            mask = transition_matrix.mask
+            concentration = jnp.where(mask, concentration, 0.0)
+            lp += jnp.sum(jnp.where(mask, (concentration - 1) * jnp.log(transition_matrix.diagonals), 0.0))
+            lp += jnp.sum(gammaln(concentration.sum(axis=1)))
+            lp -= jnp.sum(jnp.where(mask, gammaln(concentration), 0.0))
+        else:
+            lp += tfd.Dirichlet(concentration).log_prob(transition_matrix).sum()
+        return lp
 
     @abstractmethod
     def emission_distribution(self, state):
@@ -278,19 +494,127 @@ class StandardHMM(BaseHMM):
         """
         raise NotImplementedError
 
+    def e_step(self, batch_emissions, lengths=None):
+        """If the emission model defines `_emission_statistics`, the E-step
+        only computes the expected sufficient statistics (an HMMSuffStats
+        object). Otherwise it falls back to the posterior.
+        """
+        if self._has_emission_statistics:
+            return self.expected_sufficient_statistics(batch_emissions, lengths)
+        return super().e_step(batch_emissions, lengths)
+
+    @classmethod
+    def fit_em_restarts(cls, key, num_restarts, batch_emissions, *init_args, num_iters=50, tol=None,
+                        lengths=None, num_buckets=1, **kwargs):
+        """Fit an HMM with EM from several random initializations at once, by
+        vmapping the compiled EM loop over a batch of parameters.
+
+        Args:
+            key: rng key for the random initializations.
+            num_restarts (int): number of random initializations.
+            batch_emissions: (B, T, ...) emissions.
+            *init_args: arguments to `random_initialization` after the key,
+                e.g. `num_states, emission_dim`.
+            num_iters, tol, lengths, num_buckets, **kwargs: as in `fit_em`.
+
+        Returns:
+            hmm: the fitted model with the highest final log probability.
+            log_probs: (num_restarts, num_iters) log probabilities of each
+                restart, NaN after that restart converged.
+        """
+        keys = jr.split(key, num_restarts)
+        batch_params = vmap(lambda key: cls.random_initialization(key, *init_args).unconstrained_params)(keys)
+
+        hmm = cls.random_initialization(keys[0], *init_args)
+        run = hmm._em_runner(batch_emissions, num_iters, lengths, num_buckets, tol, None, **kwargs)
+        batch_params, log_probs, num_completed = jit(vmap(run))(batch_params)
+
+        final_log_probs = log_probs[jnp.arange(num_restarts), num_completed - 1]
+        best = jnp.nanargmax(final_log_probs)
+        hmm.unconstrained_params = [params[best] for params in batch_params]
+        return hmm, log_probs
+
+    def fit_stochastic_em(self, emissions_iterable, num_sequences=None, num_epochs=1, schedule=None, **kwargs):
+        """Fit this HMM with stochastic (online) EM. The sufficient statistics of
+        each minibatch are blended into running statistics,
+
+            stats = (1 - rho_t) * stats + rho_t * (num_sequences / B) * minibatch_stats,
+
+        with a Robbins-Monro step size rho_t, and the M-step is run on the
+        running statistics after every minibatch.
+
+        Args:
+            emissions_iterable: iterable of (B, T, ...) minibatches of emissions,
+                e.g. a generator streaming them from disk. A generator can only
+                be consumed once, so pass a list to run several epochs.
+            num_sequences (int, optional): total number of sequences in the
+                dataset, used to weigh the statistics against the prior. If
+                None, statistics are not rescaled.
+            num_epochs (int, optional): number of passes over the minibatches.
+            schedule (Callable, optional): function of the step number giving
+                the step size rho_t. Defaults to (t + 1)^(-0.6).
+
+        Returns:
+            log_probs: log probability of each minibatch, rescaled like its
+                statistics, under the parameters before its update.
+        """
+        if not self._has_emission_statistics:
+            raise NotImplementedError("Stochastic EM requires the model to define _emission_statistics.")
+        if schedule is None:
+            schedule = lambda step: (step + 1.0)**(-0.6)
+
+        @jit
+        def _step(params, running_stats, minibatch, step_size):
+            self.unconstrained_params = params
+            scale = 1.0 if num_sequences is None else num_sequences / len(minibatch)
+            minibatch_stats = tree_map(lambda x: scale * jnp.sum(x, axis=0, keepdims=True), self.e_step(minibatch))
+            if running_stats is None:
+                running_stats = minibatch_stats
+            else:
+                running_stats = tree_map(lambda x, y: (1 - step_size) * x + step_size * y,
+                                         running_stats, minibatch_stats)
+
+            lp = self.log_prior() + minibatch_stats.marginal_loglik.sum()
+            self.m_step(minibatch, running_stats, **kwargs)
+            return self.unconstrained_params, running_stats, lp
+
+        log_probs = []
+        params, running_stats = self.unconstrained_params, None
+        for _ in range(num_epochs):
+            for minibatch in emissions_iterable:
+                step_size = schedule(len(log_probs))
+                params, running_stats, lp = _step(params, running_stats, jnp.asarray(minibatch), step_size)
+                log_probs.append(lp)
+
+        self.unconstrained_params = params
+        return jnp.array(log_probs)
+
     def _m_step_initial_probs(self, batch_emissions, batch_posteriors):
-        post = tfd.Dirichlet(self._initial_probs_concentration.value +
-                             batch_posteriors.initial_probs.sum(axis=0))
+        # Models without emission statistics get the full posterior from e_step
+        if isinstance(batch_posteriors, HMMPosterior):
+            initial_probs = batch_posteriors.smoothed_probs[:, 0]
+        else:
+            initial_probs = batch_posteriors.initial_probs
+        post = tfd.Dirichlet(self._initial_probs_concentration.value + initial_probs.sum(axis=0))
         self._initial_probs.value = post.mode()
 
     def _m_step_transition_matrix(self, batch_emissions, batch_posteriors):
+        transition_matrix = self._transition_matrix.value
+        if isinstance(transition_matrix, BandedTransitionMatrix):
+            # Dirichlet mode restricted to the in-range entries of each row
+            counts = batch_posteriors.trans_probs.diagonals.sum(axis=0)
+            mode = jnp.where(transition_matrix.mask, self._transition_matrix_concentration.value + counts - 1, 0.0)
+            self._transition_matrix.value = BandedTransitionMatrix(mode / mode.sum(axis=1, keepdims=True),
+                                                                   transition_matrix.offsets)
+            return
+
         post = tfd.Dirichlet(self._transition_matrix_concentration.value +
                              batch_posteriors.trans_probs.sum(axis=0))
         self._transition_matrix.value = post.mode()
 
     def _m_step_emissions(self, batch_emissions, batch_posteriors,
                           optimizer=optax.adam(1e-2),
-                          num_mstep_iters=50):
+                          num_mstep_iters=100):
 
         def neg_expected_log_joint(params, minibatch):
             minibatch_emissions, minibatch_posteriors = minibatch
@@ -298,10 +622,9 @@ class StandardHMM(BaseHMM):
             self.unconstrained_params = params
 
             def _single_expected_log_like(emissions, posterior):
-                log_likelihoods = self._conditional_logliks(emissions)
+                log_likelihoods = self._compute_conditional_logliks(emissions)
                 expected_states = posterior.smoothed_probs
-                lp += jnp.sum(expected_states * log_likelihoods)
-                return lp
+                return jnp.sum(expected_states * log_likelihoods)
 
             log_prior = self.log_prior()
             minibatch_ells = vmap(_single_expected_log_like)(
@@ -319,7 +642,7 @@ class StandardHMM(BaseHMM):
 
     def m_step(self, batch_emissions, batch_posteriors,
                optimizer=optax.adam(1e-2),
-               num_mstep_iters=50):
+               num_mstep_iters=100):
 
         self._m_step_initial_probs(batch_emissions, batch_posteriors)
         self._m_step_transition_matrix(batch_emissions, batch_posteriors)
@@ -1,16 +1,14 @@
 from functools import partial
 
-import chex
 import jax.numpy as jnp
 import jax.random as jr
 import tensorflow_probability.substrates.jax.bijectors as tfb
 import tensorflow_probability.substrates.jax.distributions as tfd
 from jax import tree_map
-from jax import vmap
+from jax.scipy.special import xlog1py
+from jax.scipy.special import xlogy
 from jax.tree_util import register_pytree_node_class
 from ssm_jax.abstractions import Parameter
-from ssm_jax.hmm.inference import compute_transition_probs
-from ssm_jax.hmm.inference import hmm_smoother
 from ssm_jax.hmm.models.base import StandardHMM
 
 
@@ -59,53 +57,22 @@ class BernoulliHMM(StandardHMM):
         return tfd.Independent(tfd.Bernoulli(probs=self._emission_probs.value[state]),
                                reinterpreted_batch_ndims=1)
 
+    def log_likelihoods(self, emissions):
+        # xlogy terms keep probabilities of exactly 0 or 1 (e.g. from the M-step) finite
+        probs = self._emission_probs.value
+        emissions = emissions[:, None, :]
+        return (xlogy(emissions, probs) + xlog1py(1 - emissions, -probs)).sum(axis=-1)
+
     def log_prior(self):
-        lp = tfd.Dirichlet(self._initial_probs_concentration.value).log_prob(self.initial_probs.value)
-        lp += tfd.Dirichlet(self._transition_matrix_concentration.value).log_prob(self.transition_matrix.value).sum()
+        lp = super().log_prior()
         lp += tfd.Beta(self._emission_prior_concentration1.value,
                          self._emission_prior_concentration0.value).log_prob(self._emission_probs.value).sum()
         return lp
 
-    def e_step(self, batch_emissions):
-        """The E-step computes expected sufficient statistics under the
-        posterior. In the Gaussian case, this these are the first two
-        moments of the data
-        """
-
-        @chex.dataclass
-        class BernoulliHMMSuffStats:
-            # Wrapper for sufficient statistics of a BernoulliHMM
-            marginal_loglik: chex.Scalar
-            initial_probs: chex.Array
-            trans_probs: chex.Array
-            sum_x: chex.Array
-            sum_1mx: chex.Array
-
-        def _single_e_step(emissions):
-            # Run the smoother
-            posterior = hmm_smoother(self._compute_initial_probs(),
-                                     self._compute_transition_matrices(),
-                                     self._compute_conditional_logliks(emissions))
-
-            # Compute the initial state and transition probabilities
-            initial_probs = posterior.smoothed_probs[0]
-            trans_probs = compute_transition_probs(self.transition_matrix.value, posterior)
-
-            # Compute the expected sufficient statistics
-            sum_x = jnp.einsum("tk, ti->ki", posterior.smoothed_probs, jnp.where(jnp.isnan(emissions), 0, emissions))
-            sum_1mx = jnp.einsum("tk, ti->ki", posterior.smoothed_probs,
-                                 jnp.where(jnp.isnan(emissions), 0, 1 - emissions))
-
-            # Pack into a dataclass
-            stats = BernoulliHMMSuffStats(marginal_loglik=posterior.marginal_loglik,
-                                          initial_probs=initial_probs,
-                                          trans_probs=trans_probs,
-                                          sum_x=sum_x,
-                                          sum_1mx=sum_1mx)
-            return stats
-
-        # Map the E step calculations over batches
-        return vmap(_single_e_step)(batch_emissions)
+    # Expectation-maximization (EM) code
+    def _emission_statistics(self, emission):
+        return dict(sum_x=jnp.where(jnp.isnan(emission), 0, emission),
+                    sum_1mx=jnp.where(jnp.isnan(emission), 0, 1 - emission))
 
     def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
         # Sum the statistics across all batches
@@ -113,5 +80,5 @@ class BernoulliHMM(StandardHMM):
 
         # Then maximize the expected log probability as a fn of model parameters
         self._emission_probs.value = tfd.Beta(
-            self._emission_prior_concentration1.value + stats.sum_x,
-            self._emission_prior_concentration0.value + stats.sum_1mx).mode()
+            self._emission_prior_concentration1.value + stats.emission_stats["sum_x"],
+            self._emission_prior_concentration0.value + stats.emission_stats["sum_1mx"]).mode()
@@ -1,17 +1,13 @@
 from functools import partial
 
-import chex
 import jax.numpy as jnp
 import jax.random as jr
 import tensorflow_probability.substrates.jax.bijectors as tfb
 import tensorflow_probability.substrates.jax.distributions as tfd
 from jax import tree_map
-from jax import vmap
 from jax.nn import one_hot
 from jax.tree_util import register_pytree_node_class
 from ssm_jax.abstractions import Parameter
-from ssm_jax.hmm.inference import compute_transition_probs
-from ssm_jax.hmm.inference import hmm_smoother
 from ssm_jax.hmm.models.base import StandardHMM
 
 
@@ -72,50 +68,20 @@ class CategoricalHMM(StandardHMM):
             tfd.Categorical(probs=self.emission_probs.value[state]),
             reinterpreted_batch_ndims=1)
 
+    def log_likelihoods(self, emissions):
+        # A single emission per time step may be given as a scalar
+        emissions = emissions.reshape(len(emissions), self.num_emissions)
+        log_probs = jnp.log(self.emission_probs.value)
+        return jnp.einsum("tdc,kdc->tk", one_hot(emissions, self.num_classes), log_probs)
+
     def log_prior(self):
-        lp = tfd.Dirichlet(self._initial_probs_concentration.value).log_prob(self.initial_probs.value)
-        lp += tfd.Dirichlet(self._transition_matrix_concentration.value).log_prob(self.transition_matrix.value).sum()
+        lp = super().log_prior()
         lp += tfd.Dirichlet(self._emission_prior_concentration.value).log_prob(self.emission_probs.value).sum()
         return lp
 
-    def e_step(self, batch_emissions):
-        """The E-step computes expected sufficient statistics under the
-        posterior. In the Gaussian case, this these are the first two
-        moments of the data
-        """
-
-        @chex.dataclass
-        class CategoricalHMMSuffStats:
-            # Wrapper for sufficient statistics of a BernoulliHMM
-            marginal_loglik: chex.Scalar
-            initial_probs: chex.Array
-            trans_probs: chex.Array
-            sum_x: chex.Array
-
-        def _single_e_step(emissions):
-            # Run the smoother
-            posterior = hmm_smoother(self._compute_initial_probs(),
-                                     self._compute_transition_matrices(),
-                                     self._compute_conditional_logliks(emissions))
-
-            # Compute the initial state and transition probabilities
-            initial_probs = posterior.smoothed_probs[0]
-            trans_probs = compute_transition_probs(self.transition_matrix.value, posterior)
-
-            # Compute the expected sufficient statistics
-            sum_x = jnp.einsum("tk, tdi->kdi", posterior.smoothed_probs, one_hot(emissions, self.num_classes))
-
-            # Pack into a dataclass
-            stats = CategoricalHMMSuffStats(
-                marginal_loglik=posterior.marginal_loglik,
-                initial_probs=initial_probs,
-                trans_probs=trans_probs,
-                sum_x=sum_x,
-            )
-            return stats
-
-        # Map the E step calculations over batches
-        return vmap(_single_e_step)(batch_emissions)
+    # Expectation-maximization (EM) code
+    def _emission_statistics(self, emission):
+        return dict(sum_x=one_hot(emission, self.num_classes))
 
     def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
         # Sum the statistics across all batches
@@ -123,4 +89,4 @@ class CategoricalHMM(StandardHMM):
 
         # Then maximize the expected log probability as a fn of model parameters
         self._emission_probs.value = tfd.Dirichlet(self._emission_prior_concentration.value +
-                                                   stats.sum_x).mode()
+                                                   stats.emission_stats["sum_x"]).mode()
@@ -1,20 +1,20 @@
 from functools import partial
 from tkinter import N
 
-import chex
 from distrax import Normal
 import jax.numpy as jnp
 import jax.random as jr
 import tensorflow_probability.substrates.jax.distributions as tfd
 import tensorflow_probability.substrates.jax.bijectors as tfb
 from jax import vmap
+from jax.scipy.linalg import cho_solve
+from jax.scipy.linalg import solve_triangular
 from jax.tree_util import register_pytree_node_class
 from jax.tree_util import tree_map
 from ssm_jax.abstractions import Parameter
-from ssm_jax.hmm.inference import compute_transition_probs
-from ssm_jax.hmm.inference import hmm_smoother
 from ssm_jax.hmm.models.base import StandardHMM
 from ssm_jax.utils import PSDToRealBijector
+from ssm_jax.distributions import InverseWishart
 from ssm_jax.distributions import NormalInverseWishart
 
 
@@ -86,9 +86,19 @@ class GaussianHMM(StandardHMM):
         return tfd.MultivariateNormalFullCovariance(self._emission_means.value[state],
                                                     self._emission_covs.value[state])
 
+    def log_likelihoods(self, emissions):
+        # Factor each covariance once and whiten all time steps with a single
+        # triangular solve per state.
+        chols = jnp.linalg.cholesky(self._emission_covs.value)
+        diffs = emissions[None, :, :] - self._emission_means.value[:, None, :]
+        whitened = vmap(lambda L, diff: solve_triangular(L, diff.T, lower=True))(chols, diffs)
+        half_log_dets = jnp.log(jnp.diagonal(chols, axis1=1, axis2=2)).sum(axis=1)
+        dim = emissions.shape[-1]
+        lls = -0.5 * jnp.sum(whitened**2, axis=1) - half_log_dets[:, None] - 0.5 * dim * jnp.log(2 * jnp.pi)
+        return lls.T
+
     def log_prior(self):
-        lp = tfd.Dirichlet(self._initial_probs_concentration.value).log_prob(self.initial_probs.value)
-        lp += tfd.Dirichlet(self._transition_matrix_concentration.value).log_prob(self.transition_matrix.value).sum()
+        lp = super().log_prior()
 
         lp += NormalInverseWishart(
             self._emission_prior_mean.value,
@@ -99,48 +109,8 @@ class GaussianHMM(StandardHMM):
         return lp
 
     # Expectation-maximization (EM) code
-    def e_step(self, batch_emissions):
-        """The E-step computes expected sufficient statistics under the
-        posterior. In the Gaussian case, this these are the first two
-        moments of the data
-        """
-
-        @chex.dataclass
-        class GaussianHMMSuffStats:
-            # Wrapper for sufficient statistics of a GaussianHMM
-            marginal_loglik: chex.Scalar
-            initial_probs: chex.Array
-            trans_probs: chex.Array
-            sum_w: chex.Array
-            sum_x: chex.Array
-            sum_xxT: chex.Array
-
-        def _single_e_step(emissions):
-            # Run the smoother
-            posterior = hmm_smoother(self._compute_initial_probs(),
-                                     self._compute_transition_matrices(),
-                                     self._compute_conditional_logliks(emissions))
-
-            # Compute the initial state and transition probabilities
-            initial_probs = posterior.smoothed_probs[0]
-            trans_probs = compute_transition_probs(self.transition_matrix.value, posterior)
-
-            # Compute the expected sufficient statistics
-            sum_w = jnp.einsum("tk->k", posterior.smoothed_probs)
-            sum_x = jnp.einsum("tk,ti->ki", posterior.smoothed_probs, emissions)
-            sum_xxT = jnp.einsum("tk,ti,tj->kij", posterior.smoothed_probs, emissions, emissions)
-
-            # TODO: might need to normalize x_sum and xxT_sum for numerical stability
-            stats = GaussianHMMSuffStats(marginal_loglik=posterior.marginal_loglik,
-                                         initial_probs=initial_probs,
-                                         trans_probs=trans_probs,
-                                         sum_w=sum_w,
-                                         sum_x=sum_x,
-                                         sum_xxT=sum_xxT)
-            return stats
-
-        # Map the E step calculations over batches
-        return vmap(_single_e_step)(batch_emissions)
+    def _emission_statistics(self, emission):
+        return dict(sum_x=emission, sum_xxT=jnp.outer(emission, emission))
 
     def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
         # Sum the statistics across all batches
@@ -162,6 +132,452 @@ class GaussianHMM(StandardHMM):
             Psi_post = Psi0 + kappa0 * jnp.outer(mu0, mu0) + sum_xxT - kappa_post * jnp.outer(mu_post, mu_post)
             return NormalInverseWishart(mu_post, kappa_post, nu_post, Psi_post).mode()
 
-        covs, means = vmap(_single_m_step)(stats.sum_w, stats.sum_x, stats.sum_xxT)
+        covs, means = vmap(_single_m_step)(stats.sum_w, stats.emission_stats["sum_x"], stats.emission_stats["sum_xxT"])
         self.emission_covariance_matrices.value = covs
         self.emission_means.value = means
+
+
+@register_pytree_node_class
+class DiagonalGaussianHMM(StandardHMM):
+    """A Gaussian HMM with diagonal emission covariances. Computing the log
+    likelihoods costs O(D) per state and time step instead of O(D^2), and the
+    M-step costs O(D) per state instead of O(D^3).
+
+    Each dimension has a normal inverse gamma prior,
+
+        sigma_{kd}^2 ~ IG(shape, scale),    mu_{kd} ~ N(mu_0, sigma_{kd}^2 / kappa_0).
+    """
+
+    def __init__(self,
+                 initial_probabilities,
+                 transition_matrix,
+                 emission_means,
+                 emission_cov_diags,
+                 initial_probs_concentration=1.1,
+                 transition_matrix_concentration=1.1,
+                 emission_prior_mean=0.0,
+                 emission_prior_concentration=1e-4,
+                 emission_prior_shape=0.1,
+                 emission_prior_scale=1e-4):
+        super().__init__(initial_probabilities, transition_matrix,
+                         initial_probs_concentration=initial_probs_concentration,
+                         transition_matrix_concentration=transition_matrix_concentration)
+
+        self._emission_means = Parameter(emission_means)
+        self._emission_cov_diags = Parameter(emission_cov_diags, bijector=tfb.Invert(tfb.Softplus()))
+
+        dim = emission_means.shape[-1]
+        self._emission_prior_mean = Parameter(emission_prior_mean * jnp.ones(dim), is_frozen=True)
+        self._emission_prior_conc = Parameter(emission_prior_concentration,
+                                              is_frozen=True,
+                                              bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_shape = Parameter(emission_prior_shape,
+                                               is_frozen=True,
+                                               bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_scale = Parameter(emission_prior_scale,
+                                               is_frozen=True,
+                                               bijector=tfb.Invert(tfb.Softplus()))
+
+    @classmethod
+    def random_initialization(cls, key, num_states, emission_dim):
+        key1, key2, key3 = jr.split(key, 3)
+        initial_probs = jr.dirichlet(key1, jnp.ones(num_states))
+        transition_matrix = jr.dirichlet(key2, jnp.ones(num_states), (num_states,))
+        emission_means = jr.normal(key3, (num_states, emission_dim))
+        emission_cov_diags = jnp.ones((num_states, emission_dim))
+        return cls(initial_probs, transition_matrix, emission_means, emission_cov_diags)
+
+    # Properties to get various parameters of the model
+    @property
+    def emission_means(self):
+        return self._emission_means
+
+    @property
+    def emission_cov_diags(self):
+        return self._emission_cov_diags
+
+    def emission_distribution(self, state):
+        return tfd.MultivariateNormalDiag(self._emission_means.value[state],
+                                          jnp.sqrt(self._emission_cov_diags.value[state]))
+
+    def log_likelihoods(self, emissions):
+        precisions = 1 / self._emission_cov_diags.value
+        means = self._emission_means.value
+        quad = (emissions**2) @ precisions.T - 2 * emissions @ (means * precisions).T \
+            + jnp.sum(means**2 * precisions, axis=1)
+        log_dets = jnp.sum(jnp.log(self._emission_cov_diags.value), axis=1)
+        return -0.5 * (quad + log_dets + emissions.shape[-1] * jnp.log(2 * jnp.pi))
+
+    def log_prior(self):
+        lp = super().log_prior()
+        cov_diags = self._emission_cov_diags.value
+        lp += tfd.InverseGamma(self._emission_prior_shape.value,
+                               self._emission_prior_scale.value).log_prob(cov_diags).sum()
+        lp += tfd.Normal(self._emission_prior_mean.value,
+                         jnp.sqrt(cov_diags / self._emission_prior_conc.value)).log_prob(
+                             self._emission_means.value).sum()
+        return lp
+
+    # Expectation-maximization (EM) code
+    def _emission_statistics(self, emission):
+        return dict(sum_x=emission, sum_xsq=emission**2)
+
+    def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
+        # Sum the statistics across all batches
+        stats = tree_map(partial(jnp.sum, axis=0), batch_posteriors)
+        sum_w = stats.sum_w[:, None]
+        sum_x = stats.emission_stats["sum_x"]
+        sum_xsq = stats.emission_stats["sum_xsq"]
+
+        # Find the posterior parameters of the NIG distribution of each dimension
+        mu0 = self._emission_prior_mean.value
+        kappa0 = self._emission_prior_conc.value
+        kappa_post = kappa0 + sum_w
+        mu_post = (kappa0 * mu0 + sum_x) / kappa_post
+        shape_post = self._emission_prior_shape.value + 0.5 * sum_w
+        scale_post = self._emission_prior_scale.value + 0.5 * (sum_xsq + kappa0 * mu0**2 - kappa_post * mu_post**2)
+
+        # Take the joint mode
+        self._emission_means.value = mu_post
+        self._emission_cov_diags.value = scale_post / (shape_post + 1.5)
+
+
+@register_pytree_node_class
+class SphericalGaussianHMM(StandardHMM):
+    """A Gaussian HMM with emission covariances sigma_k^2 I. The variances have
+    inverse gamma priors and the means have N(mu_0, sigma_k^2 I / kappa_0) priors.
+    """
+
+    def __init__(self,
+                 initial_probabilities,
+                 transition_matrix,
+                 emission_means,
+                 emission_variances,
+                 initial_probs_concentration=1.1,
+                 transition_matrix_concentration=1.1,
+                 emission_prior_mean=0.0,
+                 emission_prior_concentration=1e-4,
+                 emission_prior_shape=0.1,
+                 emission_prior_scale=1e-4):
+        super().__init__(initial_probabilities, transition_matrix,
+                         initial_probs_concentration=initial_probs_concentration,
+                         transition_matrix_concentration=transition_matrix_concentration)
+
+        self._emission_means = Parameter(emission_means)
+        self._emission_variances = Parameter(emission_variances, bijector=tfb.Invert(tfb.Softplus()))
+
+        dim = emission_means.shape[-1]
+        self._emission_prior_mean = Parameter(emission_prior_mean * jnp.ones(dim), is_frozen=True)
+        self._emission_prior_conc = Parameter(emission_prior_concentration,
+                                              is_frozen=True,
+                                              bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_shape = Parameter(emission_prior_shape,
+                                               is_frozen=True,
+                                               bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_scale = Parameter(emission_prior_scale,
+                                               is_frozen=True,
+                                               bijector=tfb.Invert(tfb.Softplus()))
+
+    @classmethod
+    def random_initialization(cls, key, num_states, emission_dim):
+        key1, key2, key3 = jr.split(key, 3)
+        initial_probs = jr.dirichlet(key1, jnp.ones(num_states))
+        transition_matrix = jr.dirichlet(key2, jnp.ones(num_states), (num_states,))
+        emission_means = jr.normal(key3, (num_states, emission_dim))
+        emission_variances = jnp.ones(num_states)
+        return cls(initial_probs, transition_matrix, emission_means, emission_variances)
+
+    # Properties to get various parameters of the model
+    @property
+    def emission_means(self):
+        return self._emission_means
+
+    @property
+    def emission_variances(self):
+        return self._emission_variances
+
+    def emission_distribution(self, state):
+        mean = self._emission_means.value[state]
+        return tfd.MultivariateNormalDiag(mean, jnp.sqrt(self._emission_variances.value[state]) * jnp.ones_like(mean))
+
+    def log_likelihoods(self, emissions):
+        variances = self._emission_variances.value
+        means = self._emission_means.value
+        dim = emissions.shape[-1]
+        sq_dists = jnp.sum(emissions**2, axis=1)[:, None] - 2 * emissions @ means.T + jnp.sum(means**2, axis=1)
+        return -0.5 * (sq_dists / variances + dim * jnp.log(2 * jnp.pi * variances))
+
+    def log_prior(self):
+        lp = super().log_prior()
+        variances = self._emission_variances.value
+        lp += tfd.InverseGamma(self._emission_prior_shape.value,
+                               self._emission_prior_scale.value).log_prob(variances).sum()
+        lp += tfd.Normal(self._emission_prior_mean.value,
+                         jnp.sqrt(variances[:, None] / self._emission_prior_conc.value)).log_prob(
+                             self._emission_means.value).sum()
+        return lp
+
+    # Expectation-maximization (EM) code
+    def _emission_statistics(self, emission):
+        return dict(sum_x=emission, sum_xTx=jnp.dot(emission, emission))
+
+    def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
+        # Sum the statistics across all batches
+        stats = tree_map(partial(jnp.sum, axis=0), batch_posteriors)
+        sum_w = stats.sum_w
+        sum_x = stats.emission_stats["sum_x"]
+        sum_xTx = stats.emission_stats["sum_xTx"]
+
+        # Find the posterior parameters, sharing the variance across dimensions
+        mu0 = self._emission_prior_mean.value
+        kappa0 = self._emission_prior_conc.value
+        dim = sum_x.shape[-1]
+        kappa_post = kappa0 + sum_w
+        mu_post = (kappa0 * mu0 + sum_x) / kappa_post[:, None]
+        shape_post = self._emission_prior_shape.value + 0.5 * dim * sum_w
+        scale_post = self._emission_prior_scale.value + \
+            0.5 * (sum_xTx + kappa0 * jnp.dot(mu0, mu0) - kappa_post * jnp.sum(mu_post**2, axis=1))
+
+        # Take the joint mode
+        self._emission_means.value = mu_post
+        self._emission_variances.value = scale_post / (shape_post + 1 + 0.5 * dim)
+
+
+@register_pytree_node_class
+class SharedCovarianceGaussianHMM(StandardHMM):
+    """A Gaussian HMM whose states share one (tied) emission covariance matrix,
+    so that inference only needs a single Cholesky factorization.
+
+    The prior is Sigma ~ IW(df, scale) and mu_k ~ N(mu_0, Sigma / kappa_0).
+    """
+
+    def __init__(self,
+                 initial_probabilities,
+                 transition_matrix,
+                 emission_means,
+                 emission_covariance_matrix,
+                 initial_probs_concentration=1.1,
+                 transition_matrix_concentration=1.1,
+                 emission_prior_mean=0.0,
+                 emission_prior_concentration=1e-4,
+                 emission_prior_scale=1e-4,
+                 emission_prior_extra_df=0.1):
+        super().__init__(initial_probabilities, transition_matrix,
+                         initial_probs_concentration=initial_probs_concentration,
+                         transition_matrix_concentration=transition_matrix_concentration)
+
+        self._emission_means = Parameter(emission_means)
+        self._emission_cov = Parameter(emission_covariance_matrix, bijector=PSDToRealBijector)
+
+        dim = emission_means.shape[-1]
+        self._emission_prior_mean = Parameter(emission_prior_mean * jnp.ones(dim), is_frozen=True)
+        self._emission_prior_conc = Parameter(emission_prior_concentration,
+                                              is_frozen=True,
+                                              bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_scale = Parameter(
+            emission_prior_scale if jnp.ndim(emission_prior_scale) == 2 \
+                else emission_prior_scale * jnp.eye(dim),
+            is_frozen=True,
+            bijector=PSDToRealBijector)
+        self._emission_prior_df = Parameter(dim + emission_prior_extra_df,
+                                            is_frozen=True,
+                                            bijector=tfb.Invert(tfb.Softplus()))
+
+    @classmethod
+    def random_initialization(cls, key, num_states, emission_dim):
+        key1, key2, key3 = jr.split(key, 3)
+        initial_probs = jr.dirichlet(key1, jnp.ones(num_states))
+        transition_matrix = jr.dirichlet(key2, jnp.ones(num_states), (num_states,))
+        emission_means = jr.normal(key3, (num_states, emission_dim))
+        emission_cov = jnp.eye(emission_dim)
+        return cls(initial_probs, transition_matrix, emission_means, emission_cov)
+
+    # Properties to get various parameters of the model
+    @property
+    def emission_means(self):
+        return self._emission_means
+
+    @property
+    def emission_covariance_matrix(self):
+        return self._emission_cov
+
+    def emission_distribution(self, state):
+        return tfd.MultivariateNormalFullCovariance(self._emission_means.value[state], self._emission_cov.value)
+
+    def log_likelihoods(self, emissions):
+        # Whiten the emissions and the means with the shared Cholesky factor
+        chol = jnp.linalg.cholesky(self._emission_cov.value)
+        whitened_emissions = solve_triangular(chol, emissions.T, lower=True).T
+        whitened_means = solve_triangular(chol, self._emission_means.value.T, lower=True).T
+        sq_dists = jnp.sum(whitened_emissions**2, axis=1)[:, None] - 2 * whitened_emissions @ whitened_means.T \
+            + jnp.sum(whitened_means**2, axis=1)
+        half_log_det = jnp.log(jnp.diag(chol)).sum()
+        return -0.5 * sq_dists - half_log_det - 0.5 * emissions.shape[-1] * jnp.log(2 * jnp.pi)
+
+    def log_prior(self):
+        lp = super().log_prior()
+        cov = self._emission_cov.value
+        lp += InverseWishart(self._emission_prior_df.value, self._emission_prior_scale.value).log_prob(cov)
+        lp += tfd.MultivariateNormalFullCovariance(self._emission_prior_mean.value,
+                                                   cov / self._emission_prior_conc.value).log_prob(
+                                                       self._emission_means.value).sum()
+        return lp
+
+    # Expectation-maximization (EM) code
+    def _emission_statistics(self, emission):
+        return dict(sum_x=emission, sum_xxT=jnp.outer(emission, emission))
+
+    def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
+        # Sum the statistics across all batches
+        stats = tree_map(partial(jnp.sum, axis=0), batch_posteriors)
+        sum_w = stats.sum_w
+        sum_x = stats.emission_stats["sum_x"]
+        sum_xxT = stats.emission_stats["sum_xxT"]
+
+        # Each mean has its own normal posterior, and they all contribute
+        # to the inverse Wishart posterior of the shared covariance.
+        mu0 = self._emission_prior_mean.value
+        kappa0 = self._emission_prior_conc.value
+        num_states, dim = sum_x.shape
+        kappa_post = kappa0 + sum_w
+        mu_post = (kappa0 * mu0 + sum_x) / kappa_post[:, None]
+        df_post = self._emission_prior_df.value + sum_w.sum()
+        scale_post = self._emission_prior_scale.value + num_states * kappa0 * jnp.outer(mu0, mu0) \
+            + sum_xxT.sum(axis=0) - jnp.einsum("k,ki,kj->ij", kappa_post, mu_post, mu_post)
+
+        # Take the joint mode
+        self._emission_means.value = mu_post
+        self._emission_cov.value = scale_post / (df_post + dim + 1 + num_states)
+
+
+@register_pytree_node_class
+class LowRankGaussianHMM(StandardHMM):
+    """A Gaussian HMM with factor analysis emission covariances,
+
+        Sigma_k = W_k W_k^T + diag(psi_k),
+
+    where W_k is D x R with R << D. Inference uses the Woodbury identity and
+    learning uses the closed-form factor analysis EM update of (W_k, mu_k, psi_k),
+    so both cost O(D R^2) per state instead of O(D^3).
+
+    The diagonal variances psi_{kd} have IG(shape, scale) priors; the factors
+    and means are unregularized.
+    """
+
+    def __init__(self,
+                 initial_probabilities,
+                 transition_matrix,
+                 emission_means,
+                 emission_cov_factors,
+                 emission_cov_diags,
+                 initial_probs_concentration=1.1,
+                 transition_matrix_concentration=1.1,
+                 emission_prior_shape=0.1,
+                 emission_prior_scale=1e-4):
+        super().__init__(initial_probabilities, transition_matrix,
+                         initial_probs_concentration=initial_probs_concentration,
+                         transition_matrix_concentration=transition_matrix_concentration)
+
+        self._emission_means = Parameter(emission_means)
+        self._emission_cov_factors = Parameter(emission_cov_factors)
+        self._emission_cov_diags = Parameter(emission_cov_diags, bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_shape = Parameter(emission_prior_shape,
+                                               is_frozen=True,
+                                               bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_scale = Parameter(emission_prior_scale,
+                                               is_frozen=True,
+                                               bijector=tfb.Invert(tfb.Softplus()))
+
+    @classmethod
+    def random_initialization(cls, key, num_states, emission_dim, emission_rank):
+        key1, key2, key3, key4 = jr.split(key, 4)
+        initial_probs = jr.dirichlet(key1, jnp.ones(num_states))
+        transition_matrix = jr.dirichlet(key2, jnp.ones(num_states), (num_states,))
+        emission_means = jr.normal(key3, (num_states, emission_dim))
+        emission_cov_factors = jr.normal(key4, (num_states, emission_dim, emission_rank)) / jnp.sqrt(emission_rank)
+        emission_cov_diags = jnp.ones((num_states, emission_dim))
+        return cls(initial_probs, transition_matrix, emission_means, emission_cov_factors, emission_cov_diags)
+
+    # Properties to get various parameters of the model
+    @property
+    def emission_means(self):
+        return self._emission_means
+
+    @property
+    def emission_cov_factors(self):
+        return self._emission_cov_factors
+
+    @property
+    def emission_cov_diags(self):
+        return self._emission_cov_diags
+
+    @property
+    def emission_rank(self):
+        return self._emission_cov_factors.value.shape[-1]
+
+    def emission_distribution(self, state):
+        factor = self._emission_cov_factors.value[state]
+        cov = factor @ factor.T + jnp.diag(self._emission_cov_diags.value[state])
+        return tfd.MultivariateNormalFullCovariance(self._emission_means.value[state], cov)
+
+    def _capacitance_cholesky(self, factor, cov_diag):
+        # Cholesky factor of C = I + W^T diag(psi)^{-1} W, and diag(psi)^{-1} W
+        scaled_factor = factor / cov_diag[:, None]
+        capacitance = jnp.eye(factor.shape[-1]) + factor.T @ scaled_factor
+        return jnp.linalg.cholesky(capacitance), scaled_factor
+
+    def log_likelihoods(self, emissions):
+        dim = emissions.shape[-1]
+
+        def _single_log_likelihoods(mean, factor, cov_diag):
+            chol, scaled_factor = self._capacitance_cholesky(factor, cov_diag)
+            diffs = emissions - mean
+            projected = solve_triangular(chol, scaled_factor.T @ diffs.T, lower=True)
+            quad = jnp.sum(diffs**2 / cov_diag, axis=1) - jnp.sum(projected**2, axis=0)
+            log_det = jnp.sum(jnp.log(cov_diag)) + 2 * jnp.sum(jnp.log(jnp.diag(chol)))
+            return -0.5 * (quad + log_det + dim * jnp.log(2 * jnp.pi))
+
+        return vmap(_single_log_likelihoods, out_axes=1)(self._emission_means.value,
+                                                         self._emission_cov_factors.value,
+                                                         self._emission_cov_diags.value)
+
+    def log_prior(self):
+        lp = super().log_prior()
+        lp += tfd.InverseGamma(self._emission_prior_shape.value,
+                               self._emission_prior_scale.value).log_prob(self._emission_cov_diags.value).sum()
+        return lp
+
+    # Expectation-maximization (EM) code
+    def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
+        # The factor analysis statistics depend on the current parameters,
+        # so this model keeps the full posterior from the E-step.
+        emissions = batch_emissions.reshape(-1, batch_emissions.shape[-1])
+        weights = batch_posteriors.smoothed_probs.reshape(-1, self.num_states)
+        rank = self.emission_rank
+
+        def _single_m_step(mean, factor, cov_diag, w):
+            # Posterior of the latent factors, with a constant one appended for the mean
+            chol, scaled_factor = self._capacitance_cholesky(factor, cov_diag)
+            Ez = cho_solve((chol, True), scaled_factor.T @ (emissions - mean).T).T
+            Ez = jnp.column_stack([Ez, jnp.ones(len(emissions))])
+            Covz = jnp.zeros((rank + 1, rank + 1)).at[:rank, :rank].set(cho_solve((chol, True), jnp.eye(rank)))
+
+            # Expected sufficient statistics of the augmented regression of x on z
+            sum_w = w.sum()
+            sum_xz = (w[:, None] * emissions).T @ Ez
+            sum_zz = (w[:, None] * Ez).T @ Ez + sum_w * Covz
+            sum_xsq = w @ emissions**2
+
+            augmented_factor = jnp.linalg.solve(sum_zz, sum_xz.T).T
+            residuals = sum_xsq - jnp.sum(augmented_factor * sum_xz, axis=1)
+            cov_diag = (2 * self._emission_prior_scale.value + residuals) / \
+                (sum_w + 2 * (self._emission_prior_shape.value + 1))
+            return augmented_factor[:, rank], augmented_factor[:, :rank], cov_diag
+
+        means, factors, cov_diags = vmap(_single_m_step, in_axes=(0, 0, 0, 1))(self._emission_means.value,
+                                                                               self._emission_cov_factors.value,
+                                                                               self._emission_cov_diags.value,
+                                                                               weights)
+        self._emission_means.value = means
+        self._emission_cov_factors.value = factors
+        self._emission_cov_diags.value = cov_diags
@@ -0,0 +1,342 @@
+from abc import abstractmethod
+from functools import partial
+
+import jax.numpy as jnp
+import jax.random as jr
+import tensorflow_probability.substrates.jax.bijectors as tfb
+import tensorflow_probability.substrates.jax.distributions as tfd
+from jax import tree_map
+from jax import vmap
+from jax.nn import softmax
+from jax.scipy.linalg import solve_triangular
+from jax.scipy.special import logsumexp
+from jax.tree_util import register_pytree_node_class
+from ssm_jax.abstractions import Parameter
+from ssm_jax.distributions import NormalInverseWishart
+from ssm_jax.hmm.inference import hmm_expected_statistics
+from ssm_jax.hmm.models.base import StandardHMM
+from ssm_jax.utils import PSDToRealBijector
+
+
+def _weights_log_prior(concentration, weights):
+    # A Dirichlet needs at least two components; a single weight is always one
+    if weights.shape[-1] == 1:
+        return 0.0
+    return tfd.Dirichlet(concentration).log_prob(weights).sum()
+
+
+def _weights_mode(concentration, counts):
+    if counts.shape[-1] == 1:
+        return jnp.ones_like(counts)
+    return tfd.Dirichlet(concentration + counts).mode()
+
+
+class _MixtureHMM(StandardHMM):
+    """Shared E-step of the Gaussian mixture HMMs. Subclasses define the
+    (T, K, M) `_component_log_likelihoods` and the per-component
+    `_mixture_statistics` of a single emission.
+    """
+
+    @property
+    def emission_weights(self):
+        return self._emission_weights
+
+    @property
+    def emission_means(self):
+        return self._emission_means
+
+    @property
+    def num_components(self):
+        return self._emission_weights.value.shape[1]
+
+    @abstractmethod
+    def _component_log_likelihoods(self, emissions):
+        raise NotImplementedError
+
+    @abstractmethod
+    def _mixture_statistics(self, emission, resps):
+        raise NotImplementedError
+
+    def log_likelihoods(self, emissions):
+        log_weights = jnp.log(self._emission_weights.value)
+        return logsumexp(log_weights + self._component_log_likelihoods(emissions), axis=-1)
+
+    # Expectation-maximization (EM) code
+    def _mixture_posteriors(self, emissions):
+        # Log likelihoods (T, K) and responsibilities (T, K, M) of the components
+        log_joint = jnp.log(self._emission_weights.value) + self._component_log_likelihoods(emissions)
+        return logsumexp(log_joint, axis=-1), softmax(log_joint, axis=-1)
+
+    def _emission_statistics(self, emission):
+        _, resps = self._mixture_posteriors(emission[None])
+        return self._mixture_statistics(emission, resps[0])
+
+    def expected_sufficient_statistics(self, batch_emissions, lengths=None):
+        """As in `BaseHMM`, but the component responsibilities of all time
+        steps are computed at once, along with the log likelihoods, and the
+        per-state statistics are weighted by them.
+        """
+        def _single_e_step(emissions, length):
+            log_likelihoods, resps = self._mixture_posteriors(emissions)
+            transition_matrices = self._compute_transition_matrices()
+            return hmm_expected_statistics(self._compute_initial_probs(),
+                                           transition_matrices,
+                                           log_likelihoods,
+                                           emissions=(emissions, resps),
+                                           emission_statistics_fn=lambda args: self._mixture_statistics(*args),
+                                           length=length,
+                                           reduce_sum=(transition_matrices.ndim == 2),
+                                           per_state_statistics=True)
+
+        return vmap(_single_e_step, in_axes=(0, None if lengths is None else 0))(batch_emissions, lengths)
+
+
+@register_pytree_node_class
+class GaussianMixtureHMM(_MixtureHMM):
+    """An HMM whose emission distribution in each state is a mixture of M
+    Gaussians with full covariances.
+
+    The mixture weights have Dirichlet priors and each component has a
+    normal inverse Wishart prior, as in the GaussianHMM. The E-step computes
+    the (T, K, M) responsibilities of each component for all time steps at
+    once, and sums per-component statistics weighted by them; the M-step is
+    then in closed form.
+    """
+
+    def __init__(self,
+                 initial_probabilities,
+                 transition_matrix,
+                 emission_weights,
+                 emission_means,
+                 emission_covariance_matrices,
+                 initial_probs_concentration=1.1,
+                 transition_matrix_concentration=1.1,
+                 emission_weights_concentration=1.1,
+                 emission_prior_mean=0.0,
+                 emission_prior_concentration=1e-4,
+                 emission_prior_scale=1e-4,
+                 emission_prior_extra_df=0.1):
+        """_summary_
+
+        Args:
+            initial_probabilities (_type_): _description_
+            transition_matrix (_type_): _description_
+            emission_weights (_type_): (num_states x num_components) mixture weights
+            emission_means (_type_): (num_states x num_components x emission_dim) means
+            emission_covariance_matrices (_type_): (num_states x num_components x emission_dim x emission_dim)
+        """
+        super().__init__(initial_probabilities, transition_matrix,
+                         initial_probs_concentration=initial_probs_concentration,
+                         transition_matrix_concentration=transition_matrix_concentration)
+
+        num_components, dim = emission_means.shape[-2:]
+        self._emission_weights = Parameter(emission_weights, bijector=tfb.Invert(tfb.SoftmaxCentered()))
+        self._emission_means = Parameter(emission_means)
+        self._emission_covs = Parameter(emission_covariance_matrices, bijector=PSDToRealBijector)
+
+        self._emission_weights_concentration = Parameter(emission_weights_concentration * jnp.ones(num_components),
+                                                         is_frozen=True,
+                                                         bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_mean = Parameter(emission_prior_mean * jnp.ones(dim), is_frozen=True)
+        self._emission_prior_conc = Parameter(emission_prior_concentration,
+                                              is_frozen=True,
+                                              bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_scale = Parameter(
+            emission_prior_scale if jnp.ndim(emission_prior_scale) == 2 \
+                else emission_prior_scale * jnp.eye(dim),
+            is_frozen=True,
+            bijector=PSDToRealBijector)
+        self._emission_prior_df = Parameter(dim + emission_prior_extra_df,
+                                            is_frozen=True,
+                                            bijector=tfb.Invert(tfb.Softplus()))
+
+    @classmethod
+    def random_initialization(cls, key, num_states, num_components, emission_dim):
+        key1, key2, key3, key4 = jr.split(key, 4)
+        initial_probs = jr.dirichlet(key1, jnp.ones(num_states))
+        transition_matrix = jr.dirichlet(key2, jnp.ones(num_states), (num_states,))
+        emission_weights = jr.dirichlet(key3, jnp.ones(num_components), (num_states,))
+        emission_means = jr.normal(key4, (num_states, num_components, emission_dim))
+        emission_covs = jnp.tile(jnp.eye(emission_dim), (num_states, num_components, 1, 1))
+        return cls(initial_probs, transition_matrix, emission_weights, emission_means, emission_covs)
+
+    # Properties to get various parameters of the model
+    @property
+    def emission_covariance_matrices(self):
+        return self._emission_covs
+
+    def emission_distribution(self, state):
+        return tfd.MixtureSameFamily(
+            tfd.Categorical(probs=self._emission_weights.value[state]),
+            tfd.MultivariateNormalFullCovariance(self._emission_means.value[state],
+                                                 self._emission_covs.value[state]))
+
+    def _component_log_likelihoods(self, emissions):
+        # Factor each covariance once and whiten all time steps with a single
+        # triangular solve per component. Returns a (T, K, M) array.
+        chols = jnp.linalg.cholesky(self._emission_covs.value)
+
+        def _single_log_likelihoods(mean, chol):
+            whitened = solve_triangular(chol, (emissions - mean).T, lower=True)
+            half_log_det = jnp.log(jnp.diag(chol)).sum()
+            return -0.5 * jnp.sum(whitened**2, axis=0) - half_log_det - 0.5 * mean.shape[-1] * jnp.log(2 * jnp.pi)
+
+        return vmap(vmap(_single_log_likelihoods, out_axes=1), out_axes=1)(self._emission_means.value, chols)
+
+    def log_prior(self):
+        lp = super().log_prior()
+        lp += _weights_log_prior(self._emission_weights_concentration.value, self._emission_weights.value)
+        lp += NormalInverseWishart(
+            self._emission_prior_mean.value,
+            self._emission_prior_conc.value,
+            self._emission_prior_df.value,
+            self._emission_prior_scale.value
+        ).log_prob((self._emission_covs.value, self._emission_means.value)).sum()
+        return lp
+
+    # Expectation-maximization (EM) code
+    def _mixture_statistics(self, emission, resps):
+        # Statistics of a single emission for each state and component, (K, M, ...)
+        return dict(sum_r=resps,
+                    sum_x=resps[..., None] * emission,
+                    sum_xxT=resps[..., None, None] * jnp.outer(emission, emission))
+
+    def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
+        # Sum the statistics across all batches
+        stats = tree_map(partial(jnp.sum, axis=0), batch_posteriors).emission_stats
+
+        # The mixture weights have a Dirichlet posterior
+        self._emission_weights.value = _weights_mode(self._emission_weights_concentration.value, stats["sum_r"])
+
+        # Each component has a NIW posterior, as in the GaussianHMM
+        mu0 = self._emission_prior_mean.value
+        kappa0 = self._emission_prior_conc.value
+        nu0 = self._emission_prior_df.value
+        Psi0 = self._emission_prior_scale.value
+
+        def _single_m_step(sum_w, sum_x, sum_xxT):
+            kappa_post = kappa0 + sum_w
+            mu_post = (kappa0 * mu0 + sum_x) / kappa_post
+            nu_post = nu0 + sum_w
+            Psi_post = Psi0 + kappa0 * jnp.outer(mu0, mu0) + sum_xxT - kappa_post * jnp.outer(mu_post, mu_post)
+            return NormalInverseWishart(mu_post, kappa_post, nu_post, Psi_post).mode()
+
+        covs, means = vmap(vmap(_single_m_step))(stats["sum_r"], stats["sum_x"], stats["sum_xxT"])
+        self._emission_covs.value = covs
+        self._emission_means.value = means
+
+
+@register_pytree_node_class
+class DiagonalGaussianMixtureHMM(_MixtureHMM):
+    """An HMM whose emission distribution in each state is a mixture of M
+    Gaussians with diagonal covariances, so that the cost of inference and
+    learning is linear in K * M * D.
+
+    The mixture weights have Dirichlet priors and each dimension of each
+    component has a normal inverse gamma prior, as in the DiagonalGaussianHMM.
+    """
+
+    def __init__(self,
+                 initial_probabilities,
+                 transition_matrix,
+                 emission_weights,
+                 emission_means,
+                 emission_cov_diags,
+                 initial_probs_concentration=1.1,
+                 transition_matrix_concentration=1.1,
+                 emission_weights_concentration=1.1,
+                 emission_prior_mean=0.0,
+                 emission_prior_concentration=1e-4,
+                 emission_prior_shape=0.1,
+                 emission_prior_scale=1e-4):
+        super().__init__(initial_probabilities, transition_matrix,
+                         initial_probs_concentration=initial_probs_concentration,
+                         transition_matrix_concentration=transition_matrix_concentration)
+
+        num_components, dim = emission_means.shape[-2:]
+        self._emission_weights = Parameter(emission_weights, bijector=tfb.Invert(tfb.SoftmaxCentered()))
+        self._emission_means = Parameter(emission_means)
+        self._emission_cov_diags = Parameter(emission_cov_diags, bijector=tfb.Invert(tfb.Softplus()))
+
+        self._emission_weights_concentration = Parameter(emission_weights_concentration * jnp.ones(num_components),
+                                                         is_frozen=True,
+                                                         bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_mean = Parameter(emission_prior_mean * jnp.ones(dim), is_frozen=True)
+        self._emission_prior_conc = Parameter(emission_prior_concentration,
+                                              is_frozen=True,
+                                              bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_shape = Parameter(emission_prior_shape,
+                                               is_frozen=True,
+                                               bijector=tfb.Invert(tfb.Softplus()))
+        self._emission_prior_scale = Parameter(emission_prior_scale,
+                                               is_frozen=True,
+                                               bijector=tfb.Invert(tfb.Softplus()))
+
+    @classmethod
+    def random_initialization(cls, key, num_states, num_components, emission_dim):
+        key1, key2, key3, key4 = jr.split(key, 4)
+        initial_probs = jr.dirichlet(key1, jnp.ones(num_states))
+        transition_matrix = jr.dirichlet(key2, jnp.ones(num_states), (num_states,))
+        emission_weights = jr.dirichlet(key3, jnp.ones(num_components), (num_states,))
+        emission_means = jr.normal(key4, (num_states, num_components, emission_dim))
+        emission_cov_diags = jnp.ones((num_states, num_components, emission_dim))
+        return cls(initial_probs, transition_matrix, emission_weights, emission_means, emission_cov_diags)
+
+    # Properties to get various parameters of the model
+    @property
+    def emission_cov_diags(self):
+        return self._emission_cov_diags
+
+    def emission_distribution(self, state):
+        return tfd.MixtureSameFamily(
+            tfd.Categorical(probs=self._emission_weights.value[state]),
+            tfd.MultivariateNormalDiag(self._emission_means.value[state],
+                                       jnp.sqrt(self._emission_cov_diags.value[state])))
+
+    def _component_log_likelihoods(self, emissions):
+        # Expand the squared distances into matrix products. Returns a (T, K, M) array.
+        precisions = 1 / self._emission_cov_diags.value
+        means = self._emission_means.value
+        quad = jnp.einsum("ti,kmi->tkm", emissions**2, precisions) \
+            - 2 * jnp.einsum("ti,kmi->tkm", emissions, means * precisions) \
+            + jnp.sum(means**2 * precisions, axis=-1)
+        log_dets = jnp.sum(jnp.log(self._emission_cov_diags.value), axis=-1)
+        return -0.5 * (quad + log_dets + emissions.shape[-1] * jnp.log(2 * jnp.pi))
+
+    def log_prior(self):
+        lp = super().log_prior()
+        cov_diags = self._emission_cov_diags.value
+        lp += _weights_log_prior(self._emission_weights_concentration.value, self._emission_weights.value)
+        lp += tfd.InverseGamma(self._emission_prior_shape.value,
+                               self._emission_prior_scale.value).log_prob(cov_diags).sum()
+        lp += tfd.Normal(self._emission_prior_mean.value,
+                         jnp.sqrt(cov_diags / self._emission_prior_conc.value)).log_prob(
+                             self._emission_means.value).sum()
+        return lp
+
+    # Expectation-maximization (EM) code
+    def _mixture_statistics(self, emission, resps):
+        return dict(sum_r=resps,
+                    sum_x=resps[..., None] * emission,
+                    sum_xsq=resps[..., None] * emission**2)
+
+    def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
+        # Sum the statistics across all batches
+        stats = tree_map(partial(jnp.sum, axis=0), batch_posteriors).emission_stats
+        sum_w = stats["sum_r"][..., None]
+        sum_x = stats["sum_x"]
+        sum_xsq = stats["sum_xsq"]
+
+        # The mixture weights have a Dirichlet posterior
+        self._emission_weights.value = _weights_mode(self._emission_weights_concentration.value, stats["sum_r"])
+
+        # Each dimension of each component has a NIG posterior, as in the DiagonalGaussianHMM
+        mu0 = self._emission_prior_mean.value
+        kappa0 = self._emission_prior_conc.value
+        kappa_post = kappa0 + sum_w
+        mu_post = (kappa0 * mu0 + sum_x) / kappa_post
+        shape_post = self._emission_prior_shape.value + 0.5 * sum_w
+        scale_post = self._emission_prior_scale.value + 0.5 * (sum_xsq + kappa0 * mu0**2 - kappa_post * mu_post**2)
+
+        self._emission_means.value = mu_post
+        self._emission_cov_diags.value = scale_post / (shape_post + 1.5)
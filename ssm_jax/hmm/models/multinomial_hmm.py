@@ -1,8 +1,12 @@
+from functools import partial
+
 import jax.numpy as jnp
 import jax.random as jr
 import tensorflow_probability.substrates.jax.bijectors as tfb
 import tensorflow_probability.substrates.jax.distributions as tfd
+from jax.scipy.special import gammaln
 from jax.tree_util import register_pytree_node_class
+from jax.tree_util import tree_map
 from ssm_jax.abstractions import Parameter
 from ssm_jax.hmm.models.base import StandardHMM
 
@@ -53,11 +57,11 @@ class MultinomialHMM(StandardHMM):
 
     @property
     def num_emissions(self):
-        return self.emission_probs.shape[1]
+        return self.emission_probs.value.shape[1]
 
     @property
     def num_classes(self):
-        return self.emission_probs.shape[2]
+        return self.emission_probs.value.shape[2]
 
     @property
     def num_trials(self):
@@ -66,10 +70,26 @@ class MultinomialHMM(StandardHMM):
     def emission_distribution(self, state):
         return tfd.Independent(tfd.Multinomial(self._num_trials,
                                                probs=self.emission_probs.value[state]),
-                               retinterpreted_batch_ndims=1)
+                               reinterpreted_batch_ndims=1)
+
+    def log_likelihoods(self, emissions):
+        log_probs = jnp.log(self.emission_probs.value)
+        log_normalizers = jnp.sum(gammaln(self._num_trials + 1.0) - gammaln(emissions + 1.0).sum(axis=-1), axis=-1)
+        return jnp.einsum("tdc,kdc->tk", emissions, log_probs) + log_normalizers[:, None]
 
     def log_prior(self):
-        lp = tfd.Dirichlet(self._initial_probs_concentration.value).log_prob(self.initial_probs.value)
-        lp += tfd.Dirichlet(self._transition_matrix_concentration.value).log_prob(self.transition_matrix.value).sum()
+        lp = super().log_prior()
         lp += tfd.Dirichlet(self._emission_prior_concentration.value).log_prob(self._emission_probs.value).sum()
         return lp
+
+    # Expectation-maximization (EM) code
+    def _emission_statistics(self, emission):
+        return dict(sum_x=emission)
+
+    def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
+        # Sum the statistics across all batches
+        stats = tree_map(partial(jnp.sum, axis=0), batch_posteriors)
+
+        # The expected counts give a Dirichlet posterior, as in the CategoricalHMM
+        self._emission_probs.value = tfd.Dirichlet(self._emission_prior_concentration.value +
+                                                   stats.emission_stats["sum_x"]).mode()
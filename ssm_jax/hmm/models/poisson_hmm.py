@@ -1,16 +1,13 @@
 from functools import partial
 
-import chex
 import jax.numpy as jnp
 import jax.random as jr
 import tensorflow_probability.substrates.jax.bijectors as tfb
 import tensorflow_probability.substrates.jax.distributions as tfd
 from jax import tree_map
-from jax import vmap
+from jax.scipy.special import gammaln
 from jax.tree_util import register_pytree_node_class
 from ssm_jax.abstractions import Parameter
-from ssm_jax.hmm.inference import compute_transition_probs
-from ssm_jax.hmm.inference import hmm_smoother
 from ssm_jax.hmm.models.base import StandardHMM
 
 
@@ -61,60 +58,25 @@ class PoissonHMM(StandardHMM):
         return tfd.Independent(tfd.Poisson(rate=self.emission_rates.value[state]),
                                reinterpreted_batch_ndims=1)
 
+    def log_likelihoods(self, emissions):
+        rates = self.emission_rates.value
+        return emissions @ jnp.log(rates).T - rates.sum(axis=1) - gammaln(emissions + 1.0).sum(axis=1)[:, None]
+
     def log_prior(self):
-        lp = tfd.Dirichlet(self._initial_probs_concentration.value).log_prob(self.initial_probs.value)
-        lp += tfd.Dirichlet(self._transition_matrix_concentration.value).log_prob(self.transition_matrix.value).sum()
+        lp = super().log_prior()
         lp += tfd.Gamma(self._emission_prior_concentration.value,
                           self._emission_prior_rate.value).log_prob(self._emission_rates.value).sum()
         return lp
 
-    def e_step(self, batch_emissions):
-        """The E-step computes expected sufficient statistics under the
-        posterior. In the Gaussian case, this these are the first two
-        moments of the data
-        """
-
-        @chex.dataclass
-        class PoissonHMMSuffStats:
-            # Wrapper for sufficient statistics of a BernoulliHMM
-            marginal_loglik: chex.Scalar
-            initial_probs: chex.Array
-            trans_probs: chex.Array
-            sum_w: chex.Array
-            sum_x: chex.Array
-
-        def _single_e_step(emissions):
-            # Run the smoother
-            posterior = hmm_smoother(self.initial_probs.value,
-                                     self.transition_matrix.value,
-                                     self._compute_conditional_logliks(emissions))
-
-            # Compute the initial state and transition probabilities
-            initial_probs = posterior.smoothed_probs[0]
-            trans_probs = compute_transition_probs(self.transition_matrix.value, posterior)
-
-            # Compute the expected sufficient statistics
-            sum_w = jnp.einsum("tk->k", posterior.smoothed_probs)[:, None]
-            sum_x = jnp.einsum("tk, ti->ki", posterior.smoothed_probs, emissions)
-
-            # Pack into a dataclass
-            stats = PoissonHMMSuffStats(
-                marginal_loglik=posterior.marginal_loglik,
-                initial_probs=initial_probs,
-                trans_probs=trans_probs,
-                sum_w=sum_w,
-                sum_x=sum_x,
-            )
-            return stats
-
-        # Map the E step calculations over batches
-        return vmap(_single_e_step)(batch_emissions)
+    # Expectation-maximization (EM) code
+    def _emission_statistics(self, emission):
+        return dict(sum_x=emission)
 
     def _m_step_emissions(self, batch_emissions, batch_posteriors, **kwargs):
         # Sum the statistics across all batches
         stats = tree_map(partial(jnp.sum, axis=0), batch_posteriors)
 
         # Then maximize the expected log probability as a fn of model parameters
-        post_concentration = self._emission_prior_concentration.value + stats.sum_x
-        post_rate = self._emission_prior_rate.value + stats.sum_w
+        post_concentration = self._emission_prior_concentration.value + stats.emission_stats["sum_x"]
+        post_rate = self._emission_prior_rate.value + stats.sum_w[:, None]
         self._emission_rates.value = tfd.Gamma(post_concentration, post_rate).mode()
@@ -1,7 +1,15 @@
 import jax.numpy as jnp
 import jax.random as jr
+import pytest
 from jax import vmap
+from ssm_jax.hmm.models.base import BaseHMM
+from ssm_jax.hmm.models.gaussian_hmm import DiagonalGaussianHMM
 from ssm_jax.hmm.models.gaussian_hmm import GaussianHMM
+from ssm_jax.hmm.models.gaussian_hmm import LowRankGaussianHMM
+from ssm_jax.hmm.models.gaussian_hmm import SharedCovarianceGaussianHMM
+from ssm_jax.hmm.models.gaussian_hmm import SphericalGaussianHMM
+from ssm_jax.hmm.transitions import BandedTransitionMatrix
+from ssm_jax.utils import pad_sequences
 
 
 def get_random_gaussian_hmm_params(key, num_states, num_emissions):
@@ -80,4 +88,148 @@ def test_fit_transition_matrix(key=jr.PRNGKey(0), num_states=3, num_emissions=3,
     losses = hmm.fit_sgd(batch_emissions)
     assert jnp.allclose(hmm.initial_probs.value, initial_probabilities)
     assert jnp.allclose(hmm.emission_means.value, emission_means)
-    assert jnp.allclose(hmm.emission_covariance_matrices.value, emission_covars)
\ No newline at end of file
+    assert jnp.allclose(hmm.emission_covariance_matrices.value, emission_covars)
+
+
+def test_fit_em_banded(key=jr.PRNGKey(0), num_states=4, num_emissions=2, num_samples=5, offsets=(0, 1)):
+    init_key, sample_key = jr.split(key, 2)
+    initial_probabilities = jnp.ones(num_states) / num_states
+    emission_means = jr.normal(init_key, (num_states, num_emissions))
+    emission_covars = jnp.tile(jnp.eye(num_emissions), (num_states, 1, 1))
+    transition_matrix = 0.9 * jnp.eye(num_states) + 0.1 * jnp.eye(num_states, k=1)
+    transition_matrix = transition_matrix.at[-1, -1].set(1.0)
+    banded_matrix = BandedTransitionMatrix.from_dense(transition_matrix, offsets)
+
+    hmm = GaussianHMM(initial_probabilities, transition_matrix, emission_means, emission_covars)
+    banded_hmm = GaussianHMM(initial_probabilities, banded_matrix, emission_means, emission_covars)
+
+    keys = jr.split(sample_key, num_samples)
+    _, batch_emissions = vmap(lambda rng: banded_hmm.sample(rng, 20))(keys)
+
+    # The banded model should have the same likelihood and expected transition counts
+    assert jnp.allclose(hmm.marginal_log_prob(batch_emissions[0]), banded_hmm.marginal_log_prob(batch_emissions[0]))
+    assert jnp.isfinite(banded_hmm.log_prior())
+    stats = hmm.e_step(batch_emissions)
+    banded_stats = banded_hmm.e_step(batch_emissions)
+    assert jnp.allclose(stats.trans_probs, vmap(BandedTransitionMatrix.todense)(banded_stats.trans_probs), atol=1e-4)
+
+    # EM should keep the band structure and normalized rows
+    banded_hmm.fit_em(batch_emissions, num_iters=2)
+    learned_matrix = banded_hmm.transition_matrix.value.todense()
+    assert jnp.allclose(learned_matrix.sum(axis=1), 1.0)
+    assert jnp.allclose(learned_matrix, jnp.triu(jnp.tril(learned_matrix, 1)))
+
+
+def test_fit_em_ragged(key=jr.PRNGKey(0), num_states=3, num_emissions=2, lengths=(4, 30, 7, 25, 12, 9)):
+    init_key, sample_key = jr.split(key, 2)
+    initial_probabilities = jnp.ones(num_states) / num_states
+    transition_matrix = 0.8 * jnp.eye(num_states) + 0.2 / num_states
+    emission_means = jr.normal(init_key, (num_states, num_emissions))
+    emission_covars = jnp.tile(jnp.eye(num_emissions), (num_states, 1, 1))
+    hmm = GaussianHMM(initial_probabilities, transition_matrix, emission_means, emission_covars)
+
+    keys = jr.split(sample_key, len(lengths))
+    _, batch_emissions = vmap(lambda rng: hmm.sample(rng, max(lengths)))(keys)
+    lengths = jnp.array(lengths)
+    batch_emissions, _ = pad_sequences(batch_emissions, lengths)
+
+    # Statistics of the padded batch match those of each sequence on its own
+    stats = hmm.e_step(batch_emissions, lengths)
+    for i, length in enumerate(lengths):
+        single_stats = hmm.e_step(batch_emissions[i:i + 1, :length])
+        assert jnp.allclose(stats.marginal_loglik[i], single_stats.marginal_loglik[0])
+        assert jnp.allclose(stats.sum_w[i], single_stats.sum_w[0], atol=1e-4)
+        assert jnp.allclose(stats.trans_probs[i], single_stats.trans_probs[0], atol=1e-4)
+
+    # Bucketing by length gives the same fit as padding to the maximum length
+    hmm_bucketed = GaussianHMM(initial_probabilities, transition_matrix, emission_means, emission_covars)
+    log_probs = hmm.fit_em(batch_emissions, num_iters=2, lengths=lengths)
+    log_probs_bucketed = hmm_bucketed.fit_em(batch_emissions, num_iters=2, lengths=lengths, num_buckets=3)
+    assert jnp.allclose(log_probs, log_probs_bucketed)
+    assert jnp.allclose(hmm.emission_means.value, hmm_bucketed.emission_means.value, atol=1e-4)
+
+
+def test_fit_em_tol(key=jr.PRNGKey(0), num_states=3, num_emissions=2, num_samples=5, num_iters=50):
+    init_key, sample_key = jr.split(key, 2)
+    initial_probabilities, transition_matrix, emission_means, emission_covars = get_random_gaussian_hmm_params(
+        init_key, num_states, num_emissions)
+    hmm = GaussianHMM(initial_probabilities, transition_matrix, emission_means, emission_covars)
+    keys = jr.split(sample_key, num_samples)
+    _, batch_emissions = vmap(lambda rng: hmm.sample(rng, 20))(keys)
+
+    # Early stopping truncates the trace of running all iterations
+    hmm_full = GaussianHMM(initial_probabilities, transition_matrix, emission_means + 1.0, emission_covars)
+    hmm_tol = GaussianHMM(initial_probabilities, transition_matrix, emission_means + 1.0, emission_covars)
+    log_probs = hmm_full.fit_em(batch_emissions, num_iters=num_iters)
+    progress = []
+    log_probs_tol = hmm_tol.fit_em(batch_emissions, num_iters=num_iters, tol=1e-3,
+                                   callback=lambda itr, lp: progress.append((int(itr), float(lp))))
+    assert len(log_probs) == num_iters
+    assert 1 < len(log_probs_tol) < num_iters
+    assert jnp.allclose(log_probs[:len(log_probs_tol)], log_probs_tol)
+    assert jnp.abs(log_probs_tol[-1] - log_probs_tol[-2]) <= 1e-3 * jnp.abs(log_probs_tol[-2])
+    assert [itr for itr, _ in progress] == list(range(len(log_probs_tol)))
+    assert jnp.allclose(jnp.array([lp for _, lp in progress]), log_probs_tol)
+
+
+def test_fit_em_restarts(key=jr.PRNGKey(0), num_states=3, num_emissions=2, num_samples=5, num_restarts=4):
+    init_key, sample_key, restart_key = jr.split(key, 3)
+    initial_probabilities, transition_matrix, emission_means, emission_covars = get_random_gaussian_hmm_params(
+        init_key, num_states, num_emissions)
+    hmm = GaussianHMM(initial_probabilities, transition_matrix, emission_means, emission_covars)
+    keys = jr.split(sample_key, num_samples)
+    _, batch_emissions = vmap(lambda rng: hmm.sample(rng, 20))(keys)
+
+    best_hmm, log_probs = GaussianHMM.fit_em_restarts(restart_key, num_restarts, batch_emissions,
+                                                      num_states, num_emissions, num_iters=5)
+    assert log_probs.shape == (num_restarts, 5)
+
+    # Each restart matches fitting its initialization on its own
+    for i, key in enumerate(jr.split(restart_key, num_restarts)):
+        single_hmm = GaussianHMM.random_initialization(key, num_states, num_emissions)
+        assert jnp.allclose(single_hmm.fit_em(batch_emissions, num_iters=5), log_probs[i], rtol=1e-4)
+        if i == jnp.argmax(log_probs[:, -1]):
+            assert jnp.allclose(single_hmm.emission_means.value, best_hmm.emission_means.value, atol=1e-3)
+
+
+def test_fit_stochastic_em(key=jr.PRNGKey(0), num_states=3, num_emissions=2, num_samples=20, batch_size=4):
+    init_key, sample_key, fit_key = jr.split(key, 3)
+    initial_probabilities, transition_matrix, emission_means, emission_covars = get_random_gaussian_hmm_params(
+        init_key, num_states, num_emissions)
+    hmm = GaussianHMM(initial_probabilities, transition_matrix, emission_means, emission_covars)
+    keys = jr.split(sample_key, num_samples)
+    _, batch_emissions = vmap(lambda rng: hmm.sample(rng, 20))(keys)
+
+    # With the full batch as the only minibatch and a unit step size, this is EM
+    hmm_em = GaussianHMM.random_initialization(fit_key, num_states, num_emissions)
+    hmm_sem = GaussianHMM.random_initialization(fit_key, num_states, num_emissions)
+    log_probs = hmm_em.fit_em(batch_emissions, num_iters=3)
+    log_probs_sem = hmm_sem.fit_stochastic_em([batch_emissions], num_sequences=num_samples, num_epochs=3,
+                                              schedule=lambda step: 1.0)
+    assert jnp.allclose(log_probs, log_probs_sem, rtol=1e-4)
+    assert jnp.allclose(hmm_em.emission_means.value, hmm_sem.emission_means.value, atol=1e-3)
+
+    # One pass over a stream of minibatches improves the fit
+    hmm_stream = GaussianHMM.random_initialization(fit_key, num_states, num_emissions)
+    initial_lp = vmap(hmm_stream.marginal_log_prob)(batch_emissions).sum()
+    minibatches = (batch_emissions[i:i + batch_size] for i in range(0, num_samples, batch_size))
+    log_probs_stream = hmm_stream.fit_stochastic_em(minibatches, num_sequences=num_samples)
+    assert log_probs_stream.shape == (num_samples // batch_size,)
+    assert vmap(hmm_stream.marginal_log_prob)(batch_emissions).sum() > initial_lp
+
+
+@pytest.mark.parametrize("cls, init_args", [(DiagonalGaussianHMM, ()), (SphericalGaussianHMM, ()),
+                                             (SharedCovarianceGaussianHMM, ()), (LowRankGaussianHMM, (2,))])
+def test_covariance_structures(cls, init_args, key=jr.PRNGKey(0), num_states=3, num_emissions=5, num_samples=5):
+    true_key, sample_key, init_key = jr.split(key, 3)
+    true_hmm = cls.random_initialization(true_key, num_states, num_emissions, *init_args)
+    _, batch_emissions = vmap(lambda rng: true_hmm.sample(rng, 50))(jr.split(sample_key, num_samples))
+
+    # The structured log likelihoods match the generic per-state evaluation
+    hmm = cls.random_initialization(init_key, num_states, num_emissions, *init_args)
+    assert jnp.allclose(hmm.log_likelihoods(batch_emissions[0]),
+                        BaseHMM.log_likelihoods(hmm, batch_emissions[0]), atol=1e-3)
+
+    # The closed-form M-steps never decrease the log joint probability
+    log_probs = hmm.fit_em(batch_emissions, num_iters=10)
+    assert jnp.all(jnp.diff(log_probs) > -1e-3 * jnp.abs(log_probs[:-1]))
@@ -0,0 +1,59 @@
+import jax.numpy as jnp
+import jax.random as jr
+import pytest
+from jax import vmap
+from ssm_jax.hmm.models.base import BaseHMM
+from ssm_jax.hmm.models.gaussian_hmm import DiagonalGaussianHMM
+from ssm_jax.hmm.models.gaussian_hmm import GaussianHMM
+from ssm_jax.hmm.models.gmm_hmm import DiagonalGaussianMixtureHMM
+from ssm_jax.hmm.models.gmm_hmm import GaussianMixtureHMM
+
+
+@pytest.mark.parametrize("cls", [GaussianMixtureHMM, DiagonalGaussianMixtureHMM])
+def test_fit_em(cls, key=jr.PRNGKey(0), num_states=3, num_components=2, num_emissions=3, num_samples=5):
+    true_key, sample_key, init_key = jr.split(key, 3)
+    true_hmm = cls.random_initialization(true_key, num_states, num_components, num_emissions)
+    _, batch_emissions = vmap(lambda rng: true_hmm.sample(rng, 50))(jr.split(sample_key, num_samples))
+
+    # The batched log likelihoods match the generic per-state evaluation
+    hmm = cls.random_initialization(init_key, num_states, num_components, num_emissions)
+    assert jnp.allclose(hmm.log_likelihoods(batch_emissions[0]),
+                        BaseHMM.log_likelihoods(hmm, batch_emissions[0]), atol=1e-3)
+
+    # The closed-form M-step never decreases the log joint probability
+    log_probs = hmm.fit_em(batch_emissions, num_iters=10)
+    assert jnp.all(jnp.diff(log_probs) > -1e-3 * jnp.abs(log_probs[:-1]))
+
+
+@pytest.mark.parametrize("cls, single_cls", [(GaussianMixtureHMM, GaussianHMM),
+                                             (DiagonalGaussianMixtureHMM, DiagonalGaussianHMM)])
+def test_single_component(cls, single_cls, key=jr.PRNGKey(0), num_states=3, num_emissions=2, num_samples=5):
+    sample_key, init_key = jr.split(key)
+    true_hmm = single_cls.random_initialization(key, num_states, num_emissions)
+    _, batch_emissions = vmap(lambda rng: true_hmm.sample(rng, 30))(jr.split(sample_key, num_samples))
+
+    # With one component, EM reduces to that of the Gaussian HMM
+    hmm = single_cls.random_initialization(init_key, num_states, num_emissions)
+    gmm_hmm = cls.random_initialization(init_key, num_states, 1, num_emissions)
+    gmm_hmm.initial_probs.value = hmm.initial_probs.value
+    gmm_hmm.transition_matrix.value = hmm.transition_matrix.value
+    gmm_hmm.emission_means.value = hmm.emission_means.value[:, None]
+    hmm.fit_em(batch_emissions, num_iters=3)
+    gmm_hmm.fit_em(batch_emissions, num_iters=3)
+    assert jnp.allclose(gmm_hmm.emission_means.value[:, 0], hmm.emission_means.value, atol=1e-3)
+    assert jnp.allclose(vmap(gmm_hmm.marginal_log_prob)(batch_emissions).sum(),
+                        vmap(hmm.marginal_log_prob)(batch_emissions).sum(), rtol=1e-4)
+
+
+@pytest.mark.parametrize("cls", [GaussianMixtureHMM, DiagonalGaussianMixtureHMM])
+def test_expected_statistics(cls, key=jr.PRNGKey(0), num_states=3, num_components=2, num_emissions=3):
+    hmm = cls.random_initialization(key, num_states, num_components, num_emissions)
+    _, emissions = hmm.sample(jr.PRNGKey(1), 40)
+
+    # The per-component statistics are the joint posterior of the state and component
+    stats = hmm.expected_sufficient_statistics(emissions[None])
+    smoothed_probs = hmm.smoother(emissions).smoothed_probs
+    _, resps = hmm._mixture_posteriors(emissions)
+    joint_probs = smoothed_probs[:, :, None] * resps
+    assert jnp.allclose(stats.emission_stats["sum_r"][0], joint_probs.sum(axis=0), atol=1e-4)
+    assert jnp.allclose(stats.emission_stats["sum_x"][0], jnp.einsum("tkm,ti->kmi", joint_probs, emissions), atol=1e-3)
@@ -3,7 +3,12 @@ import pytest
 import jax.numpy as jnp
 import jax.random as jr
 import optax
+from ssm_jax.hmm.models import BernoulliHMM
+from ssm_jax.hmm.models import CategoricalHMM
 from ssm_jax.hmm.models import GaussianHMM
+from ssm_jax.hmm.models import PoissonHMM
+from ssm_jax.hmm.models.base import BaseHMM
+from ssm_jax.hmm.models.multinomial_hmm import MultinomialHMM
 
 
 def make_rnd_hmm(num_states=5, emission_dim=2):
@@ -35,6 +40,25 @@ def test_loglik():
     assert jnp.allclose(true_hmm.marginal_log_prob(batch_emissions[0]), 3149.1047, atol=1e-1)
 
 
+@pytest.mark.parametrize("cls, init_args", [(BernoulliHMM, (3,)), (CategoricalHMM, (2, 4)), (GaussianHMM, (3,)),
+                                             (MultinomialHMM, (2, 4, 5)), (PoissonHMM, (3,))])
+def test_log_likelihoods(cls, init_args, num_states=4, num_timesteps=50):
+    hmm = cls.random_initialization(jr.PRNGKey(0), num_states, *init_args)
+    _, emissions = hmm.sample(jr.PRNGKey(1), num_timesteps)
+    # The batched kernel matches the generic per-state evaluation
+    lls = hmm.log_likelihoods(emissions)
+    assert lls.shape == (num_timesteps, num_states)
+    assert jnp.allclose(lls, BaseHMM.log_likelihoods(hmm, emissions), atol=1e-3)
+
+
+def test_bernoulli_log_likelihoods_degenerate():
+    # Emission probabilities of exactly 0 or 1 give finite log likelihoods where they are attainable
+    hmm = BernoulliHMM(jnp.ones(2) / 2, jnp.eye(2), jnp.array([[0.0, 1.0], [0.5, 0.5]]))
+    lls = hmm.log_likelihoods(jnp.array([[0.0, 1.0], [1.0, 1.0]]))
+    assert jnp.allclose(lls[0], jnp.array([0.0, 2 * jnp.log(0.5)]))
+    assert lls[1, 0] == -jnp.inf and jnp.isfinite(lls[1, 1])
+
+
 def test_hmm_fit_em(num_iters=2):
     true_hmm, _, batch_emissions = make_rnd_model_and_data()
     test_hmm = GaussianHMM.random_initialization(jr.PRNGKey(1), 2 * true_hmm.num_states, true_hmm.num_obs)
@@ -0,0 +1,41 @@
+import jax.numpy as jnp
+import optax
+import jax.random as jr
+from jax import vmap
+from ssm_jax.hmm.inference import hmm_smoother
+from ssm_jax.hmm.models.base import BaseHMM
+from ssm_jax.hmm.models.base import StandardHMM
+from ssm_jax.hmm.models.multinomial_hmm import MultinomialHMM
+
+
+def test_m_step(key=jr.PRNGKey(0), num_states=3, num_emissions=2, num_classes=4, num_trials=5, num_samples=4):
+    true_key, sample_key, init_key = jr.split(key, 3)
+    true_hmm = MultinomialHMM.random_initialization(true_key, num_states, num_emissions, num_classes, num_trials)
+    _, batch_emissions = vmap(lambda key: true_hmm.sample(key, 50))(jr.split(sample_key, num_samples))
+
+    # One EM iteration sets the emission probabilities to the Dirichlet mode
+    # given the expected counts under the posterior.
+    hmm = MultinomialHMM.random_initialization(init_key, num_states, num_emissions, num_classes, num_trials)
+    expected_counts = 0
+    for emissions in batch_emissions:
+        posterior = hmm_smoother(hmm.initial_probs.value, hmm.transition_matrix.value,
+                                 hmm._compute_conditional_logliks(emissions))
+        expected_counts += jnp.einsum("tk,tdc->kdc", posterior.smoothed_probs, emissions)
+    mode = 1.1 + expected_counts - 1
+    hmm.fit_em(batch_emissions, num_iters=1)
+    assert jnp.allclose(hmm.emission_probs.value, mode / mode.sum(axis=-1, keepdims=True), atol=1e-4)
+
+
+def test_generic_m_step(key=jr.PRNGKey(0), num_states=2, num_emissions=2, num_classes=3, num_trials=5):
+    true_key, sample_key, init_key = jr.split(key, 3)
+    true_hmm = MultinomialHMM.random_initialization(true_key, num_states, num_emissions, num_classes, num_trials)
+    _, emissions = true_hmm.sample(sample_key, 200)
+    batch_emissions = emissions[None]
+
+    # Given the same posterior, the SGD fallback of StandardHMM approaches the closed-form M-step
+    hmm1 = MultinomialHMM.random_initialization(init_key, num_states, num_emissions, num_classes, num_trials)
+    hmm2 = MultinomialHMM.random_initialization(init_key, num_states, num_emissions, num_classes, num_trials)
+    hmm1._m_step_emissions(batch_emissions, hmm1.e_step(batch_emissions))
+    StandardHMM._m_step_emissions(hmm2, batch_emissions, BaseHMM.e_step(hmm2, batch_emissions),
+                                  optimizer=optax.adam(1e-1), num_mstep_iters=500)
+    assert jnp.allclose(hmm1.emission_probs.value, hmm2.emission_probs.value, atol=5e-2)
@@ -0,0 +1,306 @@
+from abc import ABC
+from abc import abstractmethod
+from functools import reduce
+
+import jax.numpy as jnp
+from jax import vmap
+from jax.nn import softmax
+from jax.tree_util import register_pytree_node_class
+from jax.tree_util import tree_map
+
+
+class TransitionOperator(ABC):
+    """A structured transition matrix A(j,k) = prob(hid(t)=k | hid(t-1)=j).
+
+    The HMM inference functions accept a TransitionOperator wherever they
+    accept a dense (K, K) transition matrix. They only touch it through
+    `predict` (A.T @ probs) and `matvec` (A @ beta), so prediction costs
+    whatever those cost for the given structure instead of O(K^2).
+
+    Subclasses must be registered as JAX PyTrees. Leading batch dimensions
+    on all of their arrays, i.e. `batch_shape == (T-1,)`, give a
+    time-varying transition matrix, just like a (T-1, K, K) dense array.
+    """
+
+    @property
+    @abstractmethod
+    def num_states(self):
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def batch_shape(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def predict(self, probs):
+        """Compute A.T @ probs."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def matvec(self, vector):
+        """Compute A @ vector."""
+        raise NotImplementedError
+
+    # Array-like attributes, so that operators can be passed wherever
+    # a (K, K) or (T-1, K, K) array is expected.
+    @property
+    def ndim(self):
+        return len(self.batch_shape) + 2
+
+    @property
+    def shape(self):
+        return self.batch_shape + (self.num_states, self.num_states)
+
+    def __getitem__(self, t):
+        return tree_map(lambda x: x[t], self)
+
+    def todense(self):
+        """Return the dense (K, K) matrix, or (T-1, K, K) if time-varying."""
+        if self.batch_shape:
+            return vmap(lambda t: self[t].todense())(jnp.arange(self.batch_shape[0]))
+        return vmap(self.matvec, in_axes=1, out_axes=1)(jnp.eye(self.num_states))
+
+    def max_product(self, scores):
+        """Compute max_j log A[i, j] + scores[j] and its argmax for each i."""
+        scores = jnp.log(self.todense()) + scores
+        return jnp.max(scores, axis=1), jnp.argmax(scores, axis=1)
+
+    def rescale(self, left, right):
+        """Compute diag(left) @ A @ diag(right) as a dense array."""
+        return left[:, None] * self.todense() * right[None, :]
+
+
+@register_pytree_node_class
+class BandedTransitionMatrix(TransitionOperator):
+    """A transition matrix whose nonzero entries lie on a few diagonals,
+
+        A[i, i + offsets[d]] = diagonals[i, d]
+
+    Entries whose column falls outside [0, K) are ignored. Left-to-right and
+    explicit-duration HMMs have this structure, and predicting or smoothing
+    with it costs O(K D) per time step instead of O(K^2).
+
+    A leading time axis on `diagonals`, i.e. shape (T-1, K, D), gives a
+    time-varying transition matrix, just like a (T-1, K, K) dense array.
+    """
+
+    def __init__(self, diagonals, offsets):
+        self.diagonals = diagonals
+        self.offsets = tuple(int(offset) for offset in offsets)
+
+    def __repr__(self):
+        return f"BandedTransitionMatrix(diagonals={self.diagonals}, offsets={self.offsets})"
+
+    def tree_flatten(self):
+        return (self.diagonals,), self.offsets
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(children[0], aux_data)
+
+    @classmethod
+    def from_dense(cls, transition_matrix, offsets):
+        """Extract the given diagonals from a dense (K, K) transition matrix."""
+        template = cls(jnp.zeros(transition_matrix.shape[:-1] + (len(offsets),)), offsets)
+        rows = jnp.arange(template.num_states)[:, None]
+        diagonals = transition_matrix.at[..., rows, template._safe_columns].get(mode="fill", fill_value=0.0)
+        return cls(diagonals, offsets)
+
+    @property
+    def num_states(self):
+        return self.diagonals.shape[-2]
+
+    @property
+    def batch_shape(self):
+        return self.diagonals.shape[:-2]
+
+    @property
+    def _columns(self):
+        return jnp.arange(self.num_states)[:, None] + jnp.array(self.offsets)
+
+    @property
+    def mask(self):
+        """Boolean array (K, D) indicating which entries of `diagonals` are in range."""
+        columns = self._columns
+        return (columns >= 0) & (columns < self.num_states)
+
+    @property
+    def _safe_columns(self):
+        # Send out-of-range columns past the end, where they are dropped on scatter
+        # and filled on gather (negative indices would wrap around instead).
+        return jnp.where(self.mask, self._columns, self.num_states)
+
+    def todense(self):
+        rows = jnp.arange(self.num_states)[:, None]
+        return jnp.zeros(self.shape).at[..., rows, self._safe_columns].add(self.diagonals, mode="drop")
+
+    def predict(self, probs):
+        return jnp.zeros(self.num_states).at[self._safe_columns].add(probs[:, None] * self.diagonals, mode="drop")
+
+    def matvec(self, vector):
+        vector_next = vector.at[self._safe_columns].get(mode="fill", fill_value=0.0)
+        return jnp.sum(self.diagonals * vector_next, axis=1)
+
+    def max_product(self, scores):
+        scores_next = scores.at[self._safe_columns].get(mode="fill", fill_value=-jnp.inf)
+        scores = jnp.log(self.diagonals) + scores_next
+        best = jnp.argmax(scores, axis=1)
+        return jnp.max(scores, axis=1), jnp.take_along_axis(self._columns, best[:, None], axis=1)[:, 0]
+
+    def rescale(self, left, right):
+        """Compute diag(left) @ A @ diag(right), keeping the band structure."""
+        right_next = right.at[self._safe_columns].get(mode="fill", fill_value=0.0)
+        return BandedTransitionMatrix(left[:, None] * self.diagonals * right_next, self.offsets)
+
+
+@register_pytree_node_class
+class LowRankTransitionMatrix(TransitionOperator):
+    """A transition matrix that is diagonal plus low rank,
+
+        A = diag(diagonal) + left_factors @ right_factors.T
+
+    with `left_factors` and `right_factors` of shape (K, r). For example, a
+    "sticky" HMM with A = diag(stickiness) + (1 - stickiness) 1 pi^T has rank
+    one. Prediction costs O(K r).
+    """
+
+    def __init__(self, diagonal, left_factors, right_factors):
+        self.diagonal = diagonal
+        self.left_factors = left_factors
+        self.right_factors = right_factors
+
+    def __repr__(self):
+        return f"LowRankTransitionMatrix(diagonal={self.diagonal}, " \
+               f"left_factors={self.left_factors}, " \
+               f"right_factors={self.right_factors})"
+
+    def tree_flatten(self):
+        return (self.diagonal, self.left_factors, self.right_factors), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
+
+    @property
+    def num_states(self):
+        return self.diagonal.shape[-1]
+
+    @property
+    def batch_shape(self):
+        return self.diagonal.shape[:-1]
+
+    def predict(self, probs):
+        return self.diagonal * probs + self.right_factors @ (self.left_factors.T @ probs)
+
+    def matvec(self, vector):
+        return self.diagonal * vector + self.left_factors @ (self.right_factors.T @ vector)
+
+
+@register_pytree_node_class
+class KroneckerTransitionMatrix(TransitionOperator):
+    """The transition matrix of a factorial HMM with independent chains,
+
+        A = factors[0] kron factors[1] kron ... kron factors[M-1]
+
+    where the state index is the row-major (C-order) ravel of the per-chain
+    states. Prediction costs O(K sum_m K_m) instead of O(K^2).
+    """
+
+    def __init__(self, factors):
+        self.factors = tuple(factors)
+
+    def __repr__(self):
+        return f"KroneckerTransitionMatrix(factors={self.factors})"
+
+    def tree_flatten(self):
+        return (self.factors,), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
+
+    @property
+    def num_states(self):
+        return reduce(lambda k, factor: k * factor.shape[-1], self.factors, 1)
+
+    @property
+    def batch_shape(self):
+        return self.factors[0].shape[:-2]
+
+    def _apply(self, vector, transpose):
+        tensor = vector.reshape(tuple(factor.shape[-1] for factor in self.factors))
+        for axis, factor in enumerate(self.factors):
+            factor = factor.T if transpose else factor
+            tensor = jnp.moveaxis(jnp.tensordot(factor, tensor, axes=(1, axis)), 0, axis)
+        return tensor.reshape(-1)
+
+    def predict(self, probs):
+        return self._apply(probs, transpose=True)
+
+    def matvec(self, vector):
+        return self._apply(vector, transpose=False)
+
+
+@register_pytree_node_class
+class CirculantTransitionMatrix(TransitionOperator):
+    """A circulant transition matrix, A[i, j] = first_row[(j - i) mod K].
+
+    This describes random walks on a ring, e.g. of head directions or phases.
+    Prediction is a circular convolution computed with the FFT in O(K log K).
+    """
+
+    def __init__(self, first_row):
+        self.first_row = first_row
+
+    def __repr__(self):
+        return f"CirculantTransitionMatrix(first_row={self.first_row})"
+
+    def tree_flatten(self):
+        return (self.first_row,), None
+
+    @classmethod
+    def tree_unflatten(cls, aux_data, children):
+        return cls(*children)
+
+    @property
+    def num_states(self):
+        return self.first_row.shape[-1]
+
+    @property
+    def batch_shape(self):
+        return self.first_row.shape[:-1]
+
+    def predict(self, probs):
+        # (A.T p)[j] = sum_i first_row[(j - i) mod K] p[i] is a circular convolution.
+        # Clip the round-off of the FFT so probabilities stay nonnegative.
+        result = jnp.fft.irfft(jnp.fft.rfft(self.first_row) * jnp.fft.rfft(probs), n=self.num_states)
+        return jnp.maximum(result, 0.0)
+
+    def matvec(self, vector):
+        # (A v)[i] = sum_j first_row[(j - i) mod K] v[j] is a circular cross-correlation.
+        result = jnp.fft.irfft(jnp.conj(jnp.fft.rfft(self.first_row)) * jnp.fft.rfft(vector), n=self.num_states)
+        return jnp.maximum(result, 0.0)
+
+
+class BandedSoftmaxBijector:
+    """Map a banded transition matrix to unconstrained logits of shape (K, D)
+    and back. The inverse applies a softmax over the in-range entries of each
+    row, so out-of-range entries stay exactly zero.
+    """
+
+    def __init__(self, offsets):
+        self.offsets = tuple(offsets)
+
+    def __repr__(self):
+        return f"BandedSoftmaxBijector(offsets={self.offsets})"
+
+    def __call__(self, matrix):
+        return self.forward(matrix)
+
+    def forward(self, matrix):
+        return jnp.log(jnp.where(matrix.mask, matrix.diagonals, 1.0))
+
+    def inverse(self, logits):
+        mask = BandedTransitionMatrix(logits, self.offsets).mask
+        return BandedTransitionMatrix(softmax(jnp.where(mask, logits, -jnp.inf), axis=-1), self.offsets)
@@ -0,0 +1,54 @@
+import jax.numpy as jnp
+import jax.random as jr
+import pytest
+from ssm_jax.hmm.transitions import BandedTransitionMatrix
+from ssm_jax.hmm.transitions import CirculantTransitionMatrix
+from ssm_jax.hmm.transitions import KroneckerTransitionMatrix
+from ssm_jax.hmm.transitions import LowRankTransitionMatrix
+
+
+def _normalize_rows(x):
+    return x / x.sum(-1, keepdims=True)
+
+
+def random_transition_operator(key, structure, num_states=6, batch_shape=()):
+    k1, k2, k3 = jr.split(key, 3)
+    if structure == "banded":
+        banded = BandedTransitionMatrix.from_dense(jr.uniform(k1, batch_shape + (num_states, num_states)), (-1, 0, 2))
+        return BandedTransitionMatrix(_normalize_rows(banded.diagonals), banded.offsets)
+    elif structure == "low_rank":
+        stickiness = jr.uniform(k1, batch_shape + (num_states,))
+        probs = _normalize_rows(jr.uniform(k2, batch_shape + (num_states,)))
+        return LowRankTransitionMatrix(stickiness, (1 - stickiness)[..., None], probs[..., None])
+    elif structure == "kronecker":
+        factor1 = _normalize_rows(jr.uniform(k1, batch_shape + (2, 2)))
+        factor2 = _normalize_rows(jr.uniform(k2, batch_shape + (num_states // 2, num_states // 2)))
+        return KroneckerTransitionMatrix((factor1, factor2))
+    elif structure == "circulant":
+        return CirculantTransitionMatrix(_normalize_rows(jr.uniform(k1, batch_shape + (num_states,))))
+    raise ValueError(structure)
+
+
+@pytest.mark.parametrize("structure", ["banded", "low_rank", "kronecker", "circulant"])
+def test_transition_operator(structure, key=0, num_states=6):
+    if isinstance(key, int):
+        key = jr.PRNGKey(key)
+
+    k1, k2 = jr.split(key)
+    operator = random_transition_operator(k1, structure, num_states)
+    dense = operator.todense()
+    assert dense.shape == operator.shape == (num_states, num_states)
+    assert jnp.allclose(dense.sum(axis=1), 1.0)
+
+    probs = jr.uniform(k2, (num_states,))
+    assert jnp.allclose(operator.predict(probs), dense.T @ probs, atol=1e-6)
+    assert jnp.allclose(operator.matvec(probs), dense @ probs, atol=1e-6)
+
+    scores, states = operator.max_product(probs)
+    assert jnp.allclose(scores, jnp.max(jnp.log(dense) + probs, axis=1))
+    assert jnp.all(states == jnp.argmax(jnp.log(dense) + probs, axis=1))
+
+    # Time-varying operators behave like (T-1, K, K) arrays
+    operators = random_transition_operator(k1, structure, num_states, batch_shape=(3,))
+    assert operators.ndim == 3 and operators.shape == (3, num_states, num_states)
+    assert jnp.allclose(operators.todense()[1], operators[1].todense())
@@ -1,9 +1,17 @@
 import jax.numpy as jnp
 import jax.random as jr
+from jax import jit
 from jax import lax
+from jax import vmap
+from jax.scipy.linalg import cho_solve
+from jax.scipy.linalg import lu_factor
+from jax.scipy.linalg import lu_solve
+from jax.scipy.linalg import solve_triangular
 from distrax import MultivariateNormalFullCovariance as MVN
 import chex
 
+from ssm_jax.utils import mask_missing_emission
+
 
 @chex.dataclass
 class LGSSMParams:
@@ -41,6 +49,16 @@ class LGSSMPosterior:
                 Cov[x_t | y_{1:T}, u_{1:T}].
             smoothed_cross: (T-1, D_hid, D_hid) array of smoothed cross products,
                 E[x_t x_{t+1}^T | y_{1:T}, u_{1:T}].
+            filtered_covariance_chols: (T,D_hid,D_hid) array of lower Cholesky
+                factors of the filtered covariances (square-root filter only).
+            smoothed_covariance_chols: (T,D_hid,D_hid) array of lower Cholesky
+                factors of the smoothed covariances (square-root smoother only).
+            predicted_means: (T,D_hid) array,
+                E[x_{t+1} | y_{1:t}, u_{1:t}] (if requested from the filter).
+            predicted_covariances: (T,D_hid,D_hid) array,
+                Cov[x_{t+1} | y_{1:t}, u_{1:t}] (if requested from the filter).
+            predicted_covariance_chols: (T,D_hid,D_hid) array of lower Cholesky
+                factors of the predicted covariances (if requested from the filter).
     """
 
     marginal_loglik: chex.Scalar = None
@@ -49,6 +67,11 @@ class LGSSMPosterior:
     smoothed_means: chex.Array = None
     smoothed_covariances: chex.Array = None
     smoothed_cross_covariances: chex.Array = None
+    filtered_covariance_chols: chex.Array = None
+    smoothed_covariance_chols: chex.Array = None
+    predicted_means: chex.Array = None
+    predicted_covariances: chex.Array = None
+    predicted_covariance_chols: chex.Array = None
 
 
 # Helper functions
@@ -117,23 +140,102 @@ def _condition_on(m, P, H, D, d, R, u, y):
     return mu_cond, Sigma_cond
 
 
-def lgssm_filter(params, emissions, inputs=None):
-    """Run a Kalman filter to produce the marginal likelihood and filtered state
-    estimates.
+def _condition_on_with_ll(m, P, H, D, d, R, u, y):
+    """Condition a Gaussian potential on a new linear Gaussian observation, as
+    in `_condition_on`, and also return the log likelihood of the observation,
+        log N(y | H m + D u + d, S).
+    The innovation covariance S is LU-factored once, and the factors are used
+    for both the Kalman gain and the log likelihood.
+
+    Returns:
+         mu_cond (D_hid,): filtered mean.
+         Sigma_cond (D_hid,D_hid): filtered covariance.
+         ll (float): log likelihood of y.
+    """
+    S = R + H @ P @ H.T
+    S_lu = lu_factor(S)
+    K = lu_solve(S_lu, H @ P).T
+    Sigma_cond = P - K @ S @ K.T
+
+    # Log likelihood of the residual, using log|S| = sum(log|diag(U)|)
+    r = y - D @ u - d - H @ m
+    mu_cond = m + K @ r
+    logdet = jnp.log(jnp.abs(jnp.diag(S_lu[0]))).sum()
+    ll = -0.5 * jnp.dot(r, lu_solve(S_lu, r)) - 0.5 * logdet - 0.5 * len(y) * jnp.log(2 * jnp.pi)
+    return mu_cond, Sigma_cond, ll
+
+
+def _mask_emission_params(H, D, d, R, y):
+    """Zero out the emission parameters of the missing (NaN) entries of y.
+    See `ssm_jax.utils.mask_missing_emission`."""
+    observed, y, R, ll_correction = mask_missing_emission(y, R)
+    H = jnp.where(observed[:, None], H, 0.0)
+    D = jnp.where(observed[:, None], D, 0.0)
+    d = jnp.where(observed, d, 0.0)
+    return H, D, d, R, y, ll_correction
+
+
+def _condition_on_diagonal(m, P, H, D, d, R_diag, u, y):
+    """Condition a Gaussian potential on a new linear Gaussian observation with
+    a diagonal emission covariance. The observation dimensions are conditionally
+    independent, so they can be processed one at a time. Each step is a rank-one
+    update with a scalar innovation variance, so no D_obs x D_obs system is solved.
 
     Args:
-        params: an LGSSMParams instance (or object with the same fields)
-        emissions (T,D_hid): array of observations.
-        inputs (T,D_in): array of inputs.
+         m (D_hid,): prior mean.
+         P (D_hid,D_hid): prior covariance.
+         H (D_obs,D_hid): emission matrix.
+         D (D_obs,D_in): emission input weights.
+         u (D_in,): inputs.
+         d (D_obs,): emission bias.
+         R_diag (D_obs,): diagonal of the emission covariance matrix.
+         y (D_obs,): observation.
 
-    Returns:
-        filtered_posterior: LGSSMPosterior instance containing,
-            marginal_log_lik
-            filtered_means (T, D_hid)
-            filtered_covariances (T, D_hid, D_hid)
+     Returns:
+         mu_cond (D_hid,): conditional mean.
+         Sigma_cond (D_hid,D_hid): conditional covariance.
+         ll: log likelihood of y.
     """
+    def _step(carry, args):
+        ll, m, P = carry
+        h, r, y_i = args
+        Ph = P @ h
+        s = h @ Ph + r
+        k = Ph / s
+        resid = y_i - h @ m
+        ll += -0.5 * (jnp.log(2 * jnp.pi * s) + resid**2 / s)
+        # Joseph form (I - k h) P (I - k h)^T + r k k^T, which stays positive
+        # definite under rounding, computed in O(D_hid^2)
+        KP = P - jnp.outer(k, h @ P)
+        P = KP - jnp.outer(KP @ h, k) + r * jnp.outer(k, k)
+        return (ll, m + k * resid, 0.5 * (P + P.T)), None
+
+    (ll, mu_cond, Sigma_cond), _ = lax.scan(_step, (0.0, m, P), (H, R_diag, y - D @ u - d))
+    return mu_cond, Sigma_cond, ll
+
+
+@chex.dataclass
+class KalmanFilterState:
+    """State of a streaming Kalman filter, carried between chunks of emissions.
+
+    Attributes:
+            predicted_mean: (D_hid,) array, E[x_{t+1} | y_{1:t}, u_{1:t}].
+            predicted_covariance: (D_hid,D_hid) array, Cov[x_{t+1} | y_{1:t}, u_{1:t}].
+            marginal_loglik: marginal log likelihood of all the data seen so far.
+    """
+
+    predicted_mean: chex.Array
+    predicted_covariance: chex.Array
+    marginal_loglik: chex.Scalar = 0.0
+
+
+def _kalman_filter_scan(params, carry, emissions, inputs, diagonal_emission_covariance=False,
+                        return_predictions=False):
+    """Run the Kalman filter recursion from a given (ll, pred_mean, pred_cov)
+    carry. Returns the final carry and the filtered means and covariances,
+    followed by the predicted means, covariances and covariance Cholesky
+    factors of the next state if `return_predictions` is True."""
     num_timesteps = len(emissions)
-    inputs = jnp.zeros((num_timesteps, 0)) if inputs is None else inputs
 
     def _step(carry, t):
         ll, pred_mean, pred_cov = carry
@@ -150,21 +252,211 @@ def lgssm_filter(params, emissions, inputs=None):
         u = inputs[t]
         y = emissions[t]
 
-        # Update the log likelihood
-        ll += MVN(H @ pred_mean + D @ u + d, H @ pred_cov @ H.T + R).log_prob(y)
+        # Only condition on the observed (non-NaN) entries of this emission
+        H, D, d, R, y, ll_correction = _mask_emission_params(H, D, d, R, y)
+        ll += ll_correction
 
-        # Condition on this emission
-        filtered_mean, filtered_cov = _condition_on(pred_mean, pred_cov, H, D, d, R, u, y)
+        if diagonal_emission_covariance:
+            # Condition on one emission dimension at a time
+            filtered_mean, filtered_cov, ll_t = _condition_on_diagonal(pred_mean, pred_cov, H, D, d, jnp.diag(R), u, y)
+            ll += ll_t
+        else:
+            # Condition on this emission and update the log likelihood
+            filtered_mean, filtered_cov, ll_t = _condition_on_with_ll(pred_mean, pred_cov, H, D, d, R, u, y)
+            ll += ll_t
 
         # Predict the next state
         pred_mean, pred_cov = _predict(filtered_mean, filtered_cov, F, B, b, Q, u)
 
-        return (ll, pred_mean, pred_cov), (filtered_mean, filtered_cov)
+        outputs = (filtered_mean, filtered_cov)
+        if return_predictions:
+            outputs += (pred_mean, pred_cov, jnp.linalg.cholesky(pred_cov))
+        return (ll, pred_mean, pred_cov), outputs
+
+    return lax.scan(_step, carry, jnp.arange(num_timesteps))
+
+
+def _steady_state_kalman_filter_scan(params, carry, emissions, inputs, tol):
+    """Run the Kalman filter recursion for time-invariant parameters. The
+    covariance recursion does not depend on the data, so once the predicted
+    covariance has converged (to within `tol`, relative to its largest entry)
+    the gain and the Cholesky factor of the innovation covariance are frozen.
+    From then on each step only costs matrix-vector products.
+
+    A step with missing (NaN) emission entries does a full masked update, as
+    in `_kalman_filter_scan`, and restarts the covariance recursion from there.
+
+    Under `vmap` the `lax.cond`s below become selects, so both branches run at
+    every step and the steady-state savings are lost.
+    """
+    num_timesteps = len(emissions)
+    F = params.dynamics_matrix
+    B = params.dynamics_input_weights
+    b = params.dynamics_bias
+    Q = params.dynamics_covariance
+    H = params.emission_matrix
+    D = params.emission_input_weights
+    d = params.emission_bias
+    R = params.emission_covariance
+    assert F.ndim == 2 and B.ndim == 2 and b.ndim == 1 and Q.ndim == 2, \
+        "The steady-state filter requires time-invariant parameters."
+    assert H.ndim == 2 and D.ndim == 2 and d.ndim == 1 and R.ndim == 2, \
+        "The steady-state filter requires time-invariant parameters."
+
+    def _riccati_step(covs):
+        pred_cov, *_ = covs
+        S = R + H @ pred_cov @ H.T
+        S_chol = jnp.linalg.cholesky(S)
+        K = cho_solve((S_chol, True), H @ pred_cov).T
+        filtered_cov = pred_cov - K @ S @ K.T
+        next_pred_cov = F @ filtered_cov @ F.T + Q
+        converged = jnp.max(jnp.abs(next_pred_cov - pred_cov)) <= tol * jnp.max(jnp.abs(pred_cov))
+        return next_pred_cov, filtered_cov, K, S_chol, converged
+
+    def _steady_step(pred_mean, covs, u, y):
+        # Only run the O(D^3) covariance update until it has converged
+        covs = lax.cond(covs[-1], lambda covs: covs, _riccati_step, covs)
+        _, filtered_cov, K, S_chol, _ = covs
+
+        # Update the log likelihood and condition on this emission
+        z = solve_triangular(S_chol, y - D @ u - d - H @ pred_mean, lower=True)
+        ll = -0.5 * jnp.dot(z, z) - jnp.log(jnp.diag(S_chol)).sum() - 0.5 * len(y) * jnp.log(2 * jnp.pi)
+        filtered_mean = pred_mean + K @ (S_chol @ z)
+        return ll, filtered_mean, filtered_cov, covs
+
+    def _masked_step(pred_mean, covs, u, y):
+        # Condition on the observed entries only, and restart the recursion
+        pred_cov, _, K, S_chol, _ = covs
+        H_t, D_t, d_t, R_t, y, ll_correction = _mask_emission_params(H, D, d, R, y)
+        filtered_mean, filtered_cov, ll = _condition_on_with_ll(pred_mean, pred_cov, H_t, D_t, d_t, R_t, u, y)
+        covs = (F @ filtered_cov @ F.T + Q, filtered_cov, K, S_chol, jnp.array(False))
+        return ll + ll_correction, filtered_mean, filtered_cov, covs
+
+    def _step(carry, t):
+        ll, pred_mean, covs = carry
+        u = inputs[t]
+        y = emissions[t]
+
+        ll_t, filtered_mean, filtered_cov, covs = lax.cond(
+            jnp.any(jnp.isnan(y)), _masked_step, _steady_step, pred_mean, covs, u, y)
+        ll += ll_t
+
+        # Predict the next state
+        pred_mean = F @ filtered_mean + B @ u + b
+
+        return (ll, pred_mean, covs), (filtered_mean, filtered_cov)
+
+    ll, pred_mean, pred_cov = carry
+    state_dim, emission_dim = H.shape[1], H.shape[0]
+    covs = (pred_cov,
+            jnp.zeros_like(pred_cov),
+            jnp.zeros((state_dim, emission_dim)),
+            jnp.eye(emission_dim),
+            jnp.array(False))
+    (ll, pred_mean, covs), outputs = lax.scan(_step, (ll, pred_mean, covs), jnp.arange(num_timesteps))
+    return (ll, pred_mean, covs[0]), outputs
+
+
+def lgssm_filter(params, emissions, inputs=None, steady_state=False, steady_state_tol=1e-6,
+                 diagonal_emission_covariance=False, return_predictions=False):
+    """Run a Kalman filter to produce the marginal likelihood and filtered state
+    estimates.
+
+    Missing entries of the emissions are NaN. The filter only conditions on
+    the observed entries at each time step.
+
+    If `steady_state` is True, the parameters must be time-invariant. The filter
+    then stops updating the covariance once it has converged (see
+    `_steady_state_kalman_filter_scan`), so later steps cost O(D^2) instead of O(D^3).
+
+    Args:
+        params: an LGSSMParams instance (or object with the same fields)
+        emissions (T,D_hid): array of observations.
+        inputs (T,D_in): array of inputs.
+        steady_state (bool): whether to freeze the gain after convergence.
+            Steps with missing emissions restart the covariance recursion.
+        steady_state_tol (float): relative tolerance for convergence of the
+            predicted covariance.
+        diagonal_emission_covariance (bool): whether the emission covariance is
+            diagonal, in which case the emission dimensions are processed one
+            at a time with rank-one updates. Only used if not `steady_state`.
+        return_predictions (bool): whether to also return the one-step-ahead
+            predicted means and covariances, and Cholesky factors of the
+            predicted covariances. Not supported with `steady_state`.
+
+    Returns:
+        filtered_posterior: LGSSMPosterior instance containing,
+            marginal_log_lik
+            filtered_means (T, D_hid)
+            filtered_covariances (T, D_hid, D_hid)
+            predicted_means (T, D_hid), if return_predictions
+            predicted_covariances (T, D_hid, D_hid), if return_predictions
+            predicted_covariance_chols (T, D_hid, D_hid), if return_predictions
+    """
+    num_timesteps = len(emissions)
+    inputs = jnp.zeros((num_timesteps, 0)) if inputs is None else inputs
 
     # Run the Kalman filter
     carry = (0.0, params.initial_mean, params.initial_covariance)
-    (ll, _, _), (filtered_means, filtered_covs) = lax.scan(_step, carry, jnp.arange(num_timesteps))
-    return LGSSMPosterior(marginal_loglik=ll, filtered_means=filtered_means, filtered_covariances=filtered_covs)
+    if steady_state:
+        assert not return_predictions, "return_predictions is not supported with steady_state."
+        scan_outputs = _steady_state_kalman_filter_scan(params, carry, emissions, inputs, steady_state_tol)
+    else:
+        scan_outputs = _kalman_filter_scan(params, carry, emissions, inputs, diagonal_emission_covariance,
+                                           return_predictions)
+    (ll, _, _), (filtered_means, filtered_covs, *predictions) = scan_outputs
+    pred_means, pred_covs, pred_chols = predictions if return_predictions else (None, None, None)
+    return LGSSMPosterior(marginal_loglik=ll,
+                          filtered_means=filtered_means,
+                          filtered_covariances=filtered_covs,
+                          predicted_means=pred_means,
+                          predicted_covariances=pred_covs,
+                          predicted_covariance_chols=pred_chols)
+
+
+def lgssm_filter_init(params):
+    """Initialize the state of a streaming Kalman filter.
+
+    Args:
+        params: an LGSSMParams instance (or object with the same fields)
+
+    Returns:
+        state: KalmanFilterState instance.
+    """
+    return KalmanFilterState(predicted_mean=params.initial_mean,
+                             predicted_covariance=params.initial_covariance,
+                             marginal_loglik=0.0)
+
+
+@jit
+def lgssm_filter_update(params, state, emissions, inputs=None):
+    """Advance a streaming Kalman filter by a chunk of emissions. Running this
+    on consecutive chunks gives the same results as `lgssm_filter` on the whole
+    sequence, and the cost of each call only depends on the chunk length.
+
+    Time-varying parameters are indexed relative to the start of the chunk, so
+    they should be sliced to match the chunk.
+
+    Args:
+        params: an LGSSMParams instance (or object with the same fields)
+        state: KalmanFilterState from `lgssm_filter_init` or a previous update.
+        emissions (T,D_hid): array of observations in this chunk.
+        inputs (T,D_in): array of inputs in this chunk.
+
+    Returns:
+        state: updated KalmanFilterState.
+        filtered_posterior: LGSSMPosterior instance containing,
+            marginal_log_lik (of all the data seen so far)
+            filtered_means (T, D_hid)
+            filtered_covariances (T, D_hid, D_hid)
+    """
+    num_timesteps = len(emissions)
+    inputs = jnp.zeros((num_timesteps, 0)) if inputs is None else inputs
+
+    carry = (state.marginal_loglik, state.predicted_mean, state.predicted_covariance)
+    (ll, pred_mean, pred_cov), (filtered_means, filtered_covs) = _kalman_filter_scan(params, carry, emissions, inputs)
+    state = KalmanFilterState(predicted_mean=pred_mean, predicted_covariance=pred_cov, marginal_loglik=ll)
+    return state, LGSSMPosterior(marginal_loglik=ll, filtered_means=filtered_means, filtered_covariances=filtered_covs)
 
 
 def lgssm_posterior_sample(rng, params, emissions, inputs=None):
@@ -237,30 +529,28 @@ def lgssm_smoother(params, emissions, inputs=None):
     num_timesteps = len(emissions)
     inputs = jnp.zeros((num_timesteps, 0)) if inputs is None else inputs
 
-    # Run the Kalman filter
-    filtered_posterior = lgssm_filter(params, emissions, inputs)
-    ll, filtered_means, filtered_covs, *_ = filtered_posterior.to_tuple()
+    # Run the Kalman filter, keeping its one-step-ahead predictions
+    filtered_posterior = lgssm_filter(params, emissions, inputs, return_predictions=True)
+    ll = filtered_posterior.marginal_loglik
+    filtered_means = filtered_posterior.filtered_means
+    filtered_covs = filtered_posterior.filtered_covariances
 
     # Run the smoother backward in time
     def _step(carry, args):
         # Unpack the inputs
         smoothed_mean_next, smoothed_cov_next = carry
-        t, filtered_mean, filtered_cov = args
+        t, filtered_mean, filtered_cov, pred_mean, pred_cov, pred_chol = args
 
-        # Shorthand: get parameters and inputs for time index t
+        # Shorthand: get parameters for time index t
         F = _get_params(params.dynamics_matrix, 2, t)
-        B = _get_params(params.dynamics_input_weights, 2, t)
-        b = _get_params(params.dynamics_bias, 1, t)
-        Q = _get_params(params.dynamics_covariance, 2, t)
-        u = inputs[t]
 
         # This is like the Kalman gain but in reverse
         # See Eq 8.11 of Saarka's "Bayesian Filtering and Smoothing"
-        G = jnp.linalg.solve(Q + F @ filtered_cov @ F.T, F @ filtered_cov).T
+        G = cho_solve((pred_chol, True), F @ filtered_cov).T
 
         # Compute the smoothed mean and covariance
-        smoothed_mean = filtered_mean + G @ (smoothed_mean_next - F @ filtered_mean - B @ u - b)
-        smoothed_cov = filtered_cov + G @ (smoothed_cov_next - F @ filtered_cov @ F.T - Q) @ G.T
+        smoothed_mean = filtered_mean + G @ (smoothed_mean_next - pred_mean)
+        smoothed_cov = filtered_cov + G @ (smoothed_cov_next - pred_cov) @ G.T
 
         # Compute the smoothed expectation of x_t x_{t+1}^T
         smoothed_cross = G @ smoothed_cov_next + jnp.outer(smoothed_mean, smoothed_mean_next)
@@ -269,7 +559,12 @@ def lgssm_smoother(params, emissions, inputs=None):
 
     # Run the Kalman smoother
     init_carry = (filtered_means[-1], filtered_covs[-1])
-    args = (jnp.arange(num_timesteps - 2, -1, -1), filtered_means[:-1][::-1], filtered_covs[:-1][::-1])
+    args = (jnp.arange(num_timesteps - 2, -1, -1),
+            filtered_means[:-1][::-1],
+            filtered_covs[:-1][::-1],
+            filtered_posterior.predicted_means[:-1][::-1],
+            filtered_posterior.predicted_covariances[:-1][::-1],
+            filtered_posterior.predicted_covariance_chols[:-1][::-1])
     _, (smoothed_means, smoothed_covs, smoothed_cross) = lax.scan(_step, init_carry, args)
 
     # Reverse the arrays and return
@@ -284,3 +579,404 @@ def lgssm_smoother(params, emissions, inputs=None):
         smoothed_covariances=smoothed_covs,
         smoothed_cross_covariances=smoothed_cross,
     )
+
+
+def lgssm_filter_parallel(params, emissions, inputs=None):
+    """Run a parallel-in-time Kalman filter to produce the marginal likelihood
+    and filtered state estimates.
+
+    This implements the associative scan formulation of Särkkä and
+    García-Fernández (2021), "Temporal Parallelization of Bayesian Smoothers".
+    Each time step is summarized by an element (A, b, C, J, eta) that
+    parameterizes p(x_t | x_{t-1}, y_t) and the likelihood of y_t as a function
+    of x_{t-1}. These elements are combined with an associative operator so that
+    the filter runs in O(log T) depth.
+
+    Args:
+        params: an LGSSMParams instance (or object with the same fields)
+        emissions (T,D_hid): array of observations.
+        inputs (T,D_in): array of inputs.
+
+    Returns:
+        filtered_posterior: LGSSMPosterior instance containing,
+            marginal_log_lik
+            filtered_means (T, D_hid)
+            filtered_covariances (T, D_hid, D_hid)
+    """
+    num_timesteps = len(emissions)
+    inputs = jnp.zeros((num_timesteps, 0)) if inputs is None else inputs
+    dim = params.initial_mean.shape[0]
+    I = jnp.eye(dim)
+
+    def _first_element(u, y):
+        # Shorthand: get parameters for time index 0
+        H = _get_params(params.emission_matrix, 2, 0)
+        D = _get_params(params.emission_input_weights, 2, 0)
+        d = _get_params(params.emission_bias, 1, 0)
+        R = _get_params(params.emission_covariance, 2, 0)
+        m1 = params.initial_mean
+        P1 = params.initial_covariance
+
+        S = H @ P1 @ H.T + R
+        K = jnp.linalg.solve(S, H @ P1).T
+        A = jnp.zeros((dim, dim))
+        b = m1 + K @ (y - D @ u - d - H @ m1)
+        C = P1 - K @ S @ K.T
+        eta = jnp.zeros(dim)
+        J = jnp.zeros((dim, dim))
+        return A, b, C, J, eta
+
+    @vmap
+    def _generic_element(t, u_prev, u, y):
+        # Shorthand: get the dynamics parameters for the transition from time
+        # index t-1 to t and the emission parameters for time index t
+        F = _get_params(params.dynamics_matrix, 2, t - 1)
+        B = _get_params(params.dynamics_input_weights, 2, t - 1)
+        b = _get_params(params.dynamics_bias, 1, t - 1)
+        Q = _get_params(params.dynamics_covariance, 2, t - 1)
+        H = _get_params(params.emission_matrix, 2, t)
+        D = _get_params(params.emission_input_weights, 2, t)
+        d = _get_params(params.emission_bias, 1, t)
+        R = _get_params(params.emission_covariance, 2, t)
+
+        m = B @ u_prev + b
+        resid = y - D @ u - d - H @ m
+        S = H @ Q @ H.T + R
+        K = jnp.linalg.solve(S, H @ Q).T
+        HF = H @ F
+        SinvHF = jnp.linalg.solve(S, HF)
+
+        A = (I - K @ H) @ F
+        b = m + K @ resid
+        C = (I - K @ H) @ Q
+        eta = SinvHF.T @ resid
+        J = HF.T @ SinvHF
+        return A, b, C, J, eta
+
+    @vmap
+    def _combine(elem1, elem2):
+        A1, b1, C1, J1, eta1 = elem1
+        A2, b2, C2, J2, eta2 = elem2
+
+        I_C1J2 = I + C1 @ J2
+        A2_I_C1J2_inv = jnp.linalg.solve(I_C1J2.T, A2.T).T
+        A = A2_I_C1J2_inv @ A1
+        b = A2_I_C1J2_inv @ (b1 + C1 @ eta2) + b2
+        C = A2_I_C1J2_inv @ C1 @ A2.T + C2
+
+        I_J2C1 = I + J2 @ C1
+        A1T_I_J2C1_inv = jnp.linalg.solve(I_J2C1.T, A1).T
+        eta = A1T_I_J2C1_inv @ (eta2 - J2 @ b1) + eta1
+        J = A1T_I_J2C1_inv @ J2 @ A1 + J1
+        return A, b, C, J, eta
+
+    first_element = _first_element(inputs[0], emissions[0])
+    generic_elements = _generic_element(jnp.arange(1, num_timesteps), inputs[:-1], inputs[1:], emissions[1:])
+    elements = tuple(jnp.concatenate([x0[None], x]) for x0, x in zip(first_element, generic_elements))
+    _, filtered_means, filtered_covs, _, _ = lax.associative_scan(_combine, elements)
+
+    # Compute the log likelihood from the one-step-ahead predictions
+    @vmap
+    def _predict_next(t, filtered_mean, filtered_cov, u):
+        F = _get_params(params.dynamics_matrix, 2, t)
+        B = _get_params(params.dynamics_input_weights, 2, t)
+        b = _get_params(params.dynamics_bias, 1, t)
+        Q = _get_params(params.dynamics_covariance, 2, t)
+        return _predict(filtered_mean, filtered_cov, F, B, b, Q, u)
+
+    @vmap
+    def _log_likelihood(t, pred_mean, pred_cov, u, y):
+        H = _get_params(params.emission_matrix, 2, t)
+        D = _get_params(params.emission_input_weights, 2, t)
+        d = _get_params(params.emission_bias, 1, t)
+        R = _get_params(params.emission_covariance, 2, t)
+        return MVN(H @ pred_mean + D @ u + d, H @ pred_cov @ H.T + R).log_prob(y)
+
+    pred_means, pred_covs = _predict_next(jnp.arange(num_timesteps - 1), filtered_means[:-1], filtered_covs[:-1],
+                                          inputs[:-1])
+    pred_means = jnp.concatenate([params.initial_mean[None], pred_means])
+    pred_covs = jnp.concatenate([params.initial_covariance[None], pred_covs])
+    ll = _log_likelihood(jnp.arange(num_timesteps), pred_means, pred_covs, inputs, emissions).sum()
+
+    return LGSSMPosterior(marginal_loglik=ll, filtered_means=filtered_means, filtered_covariances=filtered_covs)
+
+
+def lgssm_smoother_parallel(params, emissions, inputs=None):
+    """Run a parallel-in-time Rauch-Tung-Striebel (RTS) smoother.
+
+    The forward pass is `lgssm_filter_parallel`. The backward pass summarizes
+    each time step by an element (E, g, L) that parameterizes
+    p(x_t | x_{t+1}, y_{1:t}) = N(x_t | E x_{t+1} + g, L), and combines these
+    with an associative scan in reverse time (Särkkä and García-Fernández, 2021).
+
+    Args:
+        params: an LGSSMParams instance (or object with the same fields)
+        emissions (T,D_hid): array of observations.
+        inputs (T,D_in): array of inputs.
+
+    Returns:
+        lgssm_posterior: LGSSMPosterior instance containing properites of
+            filtered and smoothed posterior distributions.
+    """
+    num_timesteps = len(emissions)
+    inputs = jnp.zeros((num_timesteps, 0)) if inputs is None else inputs
+
+    # Run the parallel Kalman filter
+    filtered_posterior = lgssm_filter_parallel(params, emissions, inputs)
+    ll, filtered_means, filtered_covs, *_ = filtered_posterior.to_tuple()
+
+    @vmap
+    def _generic_element(t, filtered_mean, filtered_cov, u):
+        # Shorthand: get parameters and inputs for time index t
+        F = _get_params(params.dynamics_matrix, 2, t)
+        B = _get_params(params.dynamics_input_weights, 2, t)
+        b = _get_params(params.dynamics_bias, 1, t)
+        Q = _get_params(params.dynamics_covariance, 2, t)
+
+        # This is like the Kalman gain but in reverse
+        # See Eq 8.11 of Saarka's "Bayesian Filtering and Smoothing"
+        E = jnp.linalg.solve(Q + F @ filtered_cov @ F.T, F @ filtered_cov).T
+        g = filtered_mean - E @ (F @ filtered_mean + B @ u + b)
+        L = filtered_cov - E @ F @ filtered_cov
+        return E, g, L
+
+    @vmap
+    def _combine(elem1, elem2):
+        E1, g1, L1 = elem1
+        E2, g2, L2 = elem2
+        E = E2 @ E1
+        g = E2 @ g1 + g2
+        L = E2 @ L1 @ E2.T + L2
+        return E, g, L
+
+    # The last element is just the final filtered distribution
+    dim = filtered_means.shape[-1]
+    final_element = (jnp.zeros((dim, dim)), filtered_means[-1], filtered_covs[-1])
+    generic_elements = _generic_element(jnp.arange(num_timesteps - 1), filtered_means[:-1], filtered_covs[:-1],
+                                        inputs[:-1])
+    elements = tuple(jnp.concatenate([x, x0[None]]) for x0, x in zip(final_element, generic_elements))
+    _, smoothed_means, smoothed_covs = lax.associative_scan(_combine, elements, reverse=True)
+
+    # Compute the smoothed expectation of x_t x_{t+1}^T
+    G = generic_elements[0]
+    smoothed_cross = G @ smoothed_covs[1:] + vmap(jnp.outer)(smoothed_means[:-1], smoothed_means[1:])
+
+    return LGSSMPosterior(
+        marginal_loglik=ll,
+        filtered_means=filtered_means,
+        filtered_covariances=filtered_covs,
+        smoothed_means=smoothed_means,
+        smoothed_covariances=smoothed_covs,
+        smoothed_cross_covariances=smoothed_cross,
+    )
+
+
+def _tria(A):
+    """Return the lower triangular L with L L^T = A A^T, computed from the QR
+    decomposition of A^T, so that A A^T is never formed."""
+    _, r = jnp.linalg.qr(A.T)
+    L = r.T
+    # Make the diagonal positive so that L is the Cholesky factor
+    return L * jnp.where(jnp.diag(L) < 0, -1.0, 1.0)
+
+
+def _predict_sqrt(m, L, F, B, b, L_Q, u):
+    """Square-root version of `_predict`. The predicted covariance
+    F L L^T F^T + L_Q L_Q^T is returned as its Cholesky factor.
+
+    Args:
+        m (D_hid,): prior mean.
+        L (D_hid,D_hid): Cholesky factor of the prior covariance.
+        F, B, b, u: as in `_predict`.
+        L_Q (D_hid,D_hid): Cholesky factor of the dynamics covariance.
+
+    Returns:
+        mu_pred (D_hid,): predicted mean.
+        L_pred (D_hid,D_hid): Cholesky factor of the predicted covariance.
+    """
+    mu_pred = F @ m + B @ u + b
+    L_pred = _tria(jnp.concatenate([F @ L, L_Q], axis=1))
+    return mu_pred, L_pred
+
+
+def _condition_on_sqrt(m, L, H, D, d, L_R, u, y):
+    """Square-root version of `_condition_on`. The triangularization of
+
+        [[L_R, H L],      [[L_S, 0     ],
+         [0,   L  ]]  ->   [G,   L_cond]]
+
+    gives the Cholesky factor L_S of S = R + H P H^T, the scaled gain
+    G = K L_S and the Cholesky factor L_cond of the conditional covariance,
+    without subtracting K S K^T.
+
+    Args:
+        m (D_hid,): prior mean.
+        L (D_hid,D_hid): Cholesky factor of the prior covariance.
+        H, D, d, u, y: as in `_condition_on`.
+        L_R (D_obs,D_obs): Cholesky factor of the emission covariance.
+
+    Returns:
+        mu_cond (D_hid,): conditional mean.
+        L_cond (D_hid,D_hid): Cholesky factor of the conditional covariance.
+        ll: log likelihood of y.
+    """
+    emission_dim, state_dim = H.shape
+    M = jnp.block([[L_R, H @ L], [jnp.zeros((state_dim, emission_dim)), L]])
+    T = _tria(M)
+    L_S = T[:emission_dim, :emission_dim]
+    G = T[emission_dim:, :emission_dim]
+    L_cond = T[emission_dim:, emission_dim:]
+
+    # Whiten the residual with the Cholesky factor of S
+    z = solve_triangular(L_S, y - D @ u - d - H @ m, lower=True)
+    mu_cond = m + G @ z
+    ll = -0.5 * jnp.dot(z, z) - jnp.log(jnp.diag(L_S)).sum() - 0.5 * emission_dim * jnp.log(2 * jnp.pi)
+    return mu_cond, L_cond, ll
+
+
+def lgssm_filter_sqrt(params, emissions, inputs=None, return_covariances=True):
+    """Run a square-root Kalman filter, which propagates Cholesky factors of
+    the covariances with QR updates. The factorized covariances stay positive
+    definite, so this filter is stable in single precision. Missing entries
+    of the emissions (NaN) are handled as in `lgssm_filter`.
+
+    Args:
+        params: an LGSSMParams instance (or object with the same fields)
+        emissions (T,D_hid): array of observations.
+        inputs (T,D_in): array of inputs.
+        return_covariances (bool): whether to also form the filtered
+            covariances from their Cholesky factors.
+
+    Returns:
+        filtered_posterior: LGSSMPosterior instance containing,
+            marginal_log_lik
+            filtered_means (T, D_hid)
+            filtered_covariance_chols (T, D_hid, D_hid)
+            filtered_covariances (T, D_hid, D_hid), if return_covariances
+    """
+    num_timesteps = len(emissions)
+    inputs = jnp.zeros((num_timesteps, 0)) if inputs is None else inputs
+
+    # Factor the noise covariances once (these may be time-varying)
+    chol_Q = jnp.linalg.cholesky(params.dynamics_covariance)
+    chol_R = jnp.linalg.cholesky(params.emission_covariance)
+
+    def _step(carry, t):
+        ll, pred_mean, pred_chol = carry
+
+        # Shorthand: get parameters and inputs for time index t
+        F = _get_params(params.dynamics_matrix, 2, t)
+        B = _get_params(params.dynamics_input_weights, 2, t)
+        b = _get_params(params.dynamics_bias, 1, t)
+        L_Q = _get_params(chol_Q, 2, t)
+        H = _get_params(params.emission_matrix, 2, t)
+        D = _get_params(params.emission_input_weights, 2, t)
+        d = _get_params(params.emission_bias, 1, t)
+        L_R = _get_params(chol_R, 2, t)
+        u = inputs[t]
+        y = emissions[t]
+
+        # Only condition on the observed (non-NaN) entries of this emission,
+        # refactoring the emission covariance if any are missing
+        R = _get_params(params.emission_covariance, 2, t)
+        H, D, d, R, y, ll_correction = _mask_emission_params(H, D, d, R, y)
+        L_R = lax.cond(ll_correction > 0, jnp.linalg.cholesky, lambda R: L_R, R)
+
+        # Condition on this emission and update the log likelihood
+        filtered_mean, filtered_chol, ll_t = _condition_on_sqrt(pred_mean, pred_chol, H, D, d, L_R, u, y)
+        ll_t += ll_correction
+
+        # Predict the next state
+        pred_mean, pred_chol = _predict_sqrt(filtered_mean, filtered_chol, F, B, b, L_Q, u)
+
+        return (ll + ll_t, pred_mean, pred_chol), (filtered_mean, filtered_chol)
+
+    carry = (0.0, params.initial_mean, jnp.linalg.cholesky(params.initial_covariance))
+    (ll, _, _), (filtered_means, filtered_chols) = lax.scan(_step, carry, jnp.arange(num_timesteps))
+    filtered_covs = filtered_chols @ jnp.swapaxes(filtered_chols, -1, -2) if return_covariances else None
+    return LGSSMPosterior(marginal_loglik=ll,
+                          filtered_means=filtered_means,
+                          filtered_covariances=filtered_covs,
+                          filtered_covariance_chols=filtered_chols)
+
+
+def lgssm_smoother_sqrt(params, emissions, inputs=None, return_covariances=True):
+    """Run a square-root Rauch-Tung-Striebel smoother. The forward pass is
+    `lgssm_filter_sqrt`, and the backward pass updates Cholesky factors of the
+    smoothed covariances with QR updates, using
+
+        P_smooth = (P_filt - G P_pred G^T) + G P_smooth_next G^T,
+
+    where both terms are available in factored form.
+
+    Args:
+        params: an LGSSMParams instance (or object with the same fields)
+        emissions (T,D_hid): array of observations.
+        inputs (T,D_in): array of inputs.
+        return_covariances (bool): whether to also form the filtered and
+            smoothed covariances from their Cholesky factors.
+
+    Returns:
+        lgssm_posterior: LGSSMPosterior instance containing properites of
+            filtered and smoothed posterior distributions.
+    """
+    num_timesteps = len(emissions)
+    inputs = jnp.zeros((num_timesteps, 0)) if inputs is None else inputs
+
+    # Run the square-root Kalman filter
+    filtered_posterior = lgssm_filter_sqrt(params, emissions, inputs, return_covariances=return_covariances)
+    filtered_means = filtered_posterior.filtered_means
+    filtered_chols = filtered_posterior.filtered_covariance_chols
+    chol_Q = jnp.linalg.cholesky(params.dynamics_covariance)
+    dim = filtered_means.shape[-1]
+
+    # Run the smoother backward in time
+    def _step(carry, args):
+        smoothed_mean_next, smoothed_chol_next = carry
+        t, filtered_mean, filtered_chol = args
+
+        # Shorthand: get parameters and inputs for time index t
+        F = _get_params(params.dynamics_matrix, 2, t)
+        B = _get_params(params.dynamics_input_weights, 2, t)
+        b = _get_params(params.dynamics_bias, 1, t)
+        L_Q = _get_params(chol_Q, 2, t)
+        u = inputs[t]
+
+        # Triangularize [[F L, L_Q], [L, 0]] to get the Cholesky factor of the
+        # predicted covariance, the smoothing gain, and the factor of the
+        # covariance of x_t given x_{t+1}.
+        M = jnp.block([[F @ filtered_chol, L_Q], [filtered_chol, jnp.zeros((dim, dim))]])
+        T = _tria(M)
+        pred_chol = T[:dim, :dim]
+        G = solve_triangular(pred_chol, T[dim:, :dim].T, lower=True, trans="T").T
+        cond_chol = T[dim:, dim:]
+
+        # Compute the smoothed mean and the factor of the smoothed covariance
+        smoothed_mean = filtered_mean + G @ (smoothed_mean_next - F @ filtered_mean - B @ u - b)
+        smoothed_chol = _tria(jnp.concatenate([cond_chol, G @ smoothed_chol_next], axis=1))
+
+        # Compute the smoothed expectation of x_t x_{t+1}^T
+        smoothed_cross = G @ smoothed_chol_next @ smoothed_chol_next.T + jnp.outer(smoothed_mean, smoothed_mean_next)
+
+        return (smoothed_mean, smoothed_chol), (smoothed_mean, smoothed_chol, smoothed_cross)
+
+    # Run the Kalman smoother
+    init_carry = (filtered_means[-1], filtered_chols[-1])
+    args = (jnp.arange(num_timesteps - 2, -1, -1), filtered_means[:-1][::-1], filtered_chols[:-1][::-1])
+    _, (smoothed_means, smoothed_chols, smoothed_cross) = lax.scan(_step, init_carry, args)
+
+    # Reverse the arrays and return
+    smoothed_means = jnp.row_stack((smoothed_means[::-1], filtered_means[-1][None, ...]))
+    smoothed_chols = jnp.row_stack((smoothed_chols[::-1], filtered_chols[-1][None, ...]))
+    smoothed_cross = smoothed_cross[::-1]
+    smoothed_covs = smoothed_chols @ jnp.swapaxes(smoothed_chols, -1, -2) if return_covariances else None
+    return LGSSMPosterior(
+        marginal_loglik=filtered_posterior.marginal_loglik,
+        filtered_means=filtered_means,
+        filtered_covariances=filtered_posterior.filtered_covariances,
+        smoothed_means=smoothed_means,
+        smoothed_covariances=smoothed_covs,
+        smoothed_cross_covariances=smoothed_cross,
+        filtered_covariance_chols=filtered_chols,
+        smoothed_covariance_chols=smoothed_chols,
+    )
@@ -3,7 +3,9 @@ from jax import numpy as jnp
 
 import tensorflow_probability.substrates.jax.distributions as tfd
 
-from ssm_jax.lgssm.inference import lgssm_filter
+from ssm_jax.lgssm.inference import lgssm_filter, lgssm_smoother, lgssm_smoother_parallel
+from ssm_jax.lgssm.inference import LGSSMParams, lgssm_filter_init, lgssm_filter_update
+from ssm_jax.lgssm.inference import lgssm_smoother_sqrt
 from ssm_jax.lgssm.models import LinearGaussianSSM
 
 
@@ -75,3 +77,153 @@ def test_kalman_filter(num_timesteps=5, seed=0):
     assert jnp.allclose(ssm_posterior.smoothed_means, tfp_smoothed_means, rtol=1e-2)
     assert jnp.allclose(ssm_posterior.smoothed_covariances, tfp_smoothed_covs, rtol=1e-2)
     assert jnp.allclose(ssm_posterior.marginal_loglik, tfp_lls.sum())
+
+
+def test_kalman_smoother_parallel(num_timesteps=50, seed=0):
+    k1, k2, k3, k4 = jr.split(jr.PRNGKey(seed), 4)
+    state_dim, emission_dim, input_dim = 4, 2, 1
+
+    # Use a model with inputs and biases to check the full parameterization
+    lgssm = LinearGaussianSSM.random_initialization(k1, state_dim, emission_dim, input_dim)
+    lgssm.dynamics_input_weights = jr.normal(k2, (state_dim, input_dim))
+    lgssm.emission_input_weights = jr.normal(k3, (emission_dim, input_dim))
+    lgssm.dynamics_bias = 0.1 * jnp.ones(state_dim)
+    inputs = jr.normal(k4, (num_timesteps, input_dim))
+    _, emissions = lgssm.sample(jr.PRNGKey(seed + 1), num_timesteps, inputs)
+
+    post = lgssm_smoother(lgssm, emissions, inputs)
+    post_par = lgssm_smoother_parallel(lgssm, emissions, inputs)
+
+    assert jnp.allclose(post.marginal_loglik, post_par.marginal_loglik, rtol=1e-4)
+    assert jnp.allclose(post.filtered_means, post_par.filtered_means, atol=1e-3)
+    assert jnp.allclose(post.filtered_covariances, post_par.filtered_covariances, atol=1e-3)
+    assert jnp.allclose(post.smoothed_means, post_par.smoothed_means, atol=1e-3)
+    assert jnp.allclose(post.smoothed_covariances, post_par.smoothed_covariances, atol=1e-3)
+    assert jnp.allclose(post.smoothed_cross_covariances, post_par.smoothed_cross_covariances, rtol=1e-3, atol=1e-3)
+
+
+def test_kalman_filter_update(num_timesteps=40, seed=0, chunk_lengths=(1, 9, 30)):
+    lgssm = LinearGaussianSSM.random_initialization(jr.PRNGKey(seed), 3, 2)
+    params = LGSSMParams(**{name: getattr(lgssm, name) for name in LGSSMParams.__dataclass_fields__})
+    _, emissions = lgssm.sample(jr.PRNGKey(seed + 1), num_timesteps)
+    post = lgssm_filter(params, emissions)
+
+    # Run the streaming filter on consecutive chunks
+    state = lgssm_filter_init(params)
+    start = 0
+    for length in chunk_lengths:
+        state, chunk_post = lgssm_filter_update(params, state, emissions[start:start + length])
+        assert jnp.allclose(chunk_post.filtered_means, post.filtered_means[start:start + length], atol=1e-5)
+        assert jnp.allclose(chunk_post.filtered_covariances, post.filtered_covariances[start:start + length], atol=1e-5)
+        start += length
+
+    assert jnp.allclose(state.marginal_loglik, post.marginal_loglik, rtol=1e-5)
+
+
+def test_kalman_smoother_sqrt(num_timesteps=50, seed=0):
+    k1, k2, k3, k4 = jr.split(jr.PRNGKey(seed), 4)
+    state_dim, emission_dim, input_dim = 4, 2, 1
+    lgssm = LinearGaussianSSM.random_initialization(k1, state_dim, emission_dim, input_dim)
+    lgssm.dynamics_input_weights = jr.normal(k2, (state_dim, input_dim))
+    lgssm.emission_input_weights = jr.normal(k3, (emission_dim, input_dim))
+    inputs = jr.normal(k4, (num_timesteps, input_dim))
+    _, emissions = lgssm.sample(jr.PRNGKey(seed + 1), num_timesteps, inputs)
+
+    post = lgssm_smoother(lgssm, emissions, inputs)
+    post_sqrt = lgssm_smoother_sqrt(lgssm, emissions, inputs)
+
+    assert jnp.allclose(post.marginal_loglik, post_sqrt.marginal_loglik, rtol=1e-4)
+    assert jnp.allclose(post.filtered_means, post_sqrt.filtered_means, atol=1e-3)
+    assert jnp.allclose(post.filtered_covariances, post_sqrt.filtered_covariances, atol=1e-3)
+    assert jnp.allclose(post.smoothed_means, post_sqrt.smoothed_means, atol=1e-3)
+    assert jnp.allclose(post.smoothed_covariances, post_sqrt.smoothed_covariances, atol=1e-3)
+    assert jnp.allclose(post.smoothed_cross_covariances, post_sqrt.smoothed_cross_covariances, atol=1e-3)
+
+    # The factors are lower triangular with a positive diagonal
+    chols = post_sqrt.smoothed_covariance_chols
+    assert jnp.allclose(chols, jnp.tril(chols))
+    assert jnp.all(jnp.diagonal(chols, axis1=1, axis2=2) > 0)
+
+
+def test_kalman_filter_steady_state(num_timesteps=200, seed=0):
+    lgssm = LinearGaussianSSM.random_initialization(jr.PRNGKey(seed), 3, 2)
+    _, emissions = lgssm.sample(jr.PRNGKey(seed + 1), num_timesteps)
+
+    # Freezing the gain after convergence only changes the results within the tolerance
+    post = lgssm_filter(lgssm, emissions)
+    post_ss = lgssm_filter(lgssm, emissions, steady_state=True, steady_state_tol=1e-6)
+    assert jnp.allclose(post.marginal_loglik, post_ss.marginal_loglik, rtol=1e-4)
+    assert jnp.allclose(post.filtered_means, post_ss.filtered_means, atol=1e-3)
+    assert jnp.allclose(post.filtered_covariances, post_ss.filtered_covariances, atol=1e-4)
+
+    # Missing emissions restart the covariance recursion
+    missing_emissions = emissions.at[100, 0].set(jnp.nan).at[150].set(jnp.nan)
+    post = lgssm_filter(lgssm, missing_emissions)
+    post_ss = lgssm_filter(lgssm, missing_emissions, steady_state=True, steady_state_tol=1e-6)
+    assert jnp.allclose(post.marginal_loglik, post_ss.marginal_loglik, rtol=1e-4)
+    assert jnp.allclose(post.filtered_means, post_ss.filtered_means, atol=1e-3)
+    assert jnp.allclose(post.filtered_covariances, post_ss.filtered_covariances, atol=1e-4)
+
+
+def test_kalman_filter_diagonal(num_timesteps=20, seed=0):
+    lgssm = LinearGaussianSSM.random_initialization(jr.PRNGKey(seed), 3, 5)
+    lgssm.emission_covariance = jnp.diag(jnp.linspace(0.1, 1.0, 5))
+    _, emissions = lgssm.sample(jr.PRNGKey(seed + 1), num_timesteps)
+
+    # Processing the emission dimensions one at a time gives the same results
+    post = lgssm_filter(lgssm, emissions)
+    post_diag = lgssm_filter(lgssm, emissions, diagonal_emission_covariance=True)
+    assert jnp.allclose(post.marginal_loglik, post_diag.marginal_loglik, rtol=1e-4)
+    assert jnp.allclose(post.filtered_means, post_diag.filtered_means, atol=1e-4)
+    assert jnp.allclose(post.filtered_covariances, post_diag.filtered_covariances, atol=1e-4)
+
+
+def test_kalman_filter_missing(num_timesteps=20, seed=0):
+    lgssm = LinearGaussianSSM.random_initialization(jr.PRNGKey(seed), 3, 3)
+    _, emissions = lgssm.sample(jr.PRNGKey(seed + 1), num_timesteps)
+
+    # Conditioning on the observed entries matches a model without the missing dimension
+    dropped = LGSSMParams(
+        initial_mean=lgssm.initial_mean,
+        initial_covariance=lgssm.initial_covariance,
+        dynamics_matrix=lgssm.dynamics_matrix,
+        dynamics_input_weights=lgssm.dynamics_input_weights,
+        dynamics_bias=lgssm.dynamics_bias,
+        dynamics_covariance=lgssm.dynamics_covariance,
+        emission_matrix=lgssm.emission_matrix[:2],
+        emission_input_weights=lgssm.emission_input_weights[:2],
+        emission_bias=lgssm.emission_bias[:2],
+        emission_covariance=lgssm.emission_covariance[:2, :2],
+    )
+    post_dropped = lgssm_filter(dropped, emissions[:, :2])
+    missing_emissions = emissions.at[:, 2].set(jnp.nan)
+    for post in [
+        lgssm_filter(lgssm, missing_emissions),
+        lgssm_filter(lgssm, missing_emissions, diagonal_emission_covariance=True),
+        lgssm_smoother_sqrt(lgssm, missing_emissions),
+    ]:
+        assert jnp.allclose(post.marginal_loglik, post_dropped.marginal_loglik, rtol=1e-4)
+        assert jnp.allclose(post.filtered_means, post_dropped.filtered_means, atol=1e-4)
+        assert jnp.allclose(post.filtered_covariances, post_dropped.filtered_covariances, atol=1e-4)
+
+    # A fully missing emission only propagates the previous filtered distribution
+    t = 5
+    post = lgssm_filter(lgssm, emissions.at[t].set(jnp.nan))
+    F, Q, b = lgssm.dynamics_matrix, lgssm.dynamics_covariance, lgssm.dynamics_bias
+    assert jnp.allclose(post.filtered_means[t], F @ post.filtered_means[t - 1] + b, atol=1e-4)
+    assert jnp.allclose(post.filtered_covariances[t], F @ post.filtered_covariances[t - 1] @ F.T + Q, atol=1e-4)
+
+
+def test_kalman_filter_predictions(num_timesteps=20, seed=0):
+    lgssm = LinearGaussianSSM.random_initialization(jr.PRNGKey(seed), 3, 2)
+    _, emissions = lgssm.sample(jr.PRNGKey(seed + 1), num_timesteps)
+
+    # The predictions are the one-step-ahead moments of the filtered distributions
+    post = lgssm_filter(lgssm, emissions, return_predictions=True)
+    F, Q, b = lgssm.dynamics_matrix, lgssm.dynamics_covariance, lgssm.dynamics_bias
+    pred_covs = F @ post.filtered_covariances @ F.T + Q
+    assert jnp.allclose(post.predicted_means, post.filtered_means @ F.T + b, atol=1e-4)
+    assert jnp.allclose(post.predicted_covariances, pred_covs, atol=1e-4)
+    chols = post.predicted_covariance_chols
+    assert jnp.allclose(chols @ jnp.swapaxes(chols, -1, -2), pred_covs, atol=1e-4)
+    assert lgssm_filter(lgssm, emissions).predicted_means is None
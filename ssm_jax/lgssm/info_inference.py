@@ -4,6 +4,8 @@ from jax import lax
 from distrax import MultivariateNormalFullCovariance as MVN
 import chex
 
+from ssm_jax.utils import mask_missing_emission
+
 
 @chex.dataclass
 class LGSSMInfoParams:
@@ -142,8 +144,22 @@ def _info_condition_on(eta, Lambda, H, R_prec, D, u, d, obs):
     return eta_cond, Lambda_cond
 
 
+def _mask_emission_params(H, D, d, R_prec, y):
+    """Zero out the emission parameters of the missing (NaN) entries of y.
+    See `ssm_jax.utils.mask_missing_emission`."""
+    observed = ~jnp.isnan(jnp.atleast_1d(y))
+    R = lax.cond(jnp.all(observed), lambda R_prec: R_prec, jnp.linalg.inv, R_prec)
+    observed, y, R, ll_correction = mask_missing_emission(y, R)
+    R_prec = lax.cond(jnp.all(observed), lambda R: R_prec, jnp.linalg.inv, R)
+    H = jnp.where(observed[:, None], H, 0.0)
+    D = jnp.where(observed[:, None], D, 0.0)
+    d = jnp.where(observed, d, 0.0)
+    return H, D, d, R_prec, y, ll_correction
+
+
 def lgssm_info_filter(params, emissions, inputs):
     """Run a Kalman filter to produce the filtered state estimates.
+    Missing entries of the emissions (NaN) are skipped.
 
     Args:
         params: an LGSSMInfoParams instance.
@@ -172,6 +188,12 @@ def lgssm_info_filter(params, emissions, inputs):
         u = inputs[t]
         y = emissions[t]
 
+        # Only condition on the observed (non-NaN) entries of this emission.
+        # The precision of the observed entries is the inverse of their
+        # marginal covariance, so it is only recomputed if any are missing.
+        H, D, d, R_prec, y, ll_correction = _mask_emission_params(H, D, d, R_prec, y)
+        ll += ll_correction
+
         # Update the log likelihood
         y_pred_eta, y_pred_prec = _info_predict(pred_eta, pred_prec, H, R_prec, D, u, d)
         ll += _mvn_info_log_prob(y_pred_eta, y_pred_prec, y)
@@ -113,6 +113,15 @@ class TestInfoFilteringAndSmoothing:
             self.lgssm_info_posterior.marginal_loglik, self.lgssm_moment_posterior.marginal_loglik, rtol=1e-2
         )
 
+    def test_missing_emissions(self):
+        y = self.y.at[::3, 0].set(jnp.nan).at[4].set(jnp.nan)
+        moment_posterior = lgssm_filter(self.lgssm, y, self.inputs)
+        info_posterior = lgssm_info_filter(self.lgssm_info, y, self.inputs)
+        info_means, info_covs = info_to_moment_form(info_posterior.filtered_etas, info_posterior.filtered_precisions)
+        assert jnp.allclose(info_means, moment_posterior.filtered_means, rtol=1e-2)
+        assert jnp.allclose(info_covs, moment_posterior.filtered_covariances, rtol=1e-2)
+        assert jnp.allclose(info_posterior.marginal_loglik, moment_posterior.marginal_loglik, rtol=1e-2)
+
 
 class TestInfoKFLinReg:
     """Test non-stationary emission matrix in information filter.
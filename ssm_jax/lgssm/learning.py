@@ -1,25 +1,35 @@
 # Code for parameter estimation (MLE, MAP) using EM and SGD
+from functools import partial
 
-import jax.numpy as jnp
-from jax import jit, value_and_grad, vmap
-import optax
+from jax import jit
 
-from tqdm.auto import trange
+from ssm_jax.optimize import run_em
 
 
-def lgssm_fit_em(model, batch_emissions, num_iters=50):
-    @jit
+def lgssm_fit_em(model, batch_emissions, num_iters=50, tol=None, callback=None):
+    """Fit a LinearGaussianSSM with EM, running all iterations on device.
+
+    Args:
+        model: initial LinearGaussianSSM.
+        batch_emissions: (B, T, D) emissions.
+        num_iters (int): maximum number of EM iterations.
+        tol (float, optional): stop early once the marginal log likelihood
+            changes by less than `tol` times its magnitude.
+        callback (Callable, optional): host function called with the iteration
+            number and marginal log likelihood after each iteration.
+
+    Returns:
+        model: fitted LinearGaussianSSM.
+        log_probs: marginal log likelihood at each iteration that was run.
+    """
     def em_step(model):
         posterior_stats, marginal_loglikes = model.e_step(batch_emissions)
         model = model.m_step(posterior_stats)
         return model, marginal_loglikes.sum()
 
-    log_probs = []
-    for _ in trange(num_iters):
-        model, marginal_loglik = em_step(model)
-        log_probs.append(marginal_loglik)
-
-    return model, jnp.array(log_probs)
+    run = jit(partial(run_em, em_step, num_iters=num_iters, tol=tol, callback=callback))
+    model, log_probs, num_completed = run(model)
+    return model, log_probs[:num_completed]
 
 
 # def hmm_fit_sgd(hmm, batch_emissions, optimizer, num_iters=50):
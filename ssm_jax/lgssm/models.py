@@ -1,13 +1,18 @@
 from functools import partial
+from itertools import repeat
 
 from jax import numpy as jnp
 from jax import random as jr
-from jax import lax, vmap
+from jax import jit, lax, vmap
 from jax.tree_util import register_pytree_node_class, tree_map
 
 from distrax import MultivariateNormalFullCovariance as MVN
 
 from ssm_jax.lgssm.inference import lgssm_filter, lgssm_smoother
+from ssm_jax.lgssm.inference import lgssm_filter_parallel, lgssm_smoother_parallel
+from ssm_jax.lgssm.inference import lgssm_filter_init, lgssm_filter_update
+from ssm_jax.lgssm.inference import lgssm_filter_sqrt, lgssm_smoother_sqrt
+from ssm_jax.optimize import run_em
 from ssm_jax.utils import PSDToRealBijector
 
 
@@ -171,11 +176,41 @@ class LinearGaussianSSM:
         filtered_posterior = lgssm_filter(self, emissions, inputs)
         return filtered_posterior.marginal_loglik
 
-    def filter(self, emissions, inputs=None):
-        return lgssm_filter(self, emissions, inputs)
+    def filter(self, emissions, inputs=None, parallel=False, sqrt=False, steady_state=False):
+        if sqrt:
+            return lgssm_filter_sqrt(self, emissions, inputs)
+        if steady_state:
+            return lgssm_filter(self, emissions, inputs, steady_state=True)
+        filter_fn = lgssm_filter_parallel if parallel else lgssm_filter
+        return filter_fn(self, emissions, inputs)
+
+    def filter_stream(self, emissions_chunks, inputs_chunks=None, state=None):
+        """Run the Kalman filter on a stream of emissions, one chunk at a time,
+        without re-filtering the history.
+
+        Args:
+            emissions_chunks: iterable of (T_i, D_obs) emission arrays.
+            inputs_chunks: optional iterable of matching (T_i, D_in) input arrays.
+            state: KalmanFilterState to resume from. Defaults to the initial distribution.
+
+        Yields:
+            state (KalmanFilterState) and filtered posterior (LGSSMPosterior) for each chunk.
+        """
+        if state is None:
+            state = lgssm_filter_init(self)
+
+        if inputs_chunks is None:
+            inputs_chunks = repeat(None)
+
+        for emissions, inputs in zip(emissions_chunks, inputs_chunks):
+            state, posterior = lgssm_filter_update(self, state, emissions, inputs)
+            yield state, posterior
 
-    def smoother(self, emissions, inputs=None):
-        return lgssm_smoother(self, emissions, inputs)
+    def smoother(self, emissions, inputs=None, parallel=False, sqrt=False):
+        if sqrt:
+            return lgssm_smoother_sqrt(self, emissions, inputs)
+        smoother_fn = lgssm_smoother_parallel if parallel else lgssm_smoother
+        return smoother_fn(self, emissions, inputs)
 
     ### Expectation-maximization (EM) code
     def e_step(self, batch_emissions, batch_inputs=None):
@@ -280,6 +315,37 @@ class LinearGaussianSSM:
             emission_bias=d,
         )
 
+    @classmethod
+    def fit_em_restarts(cls, key, num_restarts, batch_emissions, state_dim, emission_dim, input_dim=0,
+                        num_iters=50, tol=None):
+        """Fit an LGSSM with EM from several random initializations at once, by
+        vmapping the compiled EM loop over a batch of models.
+
+        Returns:
+            model: the fitted model with the highest final marginal log likelihood.
+            log_probs: (num_restarts, num_iters) marginal log likelihoods of each
+                restart, NaN after that restart converged.
+        """
+        keys = jr.split(key, num_restarts)
+        init_fn = lambda key: cls.random_initialization(key, state_dim, emission_dim, input_dim)
+        batch_params = vmap(lambda key: init_fn(key).unconstrained_params)(keys)
+        hypers = init_fn(keys[0]).hyperparams
+
+        def em_step(model):
+            posterior_stats, marginal_loglikes = model.e_step(batch_emissions)
+            return model.m_step(posterior_stats), marginal_loglikes.sum()
+
+        def run(params):
+            model = cls.from_unconstrained_params(params, hypers)
+            model, log_probs, num_completed = run_em(em_step, model, num_iters=num_iters, tol=tol)
+            return model.unconstrained_params, log_probs, num_completed
+
+        batch_params, log_probs, num_completed = jit(vmap(run))(batch_params)
+
+        final_log_probs = log_probs[jnp.arange(num_restarts), num_completed - 1]
+        best = jnp.nanargmax(final_log_probs)
+        return cls.from_unconstrained_params(tree_map(lambda x: x[best], batch_params), hypers), log_probs
+
     # Properties to allow unconstrained optimization and JAX jitting
     @property
     def unconstrained_params(self):
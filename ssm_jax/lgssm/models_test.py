@@ -0,0 +1,58 @@
+from jax import random as jr
+from jax import numpy as jnp
+from jax import vmap
+
+from ssm_jax.lgssm.learning import lgssm_fit_em
+from ssm_jax.lgssm.models import LinearGaussianSSM
+
+
+def test_filter_stream(num_timesteps=40, seed=0, chunk_lengths=(1, 9, 30)):
+    k1, k2, k3, k4 = jr.split(jr.PRNGKey(seed), 4)
+    state_dim, emission_dim, input_dim = 3, 2, 1
+    lgssm = LinearGaussianSSM.random_initialization(k1, state_dim, emission_dim, input_dim)
+    lgssm.dynamics_input_weights = jr.normal(k2, (state_dim, input_dim))
+    lgssm.emission_input_weights = jr.normal(k3, (emission_dim, input_dim))
+    inputs = jr.normal(k4, (num_timesteps, input_dim))
+    _, emissions = lgssm.sample(jr.PRNGKey(seed + 1), num_timesteps, inputs)
+    post = lgssm.filter(emissions, inputs)
+
+    # Stream the emissions and inputs from generators, one chunk at a time
+    starts = [sum(chunk_lengths[:i]) for i in range(len(chunk_lengths))]
+    emissions_chunks = (emissions[start:start + length] for start, length in zip(starts, chunk_lengths))
+    inputs_chunks = (inputs[start:start + length] for start, length in zip(starts, chunk_lengths))
+    outputs = list(lgssm.filter_stream(emissions_chunks, inputs_chunks))
+    assert len(outputs) == len(chunk_lengths)
+
+    # The concatenated chunk outputs match filtering the whole sequence
+    state = outputs[-1][0]
+    filtered_means = jnp.concatenate([chunk_post.filtered_means for _, chunk_post in outputs])
+    filtered_covs = jnp.concatenate([chunk_post.filtered_covariances for _, chunk_post in outputs])
+    assert jnp.allclose(filtered_means, post.filtered_means, atol=1e-5)
+    assert jnp.allclose(filtered_covs, post.filtered_covariances, atol=1e-5)
+    assert jnp.allclose(state.marginal_loglik, post.marginal_loglik, rtol=1e-5)
+
+    # Without inputs, the chunks can also come from a generator
+    _, emissions = lgssm.sample(jr.PRNGKey(seed + 2), num_timesteps)
+    post = lgssm.filter(emissions)
+    emissions_chunks = (emissions[start:start + length] for start, length in zip(starts, chunk_lengths))
+    state, _ = list(lgssm.filter_stream(emissions_chunks))[-1]
+    assert jnp.allclose(state.marginal_loglik, post.marginal_loglik, rtol=1e-5)
+
+
+def test_fit_em_restarts(seed=0, state_dim=2, emission_dim=3, num_samples=4, num_restarts=3, num_iters=5):
+    init_key, sample_key, restart_key = jr.split(jr.PRNGKey(seed), 3)
+    lgssm = LinearGaussianSSM.random_initialization(init_key, state_dim, emission_dim)
+    keys = jr.split(sample_key, num_samples)
+    _, batch_emissions = vmap(lambda key: lgssm.sample(key, 20))(keys)
+
+    best_model, log_probs = LinearGaussianSSM.fit_em_restarts(restart_key, num_restarts, batch_emissions,
+                                                              state_dim, emission_dim, num_iters=num_iters)
+    assert isinstance(best_model, LinearGaussianSSM)
+    assert log_probs.shape == (num_restarts, num_iters)
+    assert jnp.all(jnp.isfinite(log_probs))
+
+    # Each restart matches fitting its initialization on its own
+    for i, key in enumerate(jr.split(restart_key, num_restarts)):
+        model = LinearGaussianSSM.random_initialization(key, state_dim, emission_dim)
+        _, single_log_probs = lgssm_fit_em(model, batch_emissions, num_iters=num_iters)
+        assert jnp.allclose(single_log_probs, log_probs[i], rtol=1e-4)
@@ -1,7 +1,7 @@
 import jax.numpy as jnp
 import jax.random as jr
 import optax
-from jax import lax, value_and_grad
+from jax import debug, jit, lax, value_and_grad
 from jax.tree_util import tree_map, tree_leaves
 
 
@@ -9,12 +9,17 @@ def _get_dataset_len(dataset):
     return len(tree_leaves(dataset)[0])
 
 
-def _sample_minibatches(key, dataset, batch_size, shuffle):
-    """Sequence generator."""
-    n_data = _get_dataset_len(dataset)
-    perm = jnp.where(shuffle, jr.permutation(key, n_data), jnp.arange(n_data))
-    for idx in range(0, n_data, batch_size):
-        yield tree_map(lambda x: x[perm[idx:min(idx + batch_size, n_data)]], dataset)
+def _minibatch_indices(key, num_data, batch_size, shuffle):
+    """Split a (shuffled) permutation of the data into fixed-size minibatches.
+    If batch_size does not divide num_data, the last minibatch wraps around to
+    the start of the permutation so that all minibatches have the same shape.
+
+    Returns:
+        (num_batches, batch_size) array of indices into the dataset.
+    """
+    num_batches = -(-num_data // batch_size)
+    perm = jr.permutation(key, num_data) if shuffle else jnp.arange(num_data)
+    return perm[jnp.arange(num_batches * batch_size) % num_data].reshape(num_batches, batch_size)
 
 
 def run_sgd(loss_fn,
@@ -32,6 +37,10 @@ def run_sgd(loss_fn,
     of entire sequence, not time steps, is sampled at each step where B is
     batch size.
 
+    The dataset is an argument of the compiled training loop rather than a
+    constant baked into it, and minibatches are gathered on device from a
+    permutation drawn each epoch.
+
     Args:
         loss_fn (Callable): Objective function.
         params (PyTree): initial value of parameters to be estimated.
@@ -46,34 +55,69 @@ def run_sgd(loss_fn,
         hmm: HMM with optimized parameters.
         losses: Output of loss_fn stored at each step.
     """
-    opt_state = optimizer.init(params)
-    num_complete_batches, leftover = jnp.divmod(len(dataset), batch_size)
-    num_batches = num_complete_batches + jnp.where(leftover == 0, 0, 1)
+    num_data = _get_dataset_len(dataset)
+    batch_size = min(batch_size, num_data)
     loss_grad_fn = value_and_grad(loss_fn)
 
-    if batch_size >= _get_dataset_len(dataset):
-        shuffle = False
-
-    def train_step(carry, key):
+    def train_step(carry, key, dataset):
         params, opt_state = carry
-        sample_generator = _sample_minibatches(key, dataset, batch_size, shuffle)
+        batch_indices = _minibatch_indices(key, num_data, batch_size, shuffle)
 
-        def cond_fun(state):
-            itr, params, opt_state, avg_loss = state
-            return itr < num_batches
-
-        def body_fun(state):
-            itr, params, opt_state, avg_loss = state
-            minibatch = next(sample_generator)  ## TODO: Does this work inside while_loop??
+        def body_fun(carry, indices):
+            params, opt_state = carry
+            minibatch = tree_map(lambda x: jnp.take(x, indices, axis=0), dataset)
             this_loss, grads = loss_grad_fn(params, minibatch)
             updates, opt_state = optimizer.update(grads, opt_state)
             params = optax.apply_updates(params, updates)
-            return itr + 1, params, opt_state, (avg_loss * itr + this_loss) / (itr + 1)
+            return (params, opt_state), this_loss
+
+        (params, opt_state), batch_losses = lax.scan(body_fun, (params, opt_state), batch_indices)
+        return (params, opt_state), batch_losses.mean()
+
+    @jit
+    def train(params, dataset, keys):
+        carry = (params, optimizer.init(params))
+        (params, _), losses = lax.scan(lambda carry, key: train_step(carry, key, dataset), carry, keys)
+        return params, losses
+
+    return train(params, dataset, jr.split(key, num_epochs))
+
+
+def run_em(em_step, params, num_iters=50, tol=None, callback=None):
+    """Run EM on device, with all iterations inside a single `lax.while_loop`.
+
+    Args:
+        em_step (Callable): function mapping params to updated params and the
+            log probability of the data under the old params.
+        params (PyTree): initial value of parameters to be estimated.
+        num_iters (int): maximum number of EM iterations.
+        tol (float, optional): stop once the log probability changes by less
+            than `tol` times its magnitude. If None, run all `num_iters`.
+        callback (Callable, optional): host function called as
+            `callback(itr, log_prob)` after each iteration, e.g. for progress.
+
+    Returns:
+        params: estimated parameters.
+        log_probs: (num_iters,) log probabilities, NaN after convergence.
+        num_completed: number of iterations that were run.
+    """
+    def cond_fun(state):
+        itr, params, log_probs, converged = state
+        return (itr < num_iters) & ~converged
+
+    def body_fun(state):
+        itr, params, log_probs, _ = state
+        params, lp = em_step(params)
+        if callback is not None:
+            debug.callback(callback, itr, lp)
 
-        init_val = (0, params, opt_state, 0.0)
-        _, params, opt_state, avg_loss = lax.while_loop(cond_fun, body_fun, init_val)
-        return (params, opt_state), avg_loss
+        if tol is None:
+            converged = False
+        else:
+            prev_lp = log_probs[itr - 1]
+            converged = (itr > 0) & (jnp.abs(lp - prev_lp) <= tol * jnp.abs(prev_lp))
+        return itr + 1, params, log_probs.at[itr].set(lp), converged
 
-    keys = jr.split(key, num_epochs)
-    (params, _), losses = lax.scan(train_step, (params, opt_state), keys)
-    return params, losses
+    init_val = (0, params, jnp.full(num_iters, jnp.nan), False)
+    num_completed, params, log_probs, _ = lax.while_loop(cond_fun, body_fun, init_val)
+    return params, log_probs, num_completed
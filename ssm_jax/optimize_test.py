@@ -0,0 +1,18 @@
+import jax.numpy as jnp
+import jax.random as jr
+import optax
+
+from ssm_jax.optimize import run_sgd
+
+
+def test_run_sgd_minibatches(key=jr.PRNGKey(0), num_data=10, batch_size=2):
+    # The minimizer of the average squared distance to the data is their mean,
+    # which SGD only finds if the minibatches cover the whole dataset.
+    data = jr.normal(key, (num_data,)) + jnp.arange(num_data)
+    loss_fn = lambda params, minibatch: jnp.mean((params - minibatch)**2)
+
+    for shuffle in [False, True]:
+        params, losses = run_sgd(loss_fn, 0.0, data, optimizer=optax.sgd(1e-2), batch_size=batch_size,
+                                 num_epochs=500, shuffle=shuffle)
+        assert losses.shape == (500,)
+        assert jnp.allclose(params, data.mean(), atol=0.1)
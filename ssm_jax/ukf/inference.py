@@ -5,6 +5,7 @@ from jax import vmap
 from jax import jacfwd
 from distrax import MultivariateNormalFullCovariance as MVN
 from ssm_jax.nlgssm.containers import NLGSSMPosterior
+from ssm_jax.utils import mask_missing_emission
 import chex
 
 
@@ -136,7 +137,8 @@ def _condition_on(m, P, h, R, lamb, w_mean, w_cov, u, y):
 
 def unscented_kalman_filter(params, emissions, hyperparams, inputs=None):
     """Run a unscented Kalman filter to produce the marginal likelihood and
-    filtered state estimates.
+    filtered state estimates. Missing entries of the emissions (NaN) are
+    skipped.
 
     Args:
         params: an NLGSSMParams instance (or object with the same fields)
@@ -172,13 +174,17 @@ def unscented_kalman_filter(params, emissions, hyperparams, inputs=None):
         u = inputs[t]
         y = emissions[t]
 
+        # Only condition on the observed (non-NaN) entries of this emission
+        observed, y, R, ll_correction = mask_missing_emission(y, R)
+        h_t = lambda x, u: jnp.where(observed, jnp.atleast_1d(h(x, u)), 0.0)
+
         # Condition on this emission
         log_likelihood, filtered_mean, filtered_cov = _condition_on(
-            pred_mean, pred_cov, h, R, lamb, w_mean, w_cov, u, y
+            pred_mean, pred_cov, h_t, R, lamb, w_mean, w_cov, u, y
         )
 
         # Update the log likelihood
-        ll += log_likelihood
+        ll += log_likelihood + ll_correction
 
         # Predict the next state
         pred_mean, pred_cov, _ = _predict(filtered_mean, filtered_cov, f, Q, lamb, w_mean, w_cov, u)
@@ -1,8 +1,11 @@
 import jax.numpy as jnp
+import jax.random as jr
 
-from ssm_jax.ukf.inference import unscented_kalman_smoother, UKFHyperParams
+from ssm_jax.lgssm.inference import lgssm_filter
+from ssm_jax.lgssm.models import LinearGaussianSSM
+from ssm_jax.ukf.inference import unscented_kalman_filter, unscented_kalman_smoother, UKFHyperParams
 from ssm_jax.nlgssm.sarkka_lib import ukf, uks
-from ssm_jax.nlgssm.inference_test import random_args
+from ssm_jax.nlgssm.inference_test import lgssm_to_nlgssm, random_args
 
 
 # Helper functions
@@ -24,4 +27,19 @@ def test_ukf_nonlinear(key=0, num_timesteps=15):
     assert _all_close(means_ukf, uks_post.filtered_means)
     assert _all_close(covs_ukf, uks_post.filtered_covariances)
     assert _all_close(means_uks, uks_post.smoothed_means)
-    assert _all_close(covs_uks, uks_post.smoothed_covariances)
\ No newline at end of file
+    assert _all_close(covs_uks, uks_post.smoothed_covariances)
+
+
+def test_ukf_missing(key=0, num_timesteps=15):
+    # A stable linear model, so the sigma-point covariances are well conditioned
+    lgssm = LinearGaussianSSM.random_initialization(jr.PRNGKey(key), 4, 3)
+    _, emissions = lgssm.sample(jr.PRNGKey(key + 1), num_timesteps)
+    emissions = emissions.at[::3, 1].set(jnp.nan).at[4].set(jnp.nan)
+
+    # The unscented transform is exact for a linear model, so only conditioning
+    # on the observed entries matches the Kalman filter
+    kf_post = lgssm_filter(lgssm, emissions)
+    ukf_post = unscented_kalman_filter(lgssm_to_nlgssm(lgssm), emissions, UKFHyperParams())
+    assert _all_close(kf_post.marginal_loglik, ukf_post.marginal_loglik)
+    assert _all_close(kf_post.filtered_means, ukf_post.filtered_means)
+    assert _all_close(kf_post.filtered_covariances, ukf_post.filtered_covariances)
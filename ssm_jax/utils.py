@@ -1,3 +1,4 @@
+import numpy as np
 import tensorflow_probability.substrates.jax.bijectors as tfb
 import jax.numpy as jnp
 from jax import vmap, jit
@@ -19,7 +20,7 @@ def pad_sequences(observations, valid_lens, pad_val=0):
     Pad ragged sequences to a fixed length.
     Parameters
     ----------
-    observations : array(N, seq_len)
+    observations : array(N, seq_len, ...)
         All observation sequences
     valid_lens : array(N, seq_len)
         Consists of the valid length of each observation sequence
@@ -33,7 +34,72 @@ def pad_sequences(observations, valid_lens, pad_val=0):
 
     def pad(seq, len):
         idx = jnp.arange(1, seq.shape[0] + 1)
-        return jnp.where(idx <= len, seq, pad_val)
+        valid = (idx <= len).reshape((-1,) + (1,) * (seq.ndim - 1))
+        return jnp.where(valid, seq, pad_val)
 
     dataset = vmap(pad, in_axes=(0, 0))(observations, valid_lens), valid_lens
     return dataset
+
+
+def bucket_by_length(lengths, num_buckets):
+    """
+    Group ragged sequences into buckets of similar length, so that each bucket
+    only needs to be padded to its own longest sequence.
+    Parameters
+    ----------
+    lengths : array(N,)
+        Valid length of each sequence. Must be concrete (not traced).
+    num_buckets : int
+        Number of buckets. Sequences are sorted by length and split into
+        buckets with (nearly) equal numbers of sequences.
+    Returns
+    -------
+    * array(N,)
+        Permutation that sorts the sequences by length
+    * tuple
+        Number of sequences in each bucket
+    * tuple
+        Padded length of each bucket
+    """
+    lengths = np.asarray(lengths)
+    order = np.argsort(lengths, kind="stable")
+    buckets = [bucket for bucket in np.array_split(order, num_buckets) if len(bucket) > 0]
+    bucket_sizes = tuple(len(bucket) for bucket in buckets)
+    bucket_lengths = tuple(int(lengths[bucket].max()) for bucket in buckets)
+    return order, bucket_sizes, bucket_lengths
+
+
+def mask_missing_emission(emission, emission_covariance):
+    """
+    Prepare a partially observed emission for conditioning a Gaussian filter.
+    Missing entries are NaN. Conditioning on the observed entries only is
+    equivalent to conditioning on the full emission after setting the missing
+    entries and the matching rows of the emission function to zero, and making
+    the emission covariance the identity on (and uncorrelated with) the
+    missing entries. Each missing entry then adds log N(0 | 0, 1) to the log
+    likelihood, which the returned correction cancels. The shapes never
+    depend on the data, so this works under jit.
+    Parameters
+    ----------
+    emission : array(D_obs,)
+        Emission, with NaN for missing entries
+    emission_covariance : array(D_obs, D_obs)
+        Emission covariance
+    Returns
+    -------
+    * array(D_obs,)
+        Boolean mask of the observed entries
+    * array(D_obs,)
+        Emission with the missing entries set to zero
+    * array(D_obs, D_obs)
+        Masked emission covariance
+    * float
+        Correction to add to the log likelihood
+    """
+    emission = jnp.atleast_1d(emission)
+    observed = ~jnp.isnan(emission)
+    emission = jnp.where(observed, emission, 0.0)
+    both_observed = observed[:, None] & observed[None, :]
+    emission_covariance = jnp.where(both_observed, emission_covariance, jnp.eye(len(emission)))
+    ll_correction = 0.5 * jnp.sum(~observed) * jnp.log(2 * jnp.pi)
+    return observed, emission, emission_covariance, ll_correction